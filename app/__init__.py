@@ -30,6 +30,19 @@ except Exception:
 # duplicate import is no longer needed and has been removed to avoid any
 # confusion.
 
+try:
+    from .leader import LEASE_TTL, LeaderElection
+except Exception:
+    LeaderElection = None  # type: ignore
+
+from .realtime import socketio_options
+
+try:
+    from .recalc import RecalcEngine
+    from .utils.points import get_matrix_provider
+except Exception:
+    RecalcEngine = None  # type: ignore
+
 try:
     from .admin.routes import init_admin
 except Exception:
@@ -40,6 +53,11 @@ try:
 except Exception:
     init_socket_events = None  # type: ignore
 
+try:
+    from .metrics import init_metrics
+except Exception:
+    init_metrics = None  # type: ignore
+
 try:
     from services.paypal_webhook import init_paypal_webhook
 except Exception:
@@ -62,8 +80,9 @@ def create_app():
     # "google" already being registered.  Removing the early registration keeps
     # the blueprint setup in a single place.
 
-    from . import routes
+    from . import routes, cli
     routes.init_app(app)
+    cli.init_app(app)
     if init_paypal_webhook:
         try:
             init_paypal_webhook(app)
@@ -76,6 +95,15 @@ def create_app():
             session_factory = init_db()
         except Exception as exc:  # pragma: no cover - optional dependency
             app.logger.warning("Database unavailable: %s", exc)
+    if session_factory is not None:
+        # Hand each request's thread-local session back to the pool
+        @app.teardown_appcontext
+        def _remove_db_session(exc=None):
+            session_factory.remove()
+
+    # Off unless METRICS_ENABLED is set; then requests, queries and the
+    # background jobs are timed and served at /metrics.
+    metrics = init_metrics(app, session_factory) if init_metrics else None
 
     google_bp = None
     if make_google_blueprint is not None:
@@ -101,21 +129,50 @@ def create_app():
         except Exception as exc:  # pragma: no cover - optional dependency
             app.logger.warning("Admin init failed: %s", exc)
 
+    # Only one worker process runs the background jobs; the others take over
+    # if its lease expires.
+    election = None
+    if LeaderElection is not None and session_factory is not None:
+        election = LeaderElection(
+            session_factory,
+            ttl=float(os.environ.get("LEADER_LEASE_TTL", LEASE_TTL)),
+        )
+
+    recalc_engine = None
+    if RecalcEngine is not None and session_factory is not None:
+        recalc_engine = RecalcEngine(
+            session_factory,
+            backend=os.environ.get("RECALC_BACKEND", "thread"),
+            provider=get_matrix_provider(app),
+        )
+
     socketio = None
     if SocketIO:
-        socketio = SocketIO(app)
+        # With a message queue, emits from any process (including the
+        # scheduler thread of the leader) reach clients of every worker.
+        message_queue = os.environ.get("SOCKETIO_MESSAGE_QUEUE")
+        socketio = SocketIO(app, **socketio_options(message_queue))
         if init_scheduler and session_factory is not None:
             try:
-                init_scheduler(app, session_factory, socketio)
+                init_scheduler(
+                    app,
+                    session_factory,
+                    socketio,
+                    election=election,
+                    recalc_engine=recalc_engine,
+                )
             except Exception as exc:  # pragma: no cover
                 app.logger.warning("Scheduler failed: %s", exc)
         if init_socket_events and session_factory is not None:
             try:
-                init_socket_events(app, session_factory, socketio)
+                init_socket_events(app, session_factory, socketio, election=election)
             except Exception as exc:  # pragma: no cover
                 app.logger.warning("Socket events failed: %s", exc)
 
     app.session_factory = session_factory
+    app.leader_election = election
+    app.recalc_engine = recalc_engine
+    app.metrics = metrics
     app.socketio = socketio
     app.google_bp = google_bp
 
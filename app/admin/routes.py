@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import Callable, Any
 
-from flask import session
+from flask import flash, session
 
 try:
     from flask_admin import Admin
@@ -11,7 +11,7 @@ except Exception:  # pragma: no cover - optional dependency
     Admin = None  # type: ignore
     ModelView = object  # type: ignore
 
-from ..models import PointsMatrix, EventType
+from ..models import PointsMatrix, PointsRecalcJob, EventType
 from ..tasks import schedule_points_recalc
 
 
@@ -25,7 +25,22 @@ class PointsMatrixAdmin(ModelView):
         etype = model.event_type
         if isinstance(etype, EventType):
             etype = etype.name
-        schedule_points_recalc(etype)
+        job_id = schedule_points_recalc(etype)
+        if job_id is not None:
+            flash(f"Points recalculation #{job_id} queued for {etype}", "info")
+
+
+class RecalcJobAdmin(ModelView):
+    """Read-only progress of points recalculation jobs."""
+
+    can_create = False
+    can_edit = False
+    can_delete = False
+    column_list = ["id", "event_type", "status", "processed", "total", "error", "updated_at"]
+    column_default_sort = ("id", True)
+
+    def is_accessible(self) -> bool:  # pragma: no cover - simple session check
+        return session.get("role") == "ROLE_ADMIN"
 
 
 def init_admin(app, session_factory: Callable[[], Any] | None):
@@ -33,5 +48,7 @@ def init_admin(app, session_factory: Callable[[], Any] | None):
     if Admin is None or session_factory is None:
         return None
     admin = Admin(app, name="Admin", template_mode="bootstrap3")
-    admin.add_view(PointsMatrixAdmin(PointsMatrix, session_factory()))
+    # The scoped session registry gives every request thread its own session
+    admin.add_view(PointsMatrixAdmin(PointsMatrix, session_factory))
+    admin.add_view(RecalcJobAdmin(PointsRecalcJob, session_factory, name="Recalc jobs"))
     return admin
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+points_cli = AppGroup("points", help="Points ledger maintenance commands.")
+giveaway_cli = AppGroup("giveaway", help="Giveaway commands.")
+engagements_cli = AppGroup("engagements", help="Engagement storage commands.")
+
+
+def _session_factory():
+    session_factory = getattr(current_app, "session_factory", None)
+    if session_factory is None:
+        raise click.ClickException("Database is not configured")
+    return session_factory
+
+
+@points_cli.command("rebuild-balances")
+@click.option("--verify", is_flag=True, help="Only report drift, do not fix it.")
+def rebuild_balances_command(verify: bool) -> None:
+    """Recompute per-user balances from the points ledger."""
+    from .utils.points import rebuild_points_balances
+
+    session = _session_factory()()
+    try:
+        drift = rebuild_points_balances(session, apply=not verify)
+    finally:
+        session.close()
+    for user_id, (stored, expected) in sorted(drift.items()):
+        click.echo(f"user {user_id}: stored={stored} ledger={expected}")
+    action = "found" if verify else "fixed"
+    click.echo(f"{len(drift)} drifted balance(s) {action}")
+    if verify and drift:
+        raise SystemExit(1)
+
+
+@points_cli.command("recalc")
+@click.argument("event_type")
+def recalc_command(event_type: str) -> None:
+    """Recalculate points for EVENT_TYPE under the current matrix, in-process."""
+    from .models import EventType
+    from .recalc import RecalcEngine
+    from .utils.points import get_matrix_provider
+
+    if event_type.upper() not in EventType.__members__:
+        raise click.BadParameter(f"unknown event type {event_type!r}")
+    engine = RecalcEngine(_session_factory(), provider=get_matrix_provider(current_app))
+    job_id = engine.submit(event_type.upper(), dispatch=False)
+    engine.run(job_id)
+    progress = engine.progress(job_id)
+    click.echo(
+        f"job {job_id}: {progress['status']} "
+        f"({progress['processed']}/{progress['total']} users)"
+    )
+    if progress["status"] != "done":
+        raise SystemExit(1)
+
+
+@points_cli.command("backfill-rollups")
+@click.option("--chunk-size", type=int, default=10_000, show_default=True, help="Ledger rows per commit.")
+def backfill_rollups_command(chunk_size: int) -> None:
+    """Build hourly/daily rollups from ledger rows that predate them."""
+    from .rollups import backfill_rollups
+
+    session = _session_factory()()
+    try:
+        state = None
+        for state in backfill_rollups(session, chunk_size=chunk_size):
+            click.echo(f"rolled up ledger ids {state.backfilled_id}/{state.start_id}")
+    finally:
+        session.close()
+    click.echo("rollups are complete" if state is not None else "nothing to backfill")
+
+
+@points_cli.command("compact-ledger")
+@click.option("--older-than", "days", type=float, required=True, help="Age in days of the rows to fold.")
+@click.option("--chunk-size", type=int, default=1000, show_default=True, help="Users per commit.")
+def compact_ledger_command(days: float, chunk_size: int) -> None:
+    """Fold old ledger rows into one checkpoint row per user."""
+    from datetime import datetime, timedelta
+
+    from .compaction import compact_ledger
+
+    session = _session_factory()()
+    try:
+        removed = compact_ledger(
+            session, datetime.utcnow() - timedelta(days=days), chunk_size=chunk_size
+        )
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+    finally:
+        session.close()
+    click.echo(f"{removed} ledger row(s) compacted")
+
+
+@engagements_cli.command("archive")
+@click.option("--older-than", "days", type=float, required=True, help="Age in days of the engagements to archive.")
+@click.option("--vacuum", is_flag=True, help="Return the freed space to the OS (SQLite).")
+def archive_command(days: float, vacuum: bool) -> None:
+    """Move old engagements' raw activity JSON into the archive."""
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import text
+
+    from .compaction import archive_engagements, get_archive
+
+    session_factory = _session_factory()
+    session = session_factory()
+    try:
+        for segment in archive_engagements(
+            session, get_archive(current_app), datetime.utcnow() - timedelta(days=days)
+        ):
+            click.echo(f"wrote {segment}")
+    finally:
+        session.close()
+    engine = session_factory.get_bind()
+    if vacuum and engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+
+
+@engagements_cli.command("compact")
+@click.option("--batch-size", type=int, default=10_000, show_default=True, help="Rows per commit.")
+def compact_command(batch_size: int) -> None:
+    """Convert engagements stored as raw JSON to the compact encoding."""
+    from .compaction import compact_activities
+
+    session = _session_factory()()
+    rows = json_bytes = compact_bytes = 0
+    try:
+        for batch in compact_activities(session, batch_size=batch_size):
+            rows += batch[0]
+            json_bytes += batch[1]
+            compact_bytes += batch[2]
+            click.echo(f"{rows} row(s) converted")
+    finally:
+        session.close()
+    if rows:
+        click.echo(
+            f"{json_bytes / rows:.0f} -> {compact_bytes / rows:.0f} bytes per row, "
+            f"{(json_bytes - compact_bytes) / rows:.0f} saved"
+        )
+
+
+@engagements_cli.command("show")
+@click.argument("engagement_id", type=int)
+def show_command(engagement_id: int) -> None:
+    """Print the stored activity of an engagement, archived or not."""
+    import json
+
+    from .compaction import get_archive, load_activity
+
+    session = _session_factory()()
+    try:
+        activity = load_activity(session, engagement_id, get_archive(current_app))
+    finally:
+        session.close()
+    if activity is None:
+        raise click.ClickException(f"No stored activity for engagement {engagement_id}")
+    click.echo(json.dumps(activity, indent=2))
+
+
+@giveaway_cli.command("draw")
+@click.argument("giveaway")
+@click.option("--count", type=int, default=1, show_default=True, help="Winners to draw.")
+@click.option("--seed", type=int, help="Seed to draw with; a new draw needs an unused one.")
+@click.option(
+    "--window",
+    type=click.Choice(["all", "week", "episode"]),
+    default="all",
+    show_default=True,
+    help="Weight by all-time points or by points earned in the window.",
+)
+@click.option("--since", type=click.DateTime(), help="Window start of the draw to audit; overrides --window.")
+@click.option("--dry-run", is_flag=True, help="Draw without saving winners, e.g. to audit an earlier draw.")
+def draw_command(giveaway: str, count: int, seed, window: str, since, dry_run: bool) -> None:
+    """Draw points-weighted winners for GIVEAWAY and print the audit record."""
+    import json
+
+    from .giveaway import draw_winners
+    from .leaderboard import window_start
+
+    if since is None:
+        try:
+            since = window_start(
+                window, episode_start=current_app.config.get("LEADERBOARD_EPISODE_START")
+            )
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+    session = _session_factory()()
+    try:
+        draw = draw_winners(session, giveaway, count, seed=seed, since=since, dry_run=dry_run)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    finally:
+        session.close()
+    click.echo(json.dumps(draw, indent=2))
+
+
+def init_app(app) -> None:
+    app.cli.add_command(points_cli)
+    app.cli.add_command(giveaway_cli)
+    app.cli.add_command(engagements_cli)
@@ -0,0 +1,330 @@
+"""Compaction of old points history and archiving of old activity payloads.
+
+Ledger rows older than a cutoff are folded into one ``CHECKPOINT`` row per
+user, so balances still equal the ledger sum while the rollups keep the
+hourly detail. The stored activity of old engagements is moved to
+compressed, append-only JSONL segments next to an offset index, and
+``load_activity`` reads it back from wherever it lives.
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, delete, func, insert, or_, select, update
+from sqlalchemy.orm import undefer
+
+from .models import CHECKPOINT_REASON, Engagement, PointsLedger
+from .rollups import rollups_complete
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None  # type: ignore
+
+ARCHIVE_DIR = "archive"
+# Engagements per compressed block; a lookup decompresses one block
+ARCHIVE_BLOCK = 256
+# Engagements per segment file and transaction
+ARCHIVE_BATCH = 10_000
+# Users whose ledger rows are folded per transaction
+COMPACT_CHUNK = 1_000
+
+logger = logging.getLogger(__name__)
+
+_CODECS = {
+    "gzip": (".jsonl.gz", gzip.compress, gzip.decompress),
+}
+if zstandard is not None:
+    _CODECS["zstd"] = (
+        ".jsonl.zst",
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+
+
+def _codec_for(segment: str):
+    for codec in _CODECS.values():
+        if segment.endswith(codec[0]):
+            return codec
+    raise ValueError(f"No codec available for archive segment {segment!r}")
+
+
+class EngagementArchive:
+    """Append-only store of engagement payloads, one file per archive run.
+
+    A segment is a series of independently compressed blocks of JSONL
+    records ``{"id", "activity"}`` in id order, so ``zcat`` reads it whole;
+    the ``.idx`` file beside it lists ``first_id last_id offset length`` per
+    block. Segments are written once, under a temporary name, and never
+    modified afterwards.
+    """
+
+    def __init__(self, directory: str = ARCHIVE_DIR, codec: str = "gzip", block_size: int = ARCHIVE_BLOCK):
+        if codec not in _CODECS:
+            raise ValueError(f"Unsupported archive codec {codec!r}")
+        self.directory = directory
+        self.codec = codec
+        self.block_size = block_size
+        self._indexes: Dict[str, Tuple[List[int], List[Tuple[int, int, int]]]] = {}
+        self._lock = threading.Lock()
+
+    def write_segment(self, records: Sequence[Tuple[int, Any]]) -> str:
+        """Write ``(engagement_id, activity)`` records and return the segment name."""
+        records = sorted(records, key=lambda record: record[0])
+        suffix, compress, _ = _CODECS[self.codec]
+        name = f"engagements-{records[0][0]:012d}-{records[-1][0]:012d}{suffix}"
+        os.makedirs(self.directory, exist_ok=True)
+        index_lines = []
+        offset = 0
+        data_fd, data_tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(data_fd, "wb") as data:
+            for start in range(0, len(records), self.block_size):
+                block = records[start:start + self.block_size]
+                payload = compress(
+                    "".join(
+                        json.dumps({"id": engagement_id, "activity": activity}) + "\n"
+                        for engagement_id, activity in block
+                    ).encode()
+                )
+                data.write(payload)
+                index_lines.append(f"{block[0][0]} {block[-1][0]} {offset} {len(payload)}\n")
+                offset += len(payload)
+            data.flush()
+            os.fsync(data.fileno())
+        index_fd, index_tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(index_fd, "w") as index:
+            index.writelines(index_lines)
+            index.flush()
+            os.fsync(index.fileno())
+        os.replace(index_tmp, os.path.join(self.directory, name + ".idx"))
+        os.replace(data_tmp, os.path.join(self.directory, name))
+        return name
+
+    def _index(self, segment: str):
+        with self._lock:
+            cached = self._indexes.get(segment)
+        if cached is not None:
+            return cached
+        firsts, blocks = [], []
+        with open(os.path.join(self.directory, segment + ".idx")) as index:
+            for line in index:
+                first, last, offset, length = (int(part) for part in line.split())
+                firsts.append(first)
+                blocks.append((last, offset, length))
+        with self._lock:
+            self._indexes[segment] = (firsts, blocks)
+        return firsts, blocks
+
+    def read(self, segment: str, engagement_id: int) -> Optional[Any]:
+        """Return the archived activity of ``engagement_id`` from ``segment``."""
+        _, _, decompress = _codec_for(segment)
+        firsts, blocks = self._index(segment)
+        position = bisect_right(firsts, engagement_id) - 1
+        if position < 0 or blocks[position][0] < engagement_id:
+            return None
+        _, offset, length = blocks[position]
+        with open(os.path.join(self.directory, segment), "rb") as data:
+            data.seek(offset)
+            block = decompress(data.read(length))
+        for line in block.splitlines():
+            record = json.loads(line)
+            if record["id"] == engagement_id:
+                return record["activity"]
+        return None
+
+
+def get_archive(app=None) -> EngagementArchive:
+    """Return the archive configured for ``app`` (or the current app)."""
+    if app is None:
+        from flask import current_app
+
+        app = current_app._get_current_object()
+    archive = getattr(app, "engagement_archive", None)
+    if archive is None:
+        archive = EngagementArchive(
+            app.config.get("ENGAGEMENT_ARCHIVE_DIR")
+            or os.environ.get("ENGAGEMENT_ARCHIVE_DIR", ARCHIVE_DIR),
+            codec=app.config.get("ENGAGEMENT_ARCHIVE_CODEC")
+            or os.environ.get("ENGAGEMENT_ARCHIVE_CODEC", "gzip"),
+        )
+        app.engagement_archive = archive
+    return archive
+
+
+def archive_engagements(
+    session, archive: EngagementArchive, before: datetime, batch_size: int = ARCHIVE_BATCH
+) -> Iterator[str]:
+    """Move the stored activity of engagements older than ``before`` to the archive.
+
+    Each batch becomes one segment and is cleared from the table in its own
+    transaction; yields the segment names. A run interrupted between the
+    two leaves an unreferenced segment, and the rows are archived again.
+    """
+    after = 0
+    while True:
+        engagements = (
+            session.query(Engagement)
+            .options(undefer(Engagement.activity_blob))
+            .filter(
+                Engagement.id > after,
+                Engagement.timestamp < before,
+                or_(Engagement.raw_json.is_not(None), Engagement.activity_blob.is_not(None)),
+            )
+            .order_by(Engagement.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not engagements:
+            return
+        segment = archive.write_segment(
+            [(engagement.id, engagement.activity) for engagement in engagements]
+        )
+        for engagement in engagements:
+            engagement.raw_json = None
+            engagement.activity_blob = None
+            engagement.archive_segment = segment
+        session.commit()
+        after = engagements[-1].id
+        yield segment
+
+
+def compact_activities(session, batch_size: int = ARCHIVE_BATCH) -> Iterator[Tuple[int, int, int]]:
+    """Convert engagements still stored as ``raw_json`` to the compact encoding.
+
+    Commits per batch, so it can be stopped and rerun at any time. Yields
+    ``(rows, json_bytes, compact_bytes)`` per batch, where the compact size
+    counts the blob plus the typed columns it moved out of the JSON.
+    """
+    after = 0
+    while True:
+        engagements = (
+            session.query(Engagement)
+            .filter(Engagement.id > after, Engagement.raw_json.is_not(None))
+            .order_by(Engagement.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not engagements:
+            return
+        before_bytes = after_bytes = converted = 0
+        for engagement in engagements:
+            try:
+                item = json.loads(engagement.raw_json)
+            except ValueError:
+                logger.warning("Engagement %s has unreadable raw_json; left as is", engagement.id)
+                continue
+            before_bytes += len(engagement.raw_json.encode())
+            engagement.activity = item
+            after_bytes += len(engagement.activity_blob) + len((engagement.channel_id or "").encode())
+            after_bytes += 8 if engagement.published_at is not None else 0
+            converted += 1
+        session.commit()
+        after = engagements[-1].id
+        yield converted, before_bytes, after_bytes
+
+
+def load_activity(session, engagement_id: int, archive: Optional[EngagementArchive] = None) -> Optional[Any]:
+    """Return the stored activity of an engagement, hot or archived."""
+    engagement = session.get(Engagement, engagement_id)
+    if engagement is None:
+        return None
+    activity = engagement.activity
+    if activity is not None or engagement.archive_segment is None:
+        return activity
+    return (archive or get_archive()).read(engagement.archive_segment, engagement_id)
+
+
+def compact_ledger(session, before: datetime, chunk_size: int = COMPACT_CHUNK) -> int:
+    """Fold each user's ledger rows older than ``before`` into a checkpoint row.
+
+    The checkpoint, dated ``before``, carries the sum of the rows it
+    replaces, so balances are untouched; the rollups already hold those
+    points per hour. Each engagement's share is kept in
+    ``Engagement.compacted_points`` for later recalculations. Windowed
+    queries that start or end mid-hour before ``before`` lose the minutes
+    at the edge. Returns the number of ledger rows removed.
+    """
+    if not rollups_complete(session):
+        raise RuntimeError("Run 'flask points backfill-rollups' before compacting the ledger")
+    last_id = session.execute(select(func.max(PointsLedger.id))).scalar() or 0
+    old = (PointsLedger.timestamp < before, PointsLedger.id <= last_id)
+    removed = 0
+    after = 0
+    while True:
+        users = session.execute(
+            select(PointsLedger.user_id, func.sum(PointsLedger.points_delta), func.count())
+            .where(*old, PointsLedger.user_id > after)
+            .group_by(PointsLedger.user_id)
+            .order_by(PointsLedger.user_id)
+            .limit(chunk_size)
+        ).all()
+        if not users:
+            return removed
+        after = users[-1][0]
+        # A single row is already as small as its checkpoint
+        users = [(user_id, points, count) for user_id, points, count in users if count > 1]
+        if not users:
+            continue
+        user_ids = [user_id for user_id, _, _ in users]
+        shares = session.execute(
+            select(PointsLedger.engagement_id, func.sum(PointsLedger.points_delta))
+            .where(*old, PointsLedger.user_id.in_(user_ids), PointsLedger.engagement_id.is_not(None))
+            .group_by(PointsLedger.engagement_id)
+        ).all()
+        if shares:
+            engagements = Engagement.__table__
+            session.execute(
+                update(engagements)
+                .where(engagements.c.id == bindparam("engagement_id"))
+                .values(
+                    compacted_points=func.coalesce(engagements.c.compacted_points, 0)
+                    + bindparam("points")
+                ),
+                [{"engagement_id": engagement_id, "points": points} for engagement_id, points in shares],
+            )
+        session.execute(delete(PointsLedger).where(*old, PointsLedger.user_id.in_(user_ids)))
+        checkpoints = [
+            {
+                "user_id": user_id,
+                "engagement_id": None,
+                "points_delta": points,
+                "reason": CHECKPOINT_REASON,
+                "timestamp": before,
+            }
+            for user_id, points, _ in users
+            if points
+        ]
+        if checkpoints:
+            session.execute(insert(PointsLedger), checkpoints)
+        session.commit()
+        removed += sum(count for _, _, count in users) - len(checkpoints)
+
+
+def compact_history(app, session_factory, retention_days: float) -> None:
+    """Scheduled job: compact the ledger and archive payloads past the retention.
+
+    Engagements still stored as ``raw_json`` are converted afterwards.
+    """
+    before = datetime.utcnow() - timedelta(days=retention_days)
+    session = session_factory()
+    try:
+        if not rollups_complete(session):
+            logger.warning("Points rollups are not backfilled yet; ledger left as is")
+        else:
+            removed = compact_ledger(session, before)
+            logger.info("Compacted %s ledger rows older than %s", removed, before)
+        segments = list(archive_engagements(session, get_archive(app), before))
+        logger.info("Archived engagements into %s segment(s)", len(segments))
+        converted = sum(rows for rows, _, _ in compact_activities(session))
+        if converted:
+            logger.info("Converted %s engagements to the compact encoding", converted)
+    finally:
+        session.close()
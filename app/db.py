@@ -1,19 +1,214 @@
 from __future__ import annotations
 
+import logging
+import os
+from typing import Any, Callable, Dict, Optional
+
 try:
-    from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy import create_engine, event, func, inspect, select, text
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.exc import IntegrityError
+    from sqlalchemy.orm import scoped_session, sessionmaker
 except Exception as e:  # pragma: no cover - optional dependency
     create_engine = None  # type: ignore
     sessionmaker = None  # type: ignore
 
-from .models import Base
+from .models import Base, PointsLedger, PointsRollupState, SchemaVersion, UserPointsBalance
+
+DEFAULT_DATABASE_URL = "sqlite:///app.db"
+
+# Bump whenever the models change and add the upgrade step to MIGRATIONS
+SCHEMA_VERSION = 9
+
+# Milliseconds a SQLite connection waits for a lock before failing
+SQLITE_BUSY_TIMEOUT = 5000
+
+logger = logging.getLogger(__name__)
+
+# Pool settings for server databases, overridable through DB_POOL_* variables
+POOL_DEFAULTS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+}
+
+
+def _is_memory(url) -> bool:
+    return url.database in (None, "", ":memory:") or url.database.startswith("file::memory:")
+
+
+def _engine_options(url, options: Dict[str, Any]) -> Dict[str, Any]:
+    if url.get_backend_name() == "sqlite":
+        # SQLite serializes writers itself; the pool just keeps connections open
+        return dict(options)
+    merged: Dict[str, Any] = {"pool_pre_ping": True}
+    for name, default in POOL_DEFAULTS.items():
+        env = os.environ.get(f"DB_{name.upper()}")
+        merged[name] = int(env) if env else default
+    merged.update(options)
+    return merged
+
+
+def _configure_sqlite(engine, busy_timeout: int, wal: bool) -> None:
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # Readers no longer block the writer (or each other) under WAL,
+            # and a busy writer makes others wait instead of raising
+            # "database is locked" straight away.
+            if wal:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        finally:
+            cursor.close()
+
+
+def schema_version(engine) -> Optional[int]:
+    """Return the stored schema version, or ``None`` for an empty database."""
+    with engine.connect() as conn:
+        if not inspect(conn).has_table(SchemaVersion.__tablename__):
+            return None
+        return conn.execute(select(SchemaVersion.version)).scalar()
+
+
+# Indexes for the hot lookups: (table, name, columns, unique)
+HOT_PATH_INDEXES = (
+    ("engagements", "uq_engagements_user_event", ("user_id", "event_id"), True),
+    ("engagements", "ix_engagements_event_type_user", ("event_type", "user_id"), False),
+    ("points_ledger", "ix_points_ledger_user_time", ("user_id", "timestamp"), False),
+    ("points_ledger", "ix_points_ledger_timestamp", ("timestamp",), False),
+    ("points_ledger", "ix_points_ledger_engagement", ("engagement_id",), False),
+    ("oauth", "uq_oauth_provider_user", ("provider", "user_id"), True),
+)
+
+
+def _indexed(inspector, table: str, columns) -> bool:
+    """Whether an index or unique constraint already covers exactly ``columns``."""
+    existing = inspector.get_indexes(table) + inspector.get_unique_constraints(table)
+    return any(tuple(entry["column_names"]) == tuple(columns) for entry in existing)
+
+
+def _add_hot_path_indexes(conn) -> None:
+    """Version 2: index the poller, ledger, leaderboard and OAuth lookups."""
+    inspector = inspect(conn)
+    for table_name, name, columns, unique in HOT_PATH_INDEXES:
+        if _indexed(inspector, table_name, columns):
+            continue
+        # Plain DDL: an Index built on the model tables would attach itself to
+        # the shared metadata and be created a second time by create_all.
+        ddl = "CREATE {}INDEX {} ON {} ({})".format(
+            "UNIQUE " if unique else "", name, table_name, ", ".join(columns)
+        )
+        try:
+            with conn.begin_nested():
+                conn.execute(text(ddl))
+        except IntegrityError as exc:
+            # Rows written before the constraint existed; leave them for an
+            # operator to merge rather than failing every app start.
+            logger.warning("Could not add unique index %s, duplicate rows: %s", name, exc)
 
 
-def init_db(url: str = "sqlite:///app.db"):
-    """Initialize the database and return a session factory."""
+def _add_missing_columns(table_name: str) -> Callable[[Any], None]:
+    """Build a step that adds the model's new (nullable) columns to ``table_name``."""
+
+    def step(conn) -> None:
+        existing = {column["name"] for column in inspect(conn).get_columns(table_name)}
+        for column in Base.metadata.tables[table_name].columns:
+            if column.name in existing:
+                continue
+            ddl = "ALTER TABLE {} ADD COLUMN {} {}".format(
+                table_name, column.name, column.type.compile(dialect=conn.dialect)
+            )
+            conn.execute(text(ddl))
+            for index in column.table.indexes:
+                if [c.name for c in index.columns] == [column.name]:
+                    conn.execute(text(f"CREATE INDEX {index.name} ON {table_name} ({column.name})"))
+
+    return step
+
+
+def _start_points_rollups(conn) -> None:
+    """Version 5: rollups cover new ledger rows; older ones await the backfill."""
+    start_id = conn.execute(select(func.max(PointsLedger.id))).scalar() or 0
+    conn.execute(PointsRollupState.__table__.delete())
+    conn.execute(
+        PointsRollupState.__table__.insert().values(id=1, start_id=start_id, backfilled_id=0)
+    )
+
+
+def _seed_points_balances(conn) -> None:
+    """Version 8: rebuild balances from the ledger.
+
+    Databases from before the balance table got an empty one on upgrade, so
+    users who earned points since have a row that misses their history.
+    """
+    balances = UserPointsBalance.__table__
+    sums = select(PointsLedger.user_id, func.sum(PointsLedger.points_delta)).group_by(
+        PointsLedger.user_id
+    )
+    conn.execute(balances.delete())
+    conn.execute(balances.insert().from_select(["user_id", "total"], sums))
+
+
+def _new_tables_only(conn) -> None:
+    """For versions that only add tables, which ``create_all`` has made already."""
+
+
+# version -> step that upgrades a database from ``version - 1``
+MIGRATIONS: Dict[int, Callable[[Any], None]] = {
+    2: _add_hot_path_indexes,
+    3: _new_tables_only,  # webhook_events
+    4: _add_missing_columns("giveaway_winners"),
+    5: _start_points_rollups,
+    6: _add_missing_columns("engagements"),
+    # Compact activity columns; rows are converted by 'flask engagements compact'
+    7: _add_missing_columns("engagements"),
+    8: _seed_points_balances,
+    9: _add_missing_columns("giveaway_winners"),  # seed
+}
+
+
+def ensure_schema(engine) -> bool:
+    """Create missing tables and run pending migrations.
+
+    A database without a ``schema_version`` row but with tables predates
+    versioning and is upgraded from version 1. Returns whether any work was
+    done; a current schema costs a single query.
+    """
+    version = schema_version(engine)
+    if version is not None and version >= SCHEMA_VERSION:
+        return False
+    if version is None:
+        with engine.connect() as conn:
+            legacy = inspect(conn).has_table("users")
+        version = 1 if legacy else SCHEMA_VERSION
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for step in range(version + 1, SCHEMA_VERSION + 1):
+            logger.info("Upgrading database schema to version %s", step)
+            MIGRATIONS[step](conn)
+        conn.execute(SchemaVersion.__table__.delete())
+        conn.execute(SchemaVersion.__table__.insert().values(version=SCHEMA_VERSION))
+    return True
+
+
+def init_db(url: Optional[str] = None, **engine_options: Any):
+    """Initialize the database and return a thread-local session registry.
+
+    ``url`` defaults to ``DATABASE_URL`` and then ``sqlite:///app.db``;
+    ``engine_options`` are passed to ``create_engine`` on top of the pool
+    defaults. Calling the returned ``scoped_session`` gives each thread its
+    own session; call ``remove()`` when a request or job is done with it.
+    """
     if create_engine is None or sessionmaker is None:
         raise RuntimeError("SQLAlchemy is not available")
-    engine = create_engine(url)
-    Base.metadata.create_all(engine)
-    return sessionmaker(bind=engine)
+    url = make_url(url or os.environ.get("DATABASE_URL") or DEFAULT_DATABASE_URL)
+    engine = create_engine(url, **_engine_options(url, engine_options))
+    if url.get_backend_name() == "sqlite":
+        busy_timeout = int(os.environ.get("SQLITE_BUSY_TIMEOUT", SQLITE_BUSY_TIMEOUT))
+        _configure_sqlite(engine, busy_timeout, wal=not _is_memory(url))
+    ensure_schema(engine)
+    return scoped_session(sessionmaker(bind=engine))
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import hashlib
+import heapq
+import math
+import random
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, or_, select
+
+from .models import GiveawayWinner, UserPointsBalance
+from .rollups import window_points
+
+# Rows fetched per round trip while streaming the eligible users
+STREAM_BATCH = 10_000
+
+
+def weighted_sample(
+    weights: Iterable[Tuple[Any, float]], k: int, rng: random.Random
+) -> List[Tuple[Any, float]]:
+    """Draw ``k`` distinct items with probability proportional to weight.
+
+    Efraimidis-Spirakis reservoir sampling: each item gets the key
+    ``u ** (1 / weight)`` and the ``k`` largest keys win. Only the reservoir
+    is kept in memory, so ``weights`` can be an arbitrarily long stream.
+    Items with a weight of zero or less never win. The same stream and
+    ``rng`` state always give the same winners, in descending key order.
+    """
+    if k <= 0:
+        return []
+    reservoir: List[Tuple[float, int, Any, float]] = []
+    for position, (item, weight) in enumerate(weights):
+        if weight <= 0:
+            continue
+        # log(u) / w orders like u ** (1 / w) without underflowing for big w
+        key = math.log(1.0 - rng.random()) / weight
+        entry = (key, position, item, weight)
+        if len(reservoir) < k:
+            heapq.heappush(reservoir, entry)
+        elif key > reservoir[0][0]:
+            heapq.heapreplace(reservoir, entry)
+    return [(item, weight) for _, _, item, weight in sorted(reservoir, reverse=True)]
+
+
+def _eligible_points(session, giveaway: str, since: Optional[datetime], seed: int):
+    """``(user_id, points)`` for users who may win, in ``user_id`` order.
+
+    The winners of the ``seed`` draw of ``giveaway`` itself stay eligible,
+    so an audit sees the users that draw was made from.
+    """
+    excluded = select(GiveawayWinner.user_id).where(
+        GiveawayWinner.user_id.is_not(None),
+        or_(GiveawayWinner.paid.is_(True), GiveawayWinner.giveaway == giveaway),
+        or_(
+            GiveawayWinner.giveaway.is_(None),
+            GiveawayWinner.giveaway != giveaway,
+            GiveawayWinner.seed.is_(None),
+            GiveawayWinner.seed != seed,
+        ),
+    )
+    if since is None:
+        return (
+            select(UserPointsBalance.user_id, UserPointsBalance.total)
+            .where(UserPointsBalance.total > 0, UserPointsBalance.user_id.not_in(excluded))
+            .order_by(UserPointsBalance.user_id)
+        )
+    window = window_points(session, since)
+    return (
+        select(window.c.user_id, window.c.points)
+        .where(window.c.points > 0, window.c.user_id.not_in(excluded))
+        .order_by(window.c.user_id)
+    )
+
+
+class _Snapshot:
+    """Counts and hashes the ``(user_id, points)`` stream a draw is made from."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.users = 0
+        self.digest = hashlib.sha256()
+
+    def __iter__(self):
+        for user_id, points in self.rows:
+            points = int(points)
+            self.users += 1
+            self.digest.update(f"{user_id}:{points}\n".encode())
+            yield user_id, points
+
+
+def draw_winners(
+    session,
+    giveaway: str,
+    count: int,
+    seed: Optional[int] = None,
+    since: Optional[datetime] = None,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Draw ``count`` winners for ``giveaway`` weighted by their points.
+
+    Weights are the all-time balances, or the points earned since ``since``
+    for a windowed giveaway, aggregated by the database and streamed in
+    ``user_id`` order. Users who were already paid, or already won this
+    giveaway, are not eligible. The winners are inserted as
+    ``GiveawayWinner`` rows in one statement and committed.
+
+    Returns ``{"giveaway", "seed", "since", "dry_run", "eligible": {"users",
+    "sha256"}, "winners": [{"user_id", "points"}]}``. ``eligible`` describes
+    the snapshot the winners were drawn from. With ``dry_run`` nothing is
+    written: repeating a draw that way with its ``seed`` and ``since``
+    yields the same winners as long as the snapshot hash matches, which is
+    what makes a draw auditable. Drawing for real with a seed this giveaway
+    was already drawn with raises ``ValueError``.
+    """
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 32)
+    elif not dry_run:
+        drawn = session.execute(
+            select(GiveawayWinner.id).where(
+                GiveawayWinner.giveaway == giveaway, GiveawayWinner.seed == seed
+            ).limit(1)
+        ).first()
+        if drawn is not None:
+            raise ValueError(
+                f"Giveaway {giveaway!r} was already drawn with seed {seed}; use a dry run to audit it"
+            )
+    rng = random.Random(seed)
+    result = session.execute(
+        _eligible_points(session, giveaway, since, seed),
+        execution_options={"yield_per": STREAM_BATCH},
+    )
+    snapshot = _Snapshot(result)
+    winners = weighted_sample(snapshot, count, rng)
+    result.close()
+
+    now = datetime.utcnow()
+    if winners and not dry_run:
+        session.execute(
+            insert(GiveawayWinner),
+            [
+                {
+                    # Sent as the payout item's sender_item_id, which webhooks echo back
+                    "payout_item_id": f"{giveaway}:{user_id}",
+                    "paid": False,
+                    "user_id": user_id,
+                    "giveaway": giveaway,
+                    "points": points,
+                    "seed": seed,
+                    "drawn_at": now,
+                }
+                for user_id, points in winners
+            ],
+        )
+    session.commit()
+    return {
+        "giveaway": giveaway,
+        "seed": seed,
+        "since": since.isoformat() if since is not None else None,
+        "dry_run": dry_run,
+        "eligible": {"users": snapshot.users, "sha256": snapshot.digest.hexdigest()},
+        "winners": [{"user_id": user_id, "points": points} for user_id, points in winners],
+    }
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from .models import LeaderLease
+
+# Seconds a lease stays valid without being renewed
+LEASE_TTL = 120
+
+
+class LeaderElection:
+    """Lease-based leader election through the shared database.
+
+    Every worker process calls ``acquire`` before doing leader-only work (the
+    engagement poller and the leaderboard broadcast). The call takes the
+    lease if it is free or expired, renews it if this process already holds
+    it, and returns whether this process is the leader. A leader that dies is
+    replaced once its lease runs out.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Any],
+        name: str = "background-jobs",
+        ttl: float = LEASE_TTL,
+        holder: Optional[str] = None,
+    ):
+        self.session_factory = session_factory
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self) -> bool:
+        now = datetime.utcnow()
+        values = {"holder": self.holder, "expires_at": now + timedelta(seconds=self.ttl)}
+        session = self.session_factory()
+        try:
+            taken = (
+                session.query(LeaderLease)
+                .filter(
+                    LeaderLease.name == self.name,
+                    or_(LeaderLease.holder == self.holder, LeaderLease.expires_at < now),
+                )
+                .update(values, synchronize_session=False)
+            )
+            if not taken:
+                if session.query(LeaderLease.name).filter_by(name=self.name).first():
+                    session.rollback()
+                    return False
+                session.add(LeaderLease(name=self.name, **values))
+            session.commit()
+            return True
+        except IntegrityError:
+            # Another process created the lease first
+            session.rollback()
+            return False
+        finally:
+            session.close()
+
+    def release(self) -> None:
+        session = self.session_factory()
+        try:
+            session.query(LeaderLease).filter_by(
+                name=self.name, holder=self.holder
+            ).delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
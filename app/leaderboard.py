@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from .models import User, UserPointsBalance
+from .rollups import window_points
+
+WINDOWS = ("all", "week", "episode")
+DEFAULT_SIZE = 10
+
+
+def window_start(
+    window: str,
+    now: Optional[datetime] = None,
+    episode_start: Optional[datetime] = None,
+) -> Optional[datetime]:
+    """Return the first timestamp counted by ``window`` (``None`` = all time)."""
+    if window == "all":
+        return None
+    if window == "week":
+        now = now or datetime.utcnow()
+        monday = now - timedelta(days=now.weekday())
+        return monday.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == "episode":
+        if episode_start is None:
+            raise ValueError("No episode start configured")
+        if isinstance(episode_start, str):
+            episode_start = datetime.fromisoformat(episode_start)
+        return episode_start
+    raise ValueError(f"Unknown leaderboard window {window!r}")
+
+
+def top_points(session, limit: int = DEFAULT_SIZE, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Return the top ``limit`` users by points using a single query.
+
+    All-time boards read the materialized balances; windowed boards sum the
+    points rollups from ``since`` on, plus the ledger rows in its first hour.
+    """
+    if since is None:
+        points = UserPointsBalance.total
+        query = (
+            session.query(User.username, points)
+            .join(User, User.id == UserPointsBalance.user_id)
+            .order_by(points.desc(), UserPointsBalance.user_id)
+        )
+    else:
+        window = window_points(session, since)
+        query = (
+            session.query(User.username, window.c.points)
+            .join(User, User.id == window.c.user_id)
+            .order_by(window.c.points.desc(), window.c.user_id)
+        )
+    return [
+        {"name": name, "points": int(total or 0)}
+        for name, total in query.limit(limit).all()
+    ]
+
+
+class LeaderboardCache:
+    """TTL cache shared by the JSON endpoint and the Socket.IO broadcast."""
+
+    def __init__(self, ttl: float = 15.0):
+        self.ttl = ttl
+        self._entries: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        session_factory: Callable[[], Any],
+        window: str = "all",
+        limit: int = DEFAULT_SIZE,
+        episode_start: Optional[datetime] = None,
+    ) -> List[Dict[str, Any]]:
+        since = window_start(window, episode_start=episode_start)
+        key = (window, limit, since)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        session = session_factory()
+        try:
+            board = top_points(session, limit=limit, since=since)
+        finally:
+            session.close()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, board)
+        return board
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class LeaderboardTracker:
+    """Remember the last broadcast board and turn new boards into diffs.
+
+    A board's ``version`` is a digest of its contents, so any process that
+    reads the same board gives it the same version. A diff lists only the
+    ranks whose entry changed plus the new board ``size``, and names the
+    ``base_version`` it was computed from; clients holding another board
+    must ask for a snapshot instead of applying it. A snapshot lists every
+    rank and has no base. The first board after a ``reset`` is sent as one.
+    """
+
+    def __init__(self):
+        self.board: List[Dict[str, Any]] = []
+        self.version = board_version(self.board)
+        self._fresh = True
+        self._lock = threading.Lock()
+
+    def update(self, board: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Record ``board`` and return its diff, or ``None`` if nothing changed."""
+        with self._lock:
+            if self._fresh:
+                self._fresh = False
+                self.board = list(board)
+                self.version = board_version(board)
+                return snapshot(self.board, self.version)
+            if board == self.board:
+                return None
+            previous, base = self.board, self.version
+            entries = [
+                dict(entry, rank=rank)
+                for rank, entry in enumerate(board, start=1)
+                if rank > len(previous) or previous[rank - 1] != entry
+            ]
+            self.board = list(board)
+            self.version = board_version(board)
+            return {"version": self.version, "base_version": base, "size": len(board), "entries": entries}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return snapshot(self.board, self.version)
+
+    def reset(self) -> None:
+        """Forget the last board, e.g. once another process broadcasts instead."""
+        with self._lock:
+            self.board = []
+            self.version = board_version(self.board)
+            self._fresh = True
+
+
+def board_version(board: List[Dict[str, Any]]) -> str:
+    """Short digest of ``board``; equal boards get equal versions."""
+    data = json.dumps(board, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+
+def snapshot(board: List[Dict[str, Any]], version: Optional[str] = None) -> Dict[str, Any]:
+    """Return ``board`` as a payload that lists every rank."""
+    return {
+        "version": board_version(board) if version is None else version,
+        "size": len(board),
+        "entries": [dict(entry, rank=rank) for rank, entry in enumerate(board, start=1)],
+    }
@@ -0,0 +1,247 @@
+"""Counters and timing histograms for the hot paths, in Prometheus text format.
+
+Instrumented code talks to the process-wide ``METRICS`` registry. It is off
+unless ``METRICS_ENABLED`` is set, and then every ``inc``/``observe``/
+``timed`` call is a single attribute check. ``init_metrics`` turns it on for
+an app, times every request and database query, and serves ``/metrics``.
+Each worker process keeps its own numbers.
+"""
+from __future__ import annotations
+
+import contextlib
+import functools
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from flask import Response, g, has_request_context, request
+
+# Seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Queries per request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_NULL_TIMER = contextlib.nullcontext()
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    parts = [
+        '{}="{}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    ]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """Thread-safe registry of labelled counters and histograms."""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._buckets: Dict[str, Sequence[float]] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str, buckets: Optional[Sequence[float]] = None) -> None:
+        self._help[name] = help_text
+        if buckets is not None:
+            self._buckets[name] = tuple(sorted(buckets))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(buckets)
+            for position, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram.counts[position] += 1
+                    break
+            histogram.sum += value
+            histogram.count += 1
+
+    def time(self, name: str, **labels):
+        """Context manager observing the seconds its block took."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timer(name, labels)
+
+    @contextlib.contextmanager
+    def _timer(self, name: str, labels: Dict[str, object]):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels):
+        """Decorator observing how long each call takes, errors included."""
+
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - started, **labels)
+
+            return wrapper
+
+        return decorate
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """The current values in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for name in sorted(self._histograms):
+                buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(buckets, histogram.counts):
+                        cumulative += count
+                        le = labels + (("le", _format_value(bound)),)
+                        lines.append(f"{name}_bucket{_format_labels(le)} {cumulative}")
+                    le = labels + (("le", "+Inf"),)
+                    lines.append(f"{name}_bucket{_format_labels(le)} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+for _name, _help, _buckets in (
+    ("http_request_duration_seconds", "Flask request handling time.", None),
+    ("http_request_db_queries", "Database queries run per request.", QUERY_COUNT_BUCKETS),
+    ("db_query_duration_seconds", "SQL statement execution time.", None),
+    ("youtube_poll_run_seconds", "Duration of a full _update_engagements run.", None),
+    ("youtube_poll_user_seconds", "YouTube calls made for one user in a poll.", None),
+    ("youtube_poll_failures_total", "Users whose poll failed.", None),
+    ("youtube_service_cache_hits_total", "Polls that reused a cached YouTube service.", None),
+    ("youtube_service_cache_misses_total", "Polls that had to build a YouTube service.", None),
+    ("points_apply_seconds", "apply_points / apply_points_bulk call time.", None),
+    ("channel_data_seconds", "get_channel_data call time.", None),
+    ("leaderboard_tick_seconds", "Time to compute and diff one leaderboard broadcast.", None),
+    ("socketio_emits_total", "Socket.IO messages emitted, by event.", None),
+):
+    METRICS.describe(_name, _help, _buckets)
+
+
+def _enabled(app) -> bool:
+    value = app.config.get("METRICS_ENABLED", os.environ.get("METRICS_ENABLED", ""))
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def _instrument_engine(engine, metrics: Metrics) -> None:
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _finished(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("metrics_started")
+        if not stack:
+            return
+        started = stack.pop()
+        metrics.observe("db_query_duration_seconds", time.perf_counter() - started)
+        if has_request_context():
+            g.metrics_queries = g.get("metrics_queries", 0) + 1
+
+
+def init_metrics(app, session_factory=None, metrics: Metrics = METRICS) -> Optional[Metrics]:
+    """Enable ``metrics`` for ``app`` when ``METRICS_ENABLED`` is set.
+
+    Times every request and, with ``session_factory``, every SQL statement
+    and the number of statements per request; serves the values at
+    ``/metrics``. Does nothing, and adds no hooks, when disabled.
+    """
+    if not _enabled(app):
+        return None
+    metrics.enabled = True
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            labels = {
+                "endpoint": request.endpoint or "unmatched",
+                "method": request.method,
+                "status": response.status_code,
+            }
+            metrics.observe("http_request_duration_seconds", time.perf_counter() - started, **labels)
+            metrics.observe(
+                "http_request_db_queries",
+                g.pop("metrics_queries", 0),
+                endpoint=labels["endpoint"],
+            )
+        return response
+
+    if session_factory is not None:
+        _instrument_engine(session_factory.get_bind(), metrics)
+
+    def metrics_endpoint():
+        return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule("/metrics", "metrics", metrics_endpoint)
+    return metrics
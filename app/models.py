@@ -1,16 +1,27 @@
 import enum
+import json
+import weakref
 from sqlalchemy import (
     Column,
+    BigInteger,
     Integer,
     ForeignKey,
     String,
     DateTime,
     Text,
+    LargeBinary,
     Enum,
     Boolean,
-    func,
+    Index,
+    UniqueConstraint,
+    event,
+    insert,
+    update,
 )
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, relationship, declarative_base, deferred
+
+from .utils.activity import pack_activity, unpack_activity
 
 Base = declarative_base()
 
@@ -37,17 +48,54 @@ class EventType(enum.Enum):
 
 class Engagement(Base):
     __tablename__ = 'engagements'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'event_id', name='uq_engagements_user_event'),
+        # Recalculation walks the users with engagements of one type
+        Index('ix_engagements_event_type_user', 'event_type', 'user_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     event_type = Column(Enum(EventType), nullable=False)
     event_id = Column(String, nullable=False)
     timestamp = Column(DateTime, nullable=False)
+    # Legacy full activity JSON; new rows use the columns below instead
     raw_json = Column(Text)
+    published_at = Column(DateTime)
+    channel_id = Column(String)
+    # Rest of the activity, see ``app.utils.activity``; only loaded when read
+    activity_blob = deferred(Column(LargeBinary))
+    # Points of this engagement folded into checkpoint rows by ledger compaction
+    compacted_points = Column(Integer)
+    # Archive segment holding ``raw_json`` once it has been moved out of the table
+    archive_segment = Column(String)
 
     user = relationship('User', back_populates='engagements')
     ledger_entries = relationship('PointsLedger', back_populates='engagement')
 
+    @property
+    def activity(self):
+        """The stored YouTube activity, decoded on first access.
+
+        ``None`` once the payload has been moved to the archive.
+        """
+        cached = self.__dict__.get("_activity")
+        if cached is not None and cached[0] is self.activity_blob:
+            return cached[1]
+        if self.activity_blob is not None:
+            item = unpack_activity(self.activity_blob, self.event_id, self.published_at, self.channel_id)
+            self.__dict__["_activity"] = (self.activity_blob, item)
+            return item
+        if self.raw_json is not None:
+            return json.loads(self.raw_json)
+        return None
+
+    @activity.setter
+    def activity(self, item: dict) -> None:
+        self.published_at, self.channel_id, self.activity_blob = pack_activity(item, self.event_id)
+        self.raw_json = None
+        self.__dict__["_activity"] = (self.activity_blob, item)
+
     def __repr__(self) -> str:
         return (
             f"<Engagement id={self.id} user_id={self.user_id} "
@@ -55,8 +103,20 @@ class Engagement(Base):
         )
 
 
+# Ledger reason of the rows that stand in for compacted history; their points
+# are already in the rollups under the original reasons
+CHECKPOINT_REASON = 'CHECKPOINT'
+
+
 class PointsLedger(Base):
     __tablename__ = 'points_ledger'
+    __table_args__ = (
+        # Per-user sums (balance rebuilds) and per-user history
+        Index('ix_points_ledger_user_time', 'user_id', 'timestamp'),
+        # Windowed leaderboards scan only rows newer than the window start
+        Index('ix_points_ledger_timestamp', 'timestamp'),
+        Index('ix_points_ledger_engagement', 'engagement_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -87,10 +147,28 @@ class PointsMatrix(Base):
         return f"<PointsMatrix event_type={self.event_type.name} value={self.value}>"
 
 
+class PointsMatrixVersion(Base):
+    """Counter bumped in the same transaction as any ``PointsMatrix`` change.
+
+    Matrix caches in every process compare it to the version they loaded.
+    """
+
+    __tablename__ = "points_matrix_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<PointsMatrixVersion version={self.version}>"
+
+
 class OAuth(Base):
     """Minimal token storage compatible with Flask-Dance."""
 
     __tablename__ = 'oauth'
+    __table_args__ = (
+        UniqueConstraint('provider', 'user_id', name='uq_oauth_provider_user'),
+    )
 
     id = Column(Integer, primary_key=True)
     provider = Column(String, nullable=False)
@@ -105,14 +183,86 @@ class OAuth(Base):
         )
 
 
+class YouTubeSyncCursor(Base):
+    """Per-user position in the YouTube activities feed.
+
+    ``last_published_at`` is the newest activity fully ingested. While a sweep
+    over several pages is unfinished, ``page_token`` is where it resumes and
+    ``sweep_published_at`` the newest activity it has seen so far.
+    """
+
+    __tablename__ = "youtube_sync_cursors"
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    last_published_at = Column(DateTime)
+    sweep_published_at = Column(DateTime)
+    page_token = Column(String)
+    etag = Column(String)
+    updated_at = Column(DateTime)
+
+    def __repr__(self) -> str:
+        return (
+            f"<YouTubeSyncCursor user_id={self.user_id} "
+            f"last_published_at={self.last_published_at}>"
+        )
+
+
+class PointsRecalcJob(Base):
+    """Progress of a chunked points recalculation for one event type.
+
+    ``last_user_id`` is the resume point: users are processed in id order and
+    every chunk commits its progress.
+    """
+
+    __tablename__ = "points_recalc_jobs"
+
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, default="pending")
+    last_user_id = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    total = Column(Integer)
+    error = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return (
+            f"<PointsRecalcJob id={self.id} event_type={self.event_type!r} "
+            f"status={self.status!r} processed={self.processed}/{self.total}>"
+        )
+
+
+class LeaderLease(Base):
+    """Time-limited lease naming the process that runs the background jobs."""
+
+    __tablename__ = "leader_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<LeaderLease name={self.name!r} holder={self.holder!r} expires_at={self.expires_at}>"
+
+
 class GiveawayWinner(Base):
-    """Track winners pending payout."""
+    """Track winners pending payout.
+
+    Rows written by ``app.giveaway.draw_winners`` also record who won which
+    giveaway, the points they were drawn with and the seed of the draw.
+    """
 
     __tablename__ = "giveaway_winners"
 
     id = Column(Integer, primary_key=True)
     payout_item_id = Column(String, unique=True, nullable=False)
     paid = Column(Boolean, nullable=False, default=False)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
+    giveaway = Column(String, index=True)
+    points = Column(Integer)
+    seed = Column(BigInteger)
+    drawn_at = Column(DateTime)
 
     def __repr__(self) -> str:
         return (
@@ -120,9 +270,245 @@ class GiveawayWinner(Base):
         )
 
 
+class WebhookEvent(Base):
+    """Inbox of received PayPal webhooks, one row per transmission.
+
+    Rows are written by the request handler and applied later by the
+    webhook worker, which sets ``processed_at`` and ``status``.
+    """
+
+    __tablename__ = "webhook_events"
+
+    id = Column(Integer, primary_key=True)
+    transmission_id = Column(String, unique=True, nullable=False)
+    body = Column(Text, nullable=False)
+    received_at = Column(DateTime, nullable=False)
+    processed_at = Column(DateTime, index=True)
+    status = Column(String)
+
+    def __repr__(self) -> str:
+        return (
+            f"<WebhookEvent id={self.id} transmission_id={self.transmission_id!r} "
+            f"status={self.status!r}>"
+        )
+
+
+class SchemaVersion(Base):
+    """Single row recording which schema version the database is at."""
+
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)
+
+    def __repr__(self) -> str:
+        return f"<SchemaVersion version={self.version}>"
+
+
+class UserPointsBalance(Base):
+    """Materialized running total of a user's ``PointsLedger`` rows.
+
+    Rows are maintained in the same transaction as every ledger insert by the
+    ``after_flush`` hook below, so reading a total is a primary key lookup.
+    """
+
+    __tablename__ = "user_points_balances"
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    total = Column(Integer, nullable=False, default=0, index=True)
+
+    def __repr__(self) -> str:
+        return f"<UserPointsBalance user_id={self.user_id} total={self.total}>"
+
+
+class PointsRollup(Base):
+    """Points per user, ledger reason (the event type) and hour or day bucket.
+
+    Maintained alongside the balances for every ledger insert; rows from
+    before the table existed are filled in by ``flask points backfill-rollups``.
+    """
+
+    __tablename__ = "points_rollups"
+    __table_args__ = (
+        Index('ix_points_rollups_user_bucket', 'user_id', 'period', 'bucket_start'),
+        Index('ix_points_rollups_bucket', 'period', 'bucket_start'),
+    )
+
+    period = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    event_type = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    points = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return (
+            f"<PointsRollup {self.period} user_id={self.user_id} "
+            f"event_type={self.event_type!r} bucket_start={self.bucket_start} points={self.points}>"
+        )
+
+
+class PointsRollupState(Base):
+    """Progress of the rollup backfill.
+
+    Ledger rows with ids up to ``start_id`` predate the rollups; those up to
+    ``backfilled_id`` have been added since. Rollups are complete once the
+    two meet (or when the row is missing, for databases that always had them).
+    """
+
+    __tablename__ = "points_rollup_state"
+
+    id = Column(Integer, primary_key=True)
+    start_id = Column(Integer, nullable=False, default=0)
+    backfilled_id = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<PointsRollupState start_id={self.start_id} backfilled_id={self.backfilled_id}>"
+
+
+ROLLUP_PERIODS = ("hour", "day")
+
+
+def bucket_start(timestamp, period: str):
+    if period == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+_UPSERT_DIALECTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def _add_to_counters(connection, table, keys, column: str, rows) -> None:
+    """Add ``row[column]`` to the counter row matching ``keys``, creating it if needed."""
+    dialect_insert = _UPSERT_DIALECTS.get(connection.dialect.name)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[key] for key in keys],
+            set_={column: table.c[column] + stmt.excluded[column]},
+        )
+        connection.execute(stmt, rows)
+        return
+    for row in rows:
+        result = connection.execute(
+            update(table)
+            .where(*(table.c[key] == row[key] for key in keys))
+            .values({column: table.c[column] + row[column]})
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(**row))
+
+
+def bump_points_balances(connection, deltas) -> None:
+    """Add ``deltas`` (``{user_id: points}``) to the materialized balances.
+
+    Code that writes ledger rows with Core statements instead of the ORM must
+    call this (and ``bump_points_rollups``) itself; ORM inserts are handled
+    automatically.
+    """
+    rows = [{"user_id": uid, "total": delta} for uid, delta in deltas.items() if delta]
+    if rows:
+        _add_to_counters(connection, UserPointsBalance.__table__, ("user_id",), "total", rows)
+
+
+def bump_points_rollups(connection, entries) -> None:
+    """Add ledger ``entries`` (``(user_id, reason, timestamp, points)``) to the rollups."""
+    sums = {}
+    for user_id, reason, timestamp, points in entries:
+        for period in ROLLUP_PERIODS:
+            key = (period, user_id, reason, bucket_start(timestamp, period))
+            sums[key] = sums.get(key, 0) + points
+    rows = [
+        {"period": period, "user_id": user_id, "event_type": reason, "bucket_start": start, "points": points}
+        for (period, user_id, reason, start), points in sums.items()
+        if points
+    ]
+    if rows:
+        _add_to_counters(
+            connection,
+            PointsRollup.__table__,
+            ("period", "user_id", "event_type", "bucket_start"),
+            "points",
+            rows,
+        )
+
+
+# Caches with an ``invalidate(user_ids)`` method, told after each commit which
+# users' balances it changed
+points_subscribers: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def mark_points_changed(session, user_ids) -> None:
+    """Record that ``session``'s transaction changed these users' balances."""
+    session.info.setdefault("points_changed", set()).update(user_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _maintain_points_balances(session, flush_context) -> None:
+    entries = [
+        (obj.user_id, obj.reason, obj.timestamp, obj.points_delta)
+        for obj in session.new
+        if isinstance(obj, PointsLedger)
+    ] + [
+        (obj.user_id, obj.reason, obj.timestamp, -obj.points_delta)
+        for obj in session.deleted
+        if isinstance(obj, PointsLedger)
+    ]
+    if not entries:
+        return
+    deltas = {}
+    for user_id, _, _, points in entries:
+        deltas[user_id] = deltas.get(user_id, 0) + points
+    bump_points_balances(session.connection(), deltas)
+    bump_points_rollups(session.connection(), entries)
+    mark_points_changed(session, deltas)
+
+
+# Bumped after every commit that changed ``PointsMatrix``, so caches in this
+# process notice without waiting for their next version check.
+points_matrix_generation = 0
+
+
+def bump_points_matrix_version(connection) -> None:
+    _add_to_counters(
+        connection, PointsMatrixVersion.__table__, ("id",), "version", [{"id": 1, "version": 1}]
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _track_points_matrix_changes(session, flush_context) -> None:
+    changed = session.new | session.dirty | session.deleted
+    if any(isinstance(obj, PointsMatrix) for obj in changed):
+        bump_points_matrix_version(session.connection())
+        session.info["points_matrix_changed"] = True
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _track_bulk_points_matrix_changes(context) -> None:
+    if context.mapper.class_ is PointsMatrix and context.result.rowcount:
+        bump_points_matrix_version(context.session.connection())
+        context.session.info["points_matrix_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed_changes(session) -> None:
+    global points_matrix_generation
+    if session.info.pop("points_matrix_changed", False):
+        points_matrix_generation += 1
+    changed = session.info.pop("points_changed", None)
+    if changed:
+        for subscriber in list(points_subscribers):
+            subscriber.invalidate(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_changes(session) -> None:
+    session.info.pop("points_matrix_changed", None)
+    session.info.pop("points_changed", None)
+
+
 def get_total_points(session, user_id: int) -> int:
     """Return the total points for a user."""
-    total = session.query(func.sum(PointsLedger.points_delta)).filter_by(
+    total = session.query(UserPointsBalance.total).filter_by(
         user_id=user_id
     ).scalar()
     return total or 0
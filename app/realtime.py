@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Callable, Dict
+
+from .metrics import METRICS
+
+# Seconds over which points updates for the same user are merged
+POINTS_UPDATE_WINDOW = 1.0
+
+
+def user_room(user_id: int) -> str:
+    """Socket.IO room joined by every connection of ``user_id``."""
+    return f"user:{user_id}"
+
+
+class PointsUpdateBuffer:
+    """Coalesce ``points_update`` messages per user.
+
+    ``push`` records a user's latest total; pending totals go out at most
+    once per ``window`` seconds, one message per user, to that user's room
+    only. Call ``flush`` when a batch of work is done.
+    """
+
+    def __init__(
+        self,
+        socketio,
+        window: float = POINTS_UPDATE_WINDOW,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.socketio = socketio
+        self.window = window
+        self.clock = clock
+        self._pending: Dict[int, int] = {}
+        self._last_flush = clock()
+        self._lock = threading.Lock()
+
+    def push(self, user_id: int, total: int) -> None:
+        with self._lock:
+            self._pending[user_id] = total
+            due = self.clock() - self._last_flush >= self.window
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = self.clock()
+        if self.socketio is None:
+            return
+        METRICS.inc("socketio_emits_total", len(pending), event="points_update")
+        for user_id, total in pending.items():
+            self.socketio.emit(
+                "points_update",
+                {"user_id": user_id, "total": total},
+                room=user_room(user_id),
+            )
+
+
+class LocalMessageQueue:
+    """In-process stand-in for a Socket.IO message queue broker.
+
+    Every subscriber of a channel receives every message published on it,
+    which is what Redis or Kombu give separate worker processes. Used in tests
+    and for running several ``SocketIO`` servers inside one process.
+    """
+
+    def __init__(self):
+        self._channels: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel: str) -> "queue.Queue":
+        subscriber: queue.Queue = queue.Queue()
+        with self._lock:
+            self._channels.setdefault(channel, []).append(subscriber)
+        return subscriber
+
+    def publish(self, channel: str, message) -> None:
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+
+LOCAL_BROKER = LocalMessageQueue()
+
+
+def _pubsub_base():
+    try:
+        from socketio import PubSubManager
+    except Exception:  # pragma: no cover - optional dependency
+        return object
+    return PubSubManager
+
+
+class LocalPubSubManager(_pubsub_base()):
+    """Socket.IO client manager that fans out through a ``LocalMessageQueue``."""
+
+    name = "local"
+
+    def __init__(self, broker: LocalMessageQueue | None = None, channel: str = "flask-socketio",
+                 write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.broker = broker or LOCAL_BROKER
+        self._queue = None
+
+    def _publish(self, data) -> None:
+        # Serialize like a real broker would, so payloads are never shared
+        self.broker.publish(self.channel, self.json.dumps(data))
+
+    def _listen(self):
+        if self._queue is None:
+            self._queue = self.broker.subscribe(self.channel)
+        while True:
+            yield self._queue.get()
+
+
+def socketio_options(message_queue: str | None) -> dict:
+    """Return ``SocketIO`` keyword arguments for a message queue URL.
+
+    ``local://`` selects the in-process ``LocalPubSubManager``; any other URL
+    (``redis://``, ``amqp://``, ``kafka://`` ...) is handed to Flask-SocketIO.
+    """
+    if not message_queue:
+        return {}
+    if message_queue.startswith("local://"):
+        channel = message_queue[len("local://"):] or "flask-socketio"
+        return {"client_manager": LocalPubSubManager(channel=channel)}
+    return {"message_queue": message_queue}
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, exists, func, or_, update
+from sqlalchemy.orm import aliased
+
+from .models import Engagement, EventType, PointsLedger, PointsRecalcJob
+from .utils.points import (
+    PointsMatrixProvider,
+    get_matrix_provider,
+    rebuild_points_balances,
+    score_engagement,
+)
+
+try:
+    from celery import shared_task  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    shared_task = None  # type: ignore
+
+# Users recalculated per committed chunk
+RECALC_CHUNK_SIZE = 500
+# A running job without a heartbeat for this long is presumed dead
+RECALC_STALE_AFTER = 300
+
+logger = logging.getLogger(__name__)
+
+
+class RecalcEngine:
+    """Recalculate points after a ``PointsMatrix`` change.
+
+    ``submit`` records a ``PointsRecalcJob`` and hands it to a backend: a
+    Celery task when ``backend="celery"``, otherwise a single background
+    thread. A job walks the users with engagements of its event type in id
+    order, ``chunk_size`` at a time. For each chunk it appends ledger
+    adjustments that bring every engagement to its score under the current
+    matrix, heals the users' balances, and records its position in the same
+    commit, so a job interrupted at any point resumes where it stopped and
+    rerunning a finished job changes nothing.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Any],
+        chunk_size: int = RECALC_CHUNK_SIZE,
+        backend: str = "thread",
+        provider: Optional[PointsMatrixProvider] = None,
+        stale_after: float = RECALC_STALE_AFTER,
+        executor=None,
+    ):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.backend = backend
+        self.provider = provider
+        self.stale_after = stale_after
+        self._executor = executor
+        self._lock = threading.Lock()
+
+    def submit(self, event_type: str, dispatch: bool = True) -> int:
+        """Queue a recalculation for ``event_type`` and return the job id.
+
+        A job for the same event type that has not started yet already picks
+        up the latest matrix, so it is returned instead of queueing another.
+        With ``dispatch=False`` the job is only recorded; call ``run`` to
+        process it in the calling thread.
+        """
+        event_type = _event_type_name(event_type)
+        with self._lock:
+            session = self.session_factory()
+            try:
+                job_id = (
+                    session.query(PointsRecalcJob.id)
+                    .filter_by(event_type=event_type, status="pending")
+                    .order_by(PointsRecalcJob.id)
+                    .limit(1)
+                    .scalar()
+                )
+                if job_id is not None:
+                    return job_id
+                now = datetime.utcnow()
+                job = PointsRecalcJob(
+                    event_type=event_type, status="pending", created_at=now, updated_at=now
+                )
+                session.add(job)
+                session.commit()
+                job_id = job.id
+            finally:
+                session.close()
+        if dispatch:
+            self._dispatch(job_id)
+        return job_id
+
+    def _dispatch(self, job_id: int) -> None:
+        if self.backend == "celery" and shared_task is not None:
+            run_recalc_job.delay(job_id)
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="points-recalc"
+                )
+            executor = self._executor
+        executor.submit(self.run, job_id)
+
+    def _claim(self, session, job_id: int) -> bool:
+        """Atomically mark ``job_id`` running; fails if another run owns it."""
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.stale_after)
+        other = aliased(PointsRecalcJob)
+        job_type = (
+            session.query(PointsRecalcJob.event_type).filter_by(id=job_id).scalar()
+        )
+        if job_type is None:
+            return False
+        busy = exists().where(
+            other.event_type == job_type,
+            other.id != job_id,
+            other.status == "running",
+            other.updated_at >= stale,
+        )
+        claimed = session.execute(
+            update(PointsRecalcJob)
+            .where(
+                PointsRecalcJob.id == job_id,
+                or_(
+                    PointsRecalcJob.status == "pending",
+                    and_(
+                        PointsRecalcJob.status == "running",
+                        PointsRecalcJob.updated_at < stale,
+                    ),
+                ),
+                ~busy,
+            )
+            .values(status="running", updated_at=now)
+        ).rowcount
+        session.commit()
+        return bool(claimed)
+
+    def run(self, job_id: int) -> bool:
+        """Run (or resume) a job to completion; returns whether it ran."""
+        session = self.session_factory()
+        try:
+            if not self._claim(session, job_id):
+                return False
+            job = session.get(PointsRecalcJob, job_id)
+            try:
+                etype = EventType[job.event_type]
+                if job.total is None:
+                    job.total = (
+                        session.query(func.count(func.distinct(Engagement.user_id)))
+                        .filter(Engagement.event_type == etype)
+                        .scalar()
+                    )
+                    session.commit()
+                while True:
+                    user_ids = self._next_chunk(session, etype, job.last_user_id)
+                    if not user_ids:
+                        break
+                    self._recalculate(session, etype, user_ids)
+                    job.last_user_id = user_ids[-1]
+                    job.processed += len(user_ids)
+                    job.updated_at = datetime.utcnow()
+                    session.flush()
+                    # The flush hook already moved the balances; this only
+                    # heals drift, and the commit below writes the chunk
+                    rebuild_points_balances(session, user_ids=user_ids)
+                    session.commit()
+                job.status = "done"
+                job.updated_at = datetime.utcnow()
+                session.commit()
+            except Exception as exc:
+                logger.exception("Points recalculation %s failed", job_id)
+                session.rollback()
+                job = session.get(PointsRecalcJob, job_id)
+                job.status = "failed"
+                job.error = str(exc)
+                job.updated_at = datetime.utcnow()
+                session.commit()
+            return True
+        finally:
+            session.close()
+
+    def _next_chunk(self, session, etype: EventType, after: int) -> List[int]:
+        return [
+            user_id
+            for (user_id,) in session.query(Engagement.user_id)
+            .filter(Engagement.event_type == etype, Engagement.user_id > after)
+            .distinct()
+            .order_by(Engagement.user_id)
+            .limit(self.chunk_size)
+        ]
+
+    def _matrix(self, session) -> Dict[str, Any]:
+        provider = self.provider or get_matrix_provider()
+        # Another process may have just changed the matrix; never trust the cache
+        return provider.rules(session, refresh=True)
+
+    def _recalculate(self, session, etype: EventType, user_ids: List[int]) -> None:
+        """Add ledger adjustments so each engagement is worth its current score."""
+        matrix = self._matrix(session)
+        awarded = (
+            session.query(
+                PointsLedger.engagement_id,
+                func.sum(PointsLedger.points_delta).label("awarded"),
+            )
+            .filter(PointsLedger.user_id.in_(user_ids))
+            .group_by(PointsLedger.engagement_id)
+            .subquery()
+        )
+        # Compaction moves an engagement's old ledger rows into checkpoints
+        current = func.coalesce(awarded.c.awarded, 0) + func.coalesce(Engagement.compacted_points, 0)
+        rows = (
+            session.query(Engagement, current)
+            .outerjoin(awarded, awarded.c.engagement_id == Engagement.id)
+            .filter(Engagement.event_type == etype, Engagement.user_id.in_(user_ids))
+        )
+        for engagement, current in rows:
+            delta = score_engagement(engagement, matrix) - int(current)
+            if delta:
+                session.add(
+                    PointsLedger(
+                        user_id=engagement.user_id,
+                        engagement_id=engagement.id,
+                        points_delta=delta,
+                        reason=etype.name,
+                        timestamp=engagement.timestamp,
+                    )
+                )
+
+    def resume_pending(self) -> List[int]:
+        """Dispatch queued jobs and jobs whose runner stopped heartbeating."""
+        stale = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        session = self.session_factory()
+        try:
+            job_ids = [
+                job_id
+                for (job_id,) in session.query(PointsRecalcJob.id)
+                .filter(
+                    or_(
+                        PointsRecalcJob.status == "pending",
+                        and_(
+                            PointsRecalcJob.status == "running",
+                            PointsRecalcJob.updated_at < stale,
+                        ),
+                    )
+                )
+                .order_by(PointsRecalcJob.id)
+            ]
+        finally:
+            session.close()
+        for job_id in job_ids:
+            self._dispatch(job_id)
+        return job_ids
+
+    def progress(self, job_id: int) -> Optional[Dict[str, Any]]:
+        session = self.session_factory()
+        try:
+            job = session.get(PointsRecalcJob, job_id)
+            if job is None:
+                return None
+            return {
+                "id": job.id,
+                "event_type": job.event_type,
+                "status": job.status,
+                "processed": job.processed,
+                "total": job.total,
+                "error": job.error,
+            }
+        finally:
+            session.close()
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def _event_type_name(event_type) -> str:
+    if isinstance(event_type, EventType):
+        return event_type.name
+    return EventType[str(event_type)].name
+
+
+if shared_task is not None:
+
+    @shared_task(name="app.recalc.run_recalc_job")
+    def run_recalc_job(job_id: int) -> None:
+        """Celery entry point; the worker must run inside the Flask app context."""
+        from flask import current_app
+
+        current_app.recalc_engine.run(job_id)
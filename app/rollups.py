@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import weakref
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, Optional, Sequence
+
+from sqlalchemy import func, select, union_all
+
+from .models import (
+    CHECKPOINT_REASON,
+    EventType,
+    PointsLedger,
+    PointsRollup,
+    PointsRollupState,
+    bucket_start,
+    bump_points_rollups,
+)
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+# Ledger rows read per backfill transaction
+BACKFILL_CHUNK = 10_000
+
+# Engines whose rollups are known to be complete; that never reverts
+_complete = weakref.WeakSet()
+
+
+def _floor(ts: datetime, step: timedelta) -> datetime:
+    return bucket_start(ts, "hour" if step == HOUR else "day")
+
+
+def _ceil(ts: datetime, step: timedelta) -> datetime:
+    floor = _floor(ts, step)
+    return floor if floor == ts else floor + step
+
+
+def rollups_complete(session) -> bool:
+    """Whether every ledger row is reflected in the rollups."""
+    bind = session.get_bind()
+    if bind in _complete:
+        return True
+    state = session.get(PointsRollupState, 1)
+    if state is not None and state.backfilled_id < state.start_id:
+        return False
+    _complete.add(bind)
+    return True
+
+
+def _type_names(event_types: Optional[Iterable]) -> Optional[Sequence[str]]:
+    if event_types is None:
+        return None
+    return [t.name if isinstance(t, EventType) else str(t) for t in event_types]
+
+
+def _ledger_rows(lo, hi, types, user_id=None):
+    # Checkpoints only exist once the rollups are complete, and hold nothing
+    # the rollups are missing
+    query = select(PointsLedger.user_id, PointsLedger.points_delta.label("points")).where(
+        PointsLedger.reason != CHECKPOINT_REASON
+    )
+    if user_id is not None:
+        query = query.where(PointsLedger.user_id == user_id)
+    if lo is not None:
+        query = query.where(PointsLedger.timestamp >= lo)
+    if hi is not None:
+        query = query.where(PointsLedger.timestamp < hi)
+    if types is not None:
+        query = query.where(PointsLedger.reason.in_(types))
+    return query
+
+
+def _rollup_rows(period, lo, hi, types, user_id=None):
+    query = select(PointsRollup.user_id, PointsRollup.points).where(PointsRollup.period == period)
+    if user_id is not None:
+        query = query.where(PointsRollup.user_id == user_id)
+    if lo is not None:
+        query = query.where(PointsRollup.bucket_start >= lo)
+    if hi is not None:
+        query = query.where(PointsRollup.bucket_start < hi)
+    if types is not None:
+        query = query.where(PointsRollup.event_type.in_(types))
+    return query
+
+
+def _pieces(since: Optional[datetime], until: Optional[datetime], types, user_id=None):
+    """Selects of ``(user_id, points)`` that together cover ``[since, until)``.
+
+    Whole days come from the daily rollups, whole hours around them from the
+    hourly ones and the partial hours at either edge from the ledger.
+    """
+    lo_hour = _ceil(since, HOUR) if since is not None else None
+    hi_hour = _floor(until, HOUR) if until is not None else None
+    if lo_hour is not None and hi_hour is not None and lo_hour >= hi_hour:
+        return [_ledger_rows(since, until, types, user_id)]
+    pieces = []
+    if since is not None and since < lo_hour:
+        pieces.append(_ledger_rows(since, lo_hour, types, user_id))
+    if until is not None and hi_hour < until:
+        pieces.append(_ledger_rows(hi_hour, until, types, user_id))
+    lo_day = _ceil(lo_hour, DAY) if lo_hour is not None else None
+    hi_day = _floor(hi_hour, DAY) if hi_hour is not None else None
+    if lo_day is not None and hi_day is not None and lo_day >= hi_day:
+        pieces.append(_rollup_rows("hour", lo_hour, hi_hour, types, user_id))
+        return pieces
+    if lo_hour is not None and lo_hour < lo_day:
+        pieces.append(_rollup_rows("hour", lo_hour, lo_day, types, user_id))
+    if hi_hour is not None and hi_day < hi_hour:
+        pieces.append(_rollup_rows("hour", hi_day, hi_hour, types, user_id))
+    pieces.append(_rollup_rows("day", lo_day, hi_day, types, user_id))
+    return pieces
+
+
+def get_points(
+    session,
+    user_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    event_types: Optional[Iterable] = None,
+) -> int:
+    """Return a user's points earned in ``[since, until)``.
+
+    ``event_types`` limits the sum to those ledger reasons (``EventType``
+    members or names). Answered from the rollups plus the ledger rows in
+    the partial hours at the edges; falls back to the ledger alone until
+    the backfill has finished.
+    """
+    types = _type_names(event_types)
+    if rollups_complete(session):
+        pieces = _pieces(since, until, types, user_id)
+    else:
+        pieces = [_ledger_rows(since, until, types, user_id)]
+    rows = union_all(*pieces).subquery() if len(pieces) > 1 else pieces[0].subquery()
+    return int(session.execute(select(func.sum(rows.c.points))).scalar() or 0)
+
+
+def window_points(session, since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Subquery of ``(user_id, points)`` per user for ``[since, until)``."""
+    if rollups_complete(session):
+        pieces = _pieces(since, until, None)
+    else:
+        pieces = [_ledger_rows(since, until, None)]
+    rows = union_all(*pieces).subquery() if len(pieces) > 1 else pieces[0].subquery()
+    return (
+        select(rows.c.user_id, func.sum(rows.c.points).label("points"))
+        .group_by(rows.c.user_id)
+        .subquery()
+    )
+
+
+def backfill_rollups(session, chunk_size: int = BACKFILL_CHUNK) -> Iterator[PointsRollupState]:
+    """Roll up the ledger rows that predate the rollups, one chunk per commit.
+
+    Yields the state after each chunk. The position is committed with the
+    chunk, so an interrupted backfill resumes where it stopped.
+    """
+    while True:
+        state = session.get(PointsRollupState, 1)
+        if state is None or state.backfilled_id >= state.start_id:
+            return
+        upper = min(state.start_id, state.backfilled_id + chunk_size)
+        entries = session.execute(
+            select(
+                PointsLedger.user_id,
+                PointsLedger.reason,
+                PointsLedger.timestamp,
+                PointsLedger.points_delta,
+            ).where(PointsLedger.id > state.backfilled_id, PointsLedger.id <= upper)
+        ).all()
+        bump_points_rollups(session.connection(), entries)
+        state.backfilled_id = upper
+        session.commit()
+        yield state
@@ -10,7 +10,7 @@ from flask import (
 from types import SimpleNamespace
 
 
-from .models import User, get_total_points
+from .models import User
 try:
     from flask_dance.contrib.google import google
 except Exception:  # pragma: no cover - optional dependency
@@ -18,8 +18,20 @@ except Exception:  # pragma: no cover - optional dependency
 import json
 import os
 import pathlib
-import requests
-from .utils.quiz import generate_question, load_transcript
+import random
+import zlib
+from .leaderboard import DEFAULT_SIZE, WINDOWS, LeaderboardCache
+from .metrics import METRICS
+from .utils.channels import ChannelCache
+from .utils.points import PointsCache
+from .utils.quiz import (
+    TranscriptTooLarge,
+    generate_question,
+    generate_questions,
+    get_index,
+    store_index,
+    write_transcript,
+)
 
 bp = Blueprint('main', __name__)
 
@@ -37,9 +49,24 @@ CHANNEL_IDS = [
 TRANSCRIPTS_DIR = pathlib.Path(__file__).resolve().parent.parent / "transcripts"
 TRANSCRIPTS_DIR.mkdir(exist_ok=True)
 
+# Largest accepted transcript (after gzip decompression), in bytes
+TRANSCRIPT_MAX_BYTES = 10 * 1024 * 1024
+# Most questions a single /api/quiz request may ask for
+QUIZ_MAX_COUNT = 50
+
 
 def init_app(app):
     app.register_blueprint(bp)
+    app.leaderboard_cache = LeaderboardCache(
+        app.config.get('LEADERBOARD_CACHE_TTL', 15.0)
+    )
+    app.points_cache = PointsCache(app.config.get('POINTS_CACHE_TTL', 5.0))
+    app.channel_cache = ChannelCache(
+        API_KEY,
+        CHANNEL_IDS,
+        ttl=app.config.get('CHANNEL_CACHE_TTL', 3600.0),
+        stale_ttl=app.config.get('CHANNEL_CACHE_STALE_TTL', 86400.0),
+    )
 
 
 @bp.route('/')
@@ -56,8 +83,7 @@ def watch_channel(cid):
     username = session.get('username')
     if not username:
         return redirect(url_for('main.login'))
-    channels = get_channel_data()
-    channel = next((c for c in channels if c['id'] == cid), None)
+    channel = current_app.channel_cache.get(cid)
     if channel is None:
         return redirect(url_for('main.index'))
     return render_template('watch.html', username=username, channel=channel)
@@ -65,23 +91,75 @@ def watch_channel(cid):
 
 @bp.route('/api/upload_transcript/<cid>', methods=['POST'])
 def upload_transcript(cid):
-    """Store transcript text for a channel."""
-    text = request.get_data(as_text=True)
-    if not text:
-        return {"error": "no transcript"}, 400
+    """Store transcript text for a channel and index it for quizzes.
+
+    The body is streamed to disk in chunks and may be gzip-compressed
+    (``Content-Encoding: gzip``).
+    """
+    max_bytes = current_app.config.get('TRANSCRIPT_MAX_BYTES', TRANSCRIPT_MAX_BYTES)
+    if request.content_length is not None and request.content_length > max_bytes:
+        return {"error": "transcript too large"}, 413
+    gzipped = request.headers.get('Content-Encoding', '').lower() == 'gzip'
     path = TRANSCRIPTS_DIR / f"{cid}.txt"
-    path.write_text(text, encoding="utf-8")
+    try:
+        index = write_transcript(request.stream, str(path), max_bytes, gzipped=gzipped)
+    except TranscriptTooLarge:
+        return {"error": "transcript too large"}, 413
+    except zlib.error:
+        return {"error": "invalid gzip body"}, 400
+    if index is None:
+        return {"error": "no transcript"}, 400
+    store_index(str(path), index)
     return {"status": "ok"}
 
 
 @bp.route('/api/quiz/<cid>')
 def quiz_question(cid):
-    """Return a generated quiz question for the channel."""
+    """Return generated quiz questions for the channel.
+
+    Without ``count`` a single question object is returned. With
+    ``?count=N`` the response holds ``N`` questions and the ``seed`` that
+    reproduces them; pass ``seed`` to get the same questions again.
+    """
+    count = request.args.get('count', type=int)
+    seed = request.args.get('seed', type=int)
+    if seed is None and count is not None:
+        seed = random.SystemRandom().randrange(2 ** 32)
+    rng = random.Random(seed)
     path = TRANSCRIPTS_DIR / f"{cid}.txt"
+    if count is None:
+        if not path.exists():
+            return {"question": "Transcript not found", "options": []}
+        return generate_question(get_index(str(path)), rng)
+    max_count = current_app.config.get('QUIZ_MAX_COUNT', QUIZ_MAX_COUNT)
+    count = max(1, min(count, max_count))
     if not path.exists():
-        return {"question": "Transcript not found", "options": []}
-    transcript = load_transcript(str(path))
-    return generate_question(transcript)
+        return {"questions": [], "seed": seed}
+    return {"questions": generate_questions(get_index(str(path)), count, rng), "seed": seed}
+
+
+@bp.route('/api/leaderboard')
+def leaderboard():
+    """Return the cached top-N leaderboard for a time window."""
+    window = request.args.get('window', 'all')
+    if window not in WINDOWS:
+        return {"error": f"window must be one of {', '.join(WINDOWS)}"}, 400
+    max_size = current_app.config.get('LEADERBOARD_MAX_SIZE', 100)
+    limit = request.args.get('limit', DEFAULT_SIZE, type=int)
+    limit = max(1, min(limit, max_size))
+    session_factory = getattr(current_app, 'session_factory', None)
+    if session_factory is None:
+        return {"window": window, "leaderboard": []}
+    try:
+        board = current_app.leaderboard_cache.get(
+            session_factory,
+            window=window,
+            limit=limit,
+            episode_start=current_app.config.get('LEADERBOARD_EPISODE_START'),
+        )
+    except ValueError as exc:
+        return {"error": str(exc)}, 400
+    return {"window": window, "leaderboard": board}
 
 
 @bp.route('/login', methods=['GET', 'POST'])
@@ -94,6 +172,7 @@ def login():
             error = 'Username required'
         else:
             session['username'] = username
+            session.pop('user_id', None)
             session['role'] = (
                 'ROLE_ADMIN' if username == 'admin' else 'ROLE_USER'
             )
@@ -123,17 +202,14 @@ def oauth_login():
     if session_factory is not None:
         db_session = session_factory()
         try:
-            user = db_session.query(User).filter_by(username=username).first()
-            if user is None:
-                user = User(username=username)
-                db_session.add(user)
-                db_session.commit()
+            user_id = _get_or_create_user_id(db_session, username)
+            session['user_id'] = user_id
 
             from .models import OAuth
 
             oauth = (
                 db_session.query(OAuth)
-                .filter_by(provider='youtube', user_id=user.id)
+                .filter_by(provider='youtube', user_id=user_id)
                 .first()
             )
 
@@ -142,7 +218,7 @@ def oauth_login():
                 oauth.token = token_json
             else:
                 oauth = OAuth(
-                    provider='youtube', token=token_json, user_id=user.id
+                    provider='youtube', token=token_json, user_id=user_id
                 )
                 db_session.add(oauth)
             db_session.commit()
@@ -167,49 +243,32 @@ def dashboard():
     user_id = None
     session_factory = getattr(current_app, 'session_factory', None)
     if session_factory is not None:
-        db_session = session_factory()
-        try:
-            user = db_session.query(User).filter_by(username=username).first()
-            if user is None:
-                user = User(username=username)
-                db_session.add(user)
-                db_session.commit()
-            user_id = user.id
-            points_total = get_total_points(db_session, user.id)
-        finally:
-            db_session.close()
+        # After the first visit both lookups are served from memory
+        user_id = session.get('user_id')
+        if user_id is None:
+            db_session = session_factory()
+            try:
+                user_id = _get_or_create_user_id(db_session, username)
+            finally:
+                db_session.close()
+            session['user_id'] = user_id
+        points_total = current_app.points_cache.get(session_factory, user_id)
 
     current_user = SimpleNamespace(id=user_id, username=username, points_total=points_total)
     return render_template('dashboard.html', current_user=current_user, username=username)
 
 
+def _get_or_create_user_id(db_session, username):
+    user_id = db_session.query(User.id).filter_by(username=username).scalar()
+    if user_id is None:
+        user = User(username=username)
+        db_session.add(user)
+        db_session.commit()
+        user_id = user.id
+    return user_id
+
+
+@METRICS.timed("channel_data_seconds")
 def get_channel_data():
-    if not API_KEY:
-        # Without an API key, return simple channel URLs
-        return [
-            {
-                'id': cid,
-                'title': f'Channel {cid}',
-                'url': f'https://www.youtube.com/channel/{cid}',
-            }
-            for cid in CHANNEL_IDS
-        ]
-    data = []
-    for cid in CHANNEL_IDS:
-        resp = requests.get(
-            'https://www.googleapis.com/youtube/v3/channels',
-            params={'part': 'snippet', 'id': cid, 'key': API_KEY},
-            timeout=10,
-        )
-        if resp.ok:
-            items = resp.json().get('items')
-            if items:
-                snippet = items[0]['snippet']
-                data.append(
-                    {
-                        'id': cid,
-                        'title': snippet['title'],
-                        'url': f'https://www.youtube.com/channel/{cid}',
-                    }
-                )
-    return data
+    """Return metadata for every channel in ``CHANNEL_IDS``."""
+    return current_app.channel_cache.get_all()
@@ -2,33 +2,82 @@ from __future__ import annotations
 
 from typing import Any, Callable
 
-from flask_socketio import join_room
+from flask import has_request_context, session
+from flask_socketio import emit, join_room
 
-from .models import User, get_total_points
+from .leaderboard import DEFAULT_SIZE, LeaderboardCache, LeaderboardTracker, snapshot
+from .metrics import METRICS
+from .models import User
+from .realtime import user_room
 
 
-def init_socket_events(app, session_factory: Callable[[], Any] | None, socketio=None):
-    """Register socket events and start background jobs."""
+def init_socket_events(app, session_factory: Callable[[], Any] | None, socketio=None, election=None):
+    """Register socket events and start background jobs.
+
+    With a ``LeaderElection`` only the leader process broadcasts the
+    leaderboard; a message queue carries it to clients of other workers.
+    """
     if socketio is None or session_factory is None:
         return None
 
+    config = app.config if app is not None else {}
+    cache = getattr(app, "leaderboard_cache", None) or LeaderboardCache()
+    tracker = LeaderboardTracker()
+    # Whether this process sent the last broadcast, making ``tracker`` the
+    # board the next diff will be based on
+    broadcasting = {"active": False}
+
     @socketio.on("connect")
     def on_connect():
         join_room("public")
+        if not has_request_context():
+            return
+        username = session.get("username")
+        if username:
+            db_session = session_factory()
+            try:
+                user_id = (
+                    db_session.query(User.id).filter_by(username=username).scalar()
+                )
+            finally:
+                db_session.close()
+            if user_id is not None:
+                join_room(user_room(user_id))
+        # Late joiners start from a full snapshot; diffs follow in order
+        emit("leaderboard", board_snapshot())
+
+    @socketio.on("leaderboard_snapshot")
+    def on_leaderboard_snapshot():
+        # A client got a diff for a board it does not hold
+        emit("leaderboard", board_snapshot())
+
+    def board_snapshot():
+        if broadcasting["active"]:
+            return tracker.snapshot()
+        # Another worker broadcasts; the cached board carries the same
+        # version as the broadcast one whenever the two agree
+        return snapshot(current_board())
+
+    def current_board():
+        return cache.get(
+            session_factory,
+            window=config.get("LEADERBOARD_WINDOW", "all"),
+            limit=config.get("LEADERBOARD_SIZE", DEFAULT_SIZE),
+            episode_start=config.get("LEADERBOARD_EPISODE_START"),
+        )
 
     def leaderboard_loop():
         while True:
-            session = session_factory()
-            try:
-                users = session.query(User).all()
-                board = [
-                    {"name": user.username, "points": get_total_points(session, user.id)}
-                    for user in users
-                ]
-                board.sort(key=lambda x: x["points"], reverse=True)
-                socketio.emit("leaderboard", board[:10], room="public")
-            finally:
-                session.close()
+            if election is None or election.acquire():
+                with METRICS.time("leaderboard_tick_seconds"):
+                    diff = tracker.update(current_board())
+                if diff is not None:
+                    socketio.emit("leaderboard", diff, room="public")
+                    METRICS.inc("socketio_emits_total", event="leaderboard")
+                broadcasting["active"] = True
+            elif broadcasting["active"]:
+                broadcasting["active"] = False
+                tracker.reset()
             socketio.sleep(15)
 
     socketio.start_background_task(leaderboard_loop)
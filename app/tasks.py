@@ -1,128 +1,458 @@
 from __future__ import annotations
 
+import hashlib
 import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Tuple
 
-from .models import EventType, Engagement, OAuth, User, get_total_points
-from .utils.points import apply_points, DEFAULT_POINT_MATRIX
+from sqlalchemy.exc import IntegrityError
 
+from .metrics import METRICS
+from .models import (
+    EventType,
+    Engagement,
+    OAuth,
+    PointsLedger,
+    YouTubeSyncCursor,
+    get_total_points,
+)
+from .realtime import POINTS_UPDATE_WINDOW, PointsUpdateBuffer
+from .utils.activity import parse_published
+from .utils.points import DEFAULT_POINT_MATRIX, get_matrix_provider, score_engagement
 
-# Default mapping for tasks when no Flask config is available
+
+# Point values used when neither the config nor the PointsMatrix table override them
 RULES = DEFAULT_POINT_MATRIX
 
+# Polling defaults, overridable through the Flask config
+POLL_INTERVAL = 60
+POLL_CONCURRENCY = 8
+POLL_TIMEOUT = 20
+POLL_MAX_PAGES = 5
+RECALC_RESUME_INTERVAL = 300
+PAYPAL_WEBHOOK_SWEEP_INTERVAL = 60
+HISTORY_COMPACT_INTERVAL = 24 * 60 * 60
+
+CURSOR_FIELDS = ("last_published_at", "sweep_published_at", "page_token", "etag")
+
+logger = logging.getLogger(__name__)
+
+
+def init_scheduler(app, session_factory, socketio=None, election=None, recalc_engine=None):
+    """Initialize APScheduler job if dependencies are available.
 
-def init_scheduler(app, session_factory, socketio=None):
-    """Initialize APScheduler job if dependencies are available."""
+    With a ``LeaderElection`` every process schedules the job but only the
+    current leader runs it. The leader also resumes interrupted points
+    recalculations from ``recalc_engine``, applies PayPal webhooks left in
+    the inbox and, with ``HISTORY_RETENTION_DAYS`` set, compacts the ledger
+    and archives engagements older than that daily.
+    """
     try:
         from apscheduler.schedulers.background import BackgroundScheduler
     except Exception as exc:  # pragma: no cover - optional dependency
         app.logger.warning("APScheduler not available: %s", exc)
         return None
 
+    def run():
+        if election is None or election.acquire():
+            _update_engagements(app, session_factory, socketio)
+
     scheduler = BackgroundScheduler()
+    # A slow run must never overlap the next one: skip (and coalesce) any
+    # ticks that fire while the previous poll is still in progress.
     scheduler.add_job(
-        lambda: _update_engagements(app, session_factory, socketio),
+        run,
         "interval",
-        seconds=60,
+        seconds=app.config.get("YOUTUBE_POLL_INTERVAL", POLL_INTERVAL),
+        max_instances=1,
+        coalesce=True,
     )
+    if recalc_engine is not None:
+        def resume():
+            if election is None or election.acquire():
+                recalc_engine.resume_pending()
+
+        scheduler.add_job(
+            resume,
+            "interval",
+            seconds=app.config.get("RECALC_RESUME_INTERVAL", RECALC_RESUME_INTERVAL),
+            max_instances=1,
+            coalesce=True,
+        )
+    webhook_worker = getattr(app, "paypal_webhook_worker", None)
+    if webhook_worker is not None and app.config.get("PAYPAL_WEBHOOK_WORKER", True):
+        # Workers only wake on a delivery to their own process; this picks up
+        # rows stored before a restart or while the worker was switched off.
+        def drain_webhooks():
+            if election is None or election.acquire():
+                webhook_worker.drain()
+
+        scheduler.add_job(
+            drain_webhooks,
+            "interval",
+            seconds=app.config.get("PAYPAL_WEBHOOK_SWEEP_INTERVAL", PAYPAL_WEBHOOK_SWEEP_INTERVAL),
+            max_instances=1,
+            coalesce=True,
+        )
+    retention_days = app.config.get("HISTORY_RETENTION_DAYS")
+    if retention_days:
+        from .compaction import compact_history
+
+        def compact():
+            if election is None or election.acquire():
+                compact_history(app, session_factory, float(retention_days))
+
+        scheduler.add_job(
+            compact,
+            "interval",
+            seconds=app.config.get("HISTORY_COMPACT_INTERVAL", HISTORY_COMPACT_INTERVAL),
+            max_instances=1,
+            coalesce=True,
+        )
     scheduler.start()
     return scheduler
 
 
-def _build_youtube_service(token: dict):
-    """Create a YouTube service from a stored OAuth token."""
+_discovery_doc = None
+_discovery_lock = threading.Lock()
+
+
+def _build_youtube_service(token: dict, timeout: Optional[float] = None):
+    """Create a YouTube service from a stored OAuth token.
+
+    The discovery document bundled with ``googleapiclient`` is parsed once and
+    reused, so building a service never touches the network. ``timeout``
+    bounds every socket operation the service performs.
+    """
+    global _discovery_doc
     try:
+        import httplib2
         from google.oauth2.credentials import Credentials
-        from googleapiclient.discovery import build
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build_from_document
+        from googleapiclient.discovery_cache import get_static_doc
     except Exception:
         return None
     creds = Credentials(token.get("access_token"))
-    return build("youtube", "v3", credentials=creds)
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=timeout))
+    # build_from_document fixes up the shared document in place, so builds
+    # are serialized; they only happen on cache misses.
+    with _discovery_lock:
+        if _discovery_doc is None:
+            _discovery_doc = json.loads(get_static_doc("youtube", "v3"))
+        return build_from_document(_discovery_doc, http=http)
+
+
+class YouTubeServiceCache:
+    """Reuse built YouTube services per user until their token changes."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _fingerprint(token: dict) -> str:
+        return hashlib.sha256(json.dumps(token, sort_keys=True).encode()).hexdigest()
+
+    def get(self, user_id: int, token: dict, timeout: Optional[float] = None):
+        fingerprint = self._fingerprint(token)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == fingerprint:
+                self.hits += 1
+                METRICS.inc("youtube_service_cache_hits_total")
+                return entry[1]
+            self.misses += 1
+        METRICS.inc("youtube_service_cache_misses_total")
+        service = _build_youtube_service(token, timeout=timeout)
+        with self._lock:
+            if service is None:
+                self._entries.pop(user_id, None)
+            else:
+                self._entries[user_id] = (fingerprint, service)
+        return service
+
+    def evict(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def retain(self, user_ids) -> None:
+        """Drop services for users that are no longer linked."""
+        keep = set(user_ids)
+        with self._lock:
+            for user_id in list(self._entries):
+                if user_id not in keep:
+                    del self._entries[user_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+SERVICE_CACHE = YouTubeServiceCache()
+
+
+def _parse_published(item: dict) -> Optional[datetime]:
+    return parse_published(item.get("snippet", {}).get("publishedAt"))
+
+
+def _is_not_modified(exc: Exception) -> bool:
+    return getattr(getattr(exc, "resp", None), "status", None) == 304
+
+
+def _fetch_activities(
+    service, cursor: Optional[dict] = None, max_pages: int = POLL_MAX_PAGES
+) -> Tuple[list, dict]:
+    """Fetch activities newer than ``cursor`` and return them with the new cursor.
 
+    The first page of a sweep is a conditional request on the stored ETag.
+    Pages are followed until an already-ingested activity shows up; if
+    ``max_pages`` runs out first the cursor keeps the page token so the next
+    run resumes the same sweep.
+    """
+    cursor = dict(cursor or {})
+    after = cursor.get("last_published_at")
+    newest = cursor.get("sweep_published_at")
+    page_token = cursor.get("page_token")
+    params = {"part": "snippet,contentDetails", "mine": True, "maxResults": 50}
+    if after is not None:
+        params["publishedAfter"] = after.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def _fetch_activities(service) -> list:
+    items = []
+    for _ in range(max(1, max_pages)):
+        request = service.activities().list(pageToken=page_token, **params)
+        if page_token is None and cursor.get("etag"):
+            request.headers["If-None-Match"] = cursor["etag"]
+        try:
+            resp = request.execute()
+        except Exception as exc:
+            if _is_not_modified(exc):
+                page_token = None
+            break
+        if page_token is None:
+            cursor["etag"] = resp.get("etag")
+
+        caught_up = False
+        for item in resp.get("items", []):
+            published = _parse_published(item)
+            # publishedAt has whole seconds, so items from the cursor's own
+            # second may be new; _ingest_activities drops the ones we have
+            if after is not None and published is not None and published < after:
+                caught_up = True
+                break
+            items.append(item)
+            if published is not None and (newest is None or published > newest):
+                newest = published
+        page_token = None if caught_up else resp.get("nextPageToken")
+        if page_token is None:
+            break
+
+    if page_token is not None:
+        cursor.update(page_token=page_token, sweep_published_at=newest)
+    else:
+        if newest is not None and (after is None or newest > after):
+            after = newest
+        cursor.update(page_token=None, sweep_published_at=None, last_published_at=after)
+    return items, cursor
+
+
+@METRICS.timed("youtube_poll_user_seconds")
+def _poll_user(
+    user_id: int,
+    token: dict,
+    cursor: Optional[dict] = None,
+    timeout: Optional[float] = None,
+    max_pages: int = POLL_MAX_PAGES,
+) -> Optional[Tuple[list, dict]]:
+    """Fetch a user's new activities; runs on a worker thread and never touches the DB.
+
+    Returns ``(activities, cursor)`` or ``None`` when the user cannot be
+    polled this round.
+    """
     try:
-        resp = (
-            service.activities()
-            .list(part="snippet,contentDetails", mine=True)
-            .execute()
-        )
+        service = SERVICE_CACHE.get(user_id, token, timeout=timeout)
+        if service is None:
+            return None
+        # Verify subscription still active
+        service.subscriptions().list(part="id", mine=True).execute()
     except Exception:
-        return []
-    return resp.get("items", [])
+        SERVICE_CACHE.evict(user_id)
+        METRICS.inc("youtube_poll_failures_total")
+        return None
+    return _fetch_activities(service, cursor, max_pages=max_pages)
+
+
+def _ingest_activities(
+    session, user_id: int, activities: list, matrix=None, compact: bool = True
+) -> int:
+    """Add engagements and ledger rows for a batch of one user's activities.
+
+    Already-ingested event ids are found with a single ``IN`` query and the
+    new rows are inserted together on the next flush; the unique
+    ``(user_id, event_id)`` constraint rejects anything a concurrent writer
+    slipped in first. The caller commits. Returns the number of new
+    engagements.
+
+    ``matrix`` defaults to the cached rules of the current app. Activities
+    are stored in the compact encoding of ``Engagement.activity`` unless
+    ``compact`` is false, which keeps the full JSON in ``raw_json``.
+    """
+    if matrix is None:
+        matrix = get_matrix_provider().rules(session)
+    candidates = {}
+    for item in activities:
+        event_id = item.get("id")
+        if not event_id or event_id in candidates:
+            continue
+        etype = item.get("snippet", {}).get("type", "").upper()
+        if etype not in matrix:
+            continue
+        candidates[event_id] = (etype, item)
+    if not candidates:
+        return 0
+
+    existing = {
+        event_id
+        for (event_id,) in session.query(Engagement.event_id).filter(
+            Engagement.user_id == user_id,
+            Engagement.event_id.in_(list(candidates)),
+        )
+    }
+    now = datetime.utcnow()
+    added = 0
+    for event_id, (etype, item) in candidates.items():
+        if event_id in existing:
+            continue
+        engagement = Engagement(
+            user_id=user_id,
+            event_type=EventType[etype],
+            event_id=event_id,
+            timestamp=now,
+        )
+        if compact:
+            engagement.activity = item
+        else:
+            engagement.raw_json = json.dumps(item)
+        session.add(engagement)
+        session.add(
+            PointsLedger(
+                user_id=user_id,
+                engagement=engagement,
+                points_delta=score_engagement(engagement, matrix),
+                reason=etype,
+                timestamp=now,
+            )
+        )
+        added += 1
+    return added
+
 
+def _save_cursor(session, user_id: int, cursor: dict, existing: bool) -> None:
+    values = {field: cursor.get(field) for field in CURSOR_FIELDS}
+    values["updated_at"] = datetime.utcnow()
+    if existing:
+        session.query(YouTubeSyncCursor).filter_by(user_id=user_id).update(values)
+    else:
+        session.add(YouTubeSyncCursor(user_id=user_id, **values))
 
+
+@METRICS.timed("youtube_poll_run_seconds")
 def _update_engagements(app, session_factory, socketio=None):
+    """Poll every YouTube-linked user and ingest their new engagements.
+
+    The YouTube calls run on a bounded thread pool while this thread is the
+    only one that writes to the database, so sessions are never shared.
+    Each user's engagements and sync cursor are committed together.
+    """
     if session_factory is None:
         return
+    config = app.config if app is not None else {}
+    concurrency = config.get("YOUTUBE_POLL_CONCURRENCY", POLL_CONCURRENCY)
+    timeout = config.get("YOUTUBE_POLL_TIMEOUT", POLL_TIMEOUT)
+    max_pages = config.get("YOUTUBE_POLL_MAX_PAGES", POLL_MAX_PAGES)
+    compact = config.get("ENGAGEMENT_STORAGE", "compact") == "compact"
+    updates = None
+    if socketio is not None:
+        updates = PointsUpdateBuffer(
+            socketio, config.get("POINTS_UPDATE_WINDOW", POINTS_UPDATE_WINDOW)
+        )
+
     session = session_factory()
     try:
-        oauth_rows = (
-            session.query(OAuth).filter(OAuth.provider == "youtube").all()
-        )
-        for oauth in oauth_rows:
-            try:
-                token = json.loads(oauth.token)
-            except Exception:
-                continue
-            service = _build_youtube_service(token)
-            if service is None:
-                continue
-            # Verify subscription still active
+        tokens = []
+        for user_id, token_json in session.query(OAuth.user_id, OAuth.token).filter(
+            OAuth.provider == "youtube"
+        ):
             try:
-                service.subscriptions().list(part="id", mine=True).execute()
+                tokens.append((user_id, json.loads(token_json)))
             except Exception:
                 continue
-            # Pull activities
-            activities = _fetch_activities(service)
-            for item in activities:
-                event_id = item.get("id")
-                if not event_id:
-                    continue
-                if (
-                    session.query(Engagement)
-                    .filter_by(event_id=event_id, user_id=oauth.user_id)
-                    .first()
-                ):
+        cursors = {
+            row.user_id: {field: getattr(row, field) for field in CURSOR_FIELDS}
+            for row in session.query(YouTubeSyncCursor)
+        }
+        matrix = get_matrix_provider(app).rules(session)
+        # Release the read transaction while the network calls run.
+        session.commit()
+        SERVICE_CACHE.retain(user_id for user_id, _ in tokens)
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, concurrency), thread_name_prefix="youtube-poll"
+        ) as pool:
+            futures = {
+                pool.submit(
+                    _poll_user, user_id, token, cursors.get(user_id), timeout, max_pages
+                ): user_id
+                for user_id, token in tokens
+            }
+            for future in as_completed(futures):
+                user_id = futures[future]
+                result = future.result()
+                if result is None:
                     continue
-                etype = item.get("snippet", {}).get("type", "").upper()
-                if etype not in RULES:
+                activities, cursor = result
+                previous = cursors.get(user_id)
+                try:
+                    added = _ingest_activities(session, user_id, activities, matrix, compact)
+                    if cursor != previous:
+                        _save_cursor(session, user_id, cursor, previous is not None)
+                    session.commit()
+                except IntegrityError as exc:
+                    # A concurrent run ingested some of these first; the cursor
+                    # stays put so the next poll picks up whatever is missing.
+                    session.rollback()
+                    if app is not None:
+                        app.logger.warning("Skipped engagements for user %s: %s", user_id, exc)
                     continue
-                engagement = Engagement(
-                    user_id=oauth.user_id,
-                    event_type=EventType[etype],
-                    event_id=event_id,
-                    timestamp=datetime.utcnow(),
-                    raw_json=json.dumps(item),
-                )
-                session.add(engagement)
-                session.flush()
-                apply_points(oauth.user, engagement)
-            session.commit()
-            total = get_total_points(session, oauth.user_id)
-            if socketio is not None:
-                socketio.emit(
-                    "points_update", {"user_id": oauth.user_id, "total": total}
-                )
+                if added and updates is not None:
+                    updates.push(user_id, get_total_points(session, user_id))
     finally:
         session.close()
+        if updates is not None:
+            updates.flush()
+    if app is not None:
+        app.logger.debug("YouTube service cache: %s", SERVICE_CACHE.stats())
 
 
-def schedule_points_recalc(event_type):
-    """Placeholder to trigger async recalculation of user points."""
-    try:
-        from celery import shared_task  # type: ignore
-    except Exception:  # pragma: no cover - Celery not available
-        shared_task = None  # type: ignore
-
-    if shared_task is None:
-        # In absence of Celery, simply log the request
-        print(f"Recalculate points for event type {event_type}")
-        return
+def schedule_points_recalc(event_type, engine=None) -> Optional[int]:
+    """Queue a points recalculation for ``event_type`` and return the job id.
 
-    @shared_task
-    def _recalc(event):
-        print(f"Recalculating points for {event}")
+    Uses the app's ``RecalcEngine`` unless ``engine`` is given; returns
+    ``None`` when no engine is configured.
+    """
+    if engine is None:
+        try:
+            from flask import current_app
 
-    _recalc.delay(event_type)
+            engine = getattr(current_app, "recalc_engine", None)
+        except Exception:  # pragma: no cover - Flask not available or no context
+            engine = None
+    if engine is None:
+        logger.warning("No recalculation engine; skipped points recalc for %s", event_type)
+        return None
+    return engine.submit(event_type)
@@ -0,0 +1,114 @@
+"""Compact encoding of stored YouTube activities.
+
+The fields the app queries and scores on live in typed ``Engagement``
+columns; everything else is kept as zlib-compressed compact JSON. A preset
+dictionary of the keys and values every activity repeats lets even a
+single small activity compress well. Blobs start with a format byte so the
+encoding can change without rewriting old rows.
+"""
+from __future__ import annotations
+
+import json
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Optional, Tuple
+
+FORMAT_ZLIB_V1 = 1
+
+_THUMBNAIL = {"url": "https://i.ytimg.com/vi//default.jpg", "width": 120, "height": 90}
+# Never change: rows written with format 1 need this exact dictionary
+_ZDICT_V1 = json.dumps(
+    {
+        "kind": "youtube#activity",
+        "etag": "",
+        "snippet": {
+            "title": "",
+            "description": "",
+            "thumbnails": {
+                "default": _THUMBNAIL,
+                "medium": {"url": "https://i.ytimg.com/vi//mqdefault.jpg", "width": 320, "height": 180},
+                "high": {"url": "https://i.ytimg.com/vi//hqdefault.jpg", "width": 480, "height": 360},
+                "standard": {"url": "https://i.ytimg.com/vi//sddefault.jpg", "width": 640, "height": 480},
+                "maxres": {"url": "https://i.ytimg.com/vi//maxresdefault.jpg", "width": 1280, "height": 720},
+            },
+            "channelTitle": "",
+            "type": "upload like comment subscription playlistItem bulletin",
+            "groupId": "",
+        },
+        "contentDetails": {
+            "upload": {"videoId": ""},
+            "like": {"resourceId": {"kind": "youtube#video", "videoId": ""}},
+            "playlistItem": {"resourceId": {"kind": "youtube#video", "videoId": ""}, "playlistId": ""},
+            "subscription": {"resourceId": {"kind": "youtube#channel", "channelId": ""}},
+            "comment": {"resourceId": {"kind": "youtube#video", "videoId": ""}},
+        },
+    },
+    separators=(",", ":"),
+).encode()
+
+
+def parse_published(value: Optional[str]) -> Optional[datetime]:
+    """Parse a YouTube ``publishedAt`` value into naive UTC, or ``None``."""
+    if not value:
+        return None
+    try:
+        published = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if published.tzinfo is not None:
+        published = published.astimezone(timezone.utc).replace(tzinfo=None)
+    return published
+
+
+def _format_published(value: datetime) -> str:
+    return value.isoformat() + "Z"
+
+
+def pack_activity(
+    item: dict, event_id: Optional[str] = None
+) -> Tuple[Optional[datetime], Optional[str], bytes]:
+    """Split ``item`` into ``(published_at, channel_id, blob)``.
+
+    Values go to the typed columns only when ``unpack_activity`` can put
+    them back exactly, so the round trip is lossless.
+    """
+    rest = dict(item)
+    if event_id is not None and rest.get("id") == event_id:
+        del rest["id"]
+    published_at = channel_id = None
+    snippet = rest.get("snippet")
+    if isinstance(snippet, dict):
+        snippet = rest["snippet"] = dict(snippet)
+        published_at = parse_published(snippet.get("publishedAt"))
+        if published_at is not None and _format_published(published_at) == snippet["publishedAt"]:
+            del snippet["publishedAt"]
+        channel_id = snippet.get("channelId")
+        if isinstance(channel_id, str):
+            del snippet["channelId"]
+        else:
+            channel_id = None
+    compressor = zlib.compressobj(9, zdict=_ZDICT_V1)
+    data = json.dumps(rest, separators=(",", ":")).encode()
+    return published_at, channel_id, bytes([FORMAT_ZLIB_V1]) + compressor.compress(data) + compressor.flush()
+
+
+def unpack_activity(
+    blob: bytes,
+    event_id: Optional[str] = None,
+    published_at: Optional[datetime] = None,
+    channel_id: Optional[str] = None,
+) -> dict:
+    """Rebuild the activity ``pack_activity`` split up."""
+    if blob[0] != FORMAT_ZLIB_V1:
+        raise ValueError(f"Unknown activity format {blob[0]}")
+    decompressor = zlib.decompressobj(zdict=_ZDICT_V1)
+    item: dict[str, Any] = json.loads(decompressor.decompress(blob[1:]) + decompressor.flush())
+    if event_id is not None and "id" not in item:
+        item = {"id": event_id, **item}
+    snippet = item.get("snippet")
+    if isinstance(snippet, dict):
+        if published_at is not None and "publishedAt" not in snippet:
+            snippet["publishedAt"] = _format_published(published_at)
+        if channel_id is not None and "channelId" not in snippet:
+            snippet["channelId"] = channel_id
+    return item
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import requests
+
+CHANNELS_URL = "https://www.googleapis.com/youtube/v3/channels"
+# The channels endpoint accepts at most 50 comma separated IDs per call
+BATCH_SIZE = 50
+
+logger = logging.getLogger(__name__)
+
+
+def channel_url(cid: str) -> str:
+    return f"https://www.youtube.com/channel/{cid}"
+
+
+class ChannelCache:
+    """Channel metadata cache with TTL and stale-while-revalidate refresh.
+
+    Fresh entries are served straight from memory. Once older than ``ttl``
+    they are still served for up to ``stale_ttl`` more seconds while a single
+    background thread refreshes them; after that a request refreshes
+    synchronously. All channels are fetched with batched ``id=a,b,c`` calls
+    over one pooled ``requests.Session``.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        channel_ids: Iterable[str],
+        ttl: float = 3600.0,
+        stale_ttl: float = 86400.0,
+        http: Optional[requests.Session] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.api_key = api_key
+        self.channel_ids = list(channel_ids)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.http = http or requests.Session()
+        self.clock = clock
+        self._channels: Optional[List[Dict[str, str]]] = None
+        self._by_id: Dict[str, Dict[str, str]] = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+
+    def get_all(self) -> List[Dict[str, str]]:
+        if not self.api_key:
+            # Without an API key, return simple channel URLs
+            return [
+                {'id': cid, 'title': f'Channel {cid}', 'url': channel_url(cid)}
+                for cid in self.channel_ids
+            ]
+        if self._expired():
+            with self._fetch_lock:
+                # Another request may have refreshed while we waited
+                if self._expired():
+                    self._refresh()
+        elif self.clock() - self._fetched_at >= self.ttl:
+            self._refresh_in_background()
+        return list(self._channels or [])
+
+    def get(self, cid: str) -> Optional[Dict[str, str]]:
+        if not self.api_key:
+            if cid not in self.channel_ids:
+                return None
+            return {'id': cid, 'title': f'Channel {cid}', 'url': channel_url(cid)}
+        self.get_all()
+        return self._by_id.get(cid)
+
+    def refresh(self) -> None:
+        """Fetch metadata for every channel, keeping old data on failure."""
+        with self._fetch_lock:
+            self._refresh()
+
+    def _expired(self) -> bool:
+        age = self.clock() - self._fetched_at
+        return self._channels is None or age >= self.ttl + self.stale_ttl
+
+    def _refresh(self) -> None:
+        try:
+            titles = self._fetch_titles()
+        except Exception as exc:
+            logger.warning("Channel metadata refresh failed: %s", exc)
+            if self._channels is None:
+                # Serve an empty list but retry in the background next time
+                self._store([], fetched_at=self.clock() - self.ttl)
+            return
+        self._store([
+            {'id': cid, 'title': titles[cid], 'url': channel_url(cid)}
+            for cid in self.channel_ids
+            if cid in titles
+        ])
+
+    def _store(self, channels: List[Dict[str, str]], fetched_at: Optional[float] = None) -> None:
+        with self._lock:
+            self._channels = channels
+            self._by_id = {c['id']: c for c in channels}
+            self._fetched_at = self.clock() if fetched_at is None else fetched_at
+
+    def _fetch_titles(self) -> Dict[str, str]:
+        titles = {}
+        for start in range(0, len(self.channel_ids), BATCH_SIZE):
+            batch = self.channel_ids[start:start + BATCH_SIZE]
+            resp = self.http.get(
+                CHANNELS_URL,
+                params={
+                    'part': 'snippet',
+                    'id': ','.join(batch),
+                    'maxResults': BATCH_SIZE,
+                    'key': self.api_key,
+                },
+                timeout=10,
+            )
+            resp.raise_for_status()
+            for item in resp.json().get('items', []):
+                titles[item['id']] = item['snippet']['title']
+        return titles
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(
+                target=self.refresh, name="channel-refresh", daemon=True
+            )
+            self._refresher.start()
@@ -1,11 +1,27 @@
 from __future__ import annotations
 
+import json
+import threading
+import time
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Tuple
 
+from sqlalchemy import func, insert
 from sqlalchemy.orm import object_session
 
-from ..models import EventType, PointsLedger, get_total_points
+from .. import models
+from ..metrics import METRICS
+from ..models import (
+    EventType,
+    PointsLedger,
+    PointsMatrix,
+    PointsMatrixVersion,
+    UserPointsBalance,
+    bump_points_balances,
+    bump_points_rollups,
+    get_total_points,
+    mark_points_changed,
+)
 
 # Default matrix if not provided via Flask config
 DEFAULT_POINT_MATRIX: Dict[str, Any] = {
@@ -16,19 +32,139 @@ DEFAULT_POINT_MATRIX: Dict[str, Any] = {
 }
 
 
-def _get_matrix() -> Dict[str, Any]:
-    """Fetch the points matrix from Flask config if available."""
-    try:  # Only available when Flask is installed and an app context is active
-        from flask import current_app
+# Seconds a cached matrix is trusted before its version is checked again
+MATRIX_CHECK_INTERVAL = 5.0
 
-        matrix = current_app.config.get("POINT_MATRIX")
-        if matrix is not None:
-            return matrix
-    except Exception:  # pragma: no cover - Flask not available or no context
-        pass
-    return DEFAULT_POINT_MATRIX
 
+def compile_rule(rule) -> Callable[[Any], int]:
+    """Turn a matrix value (points or a callable) into ``engagement -> int``."""
+    if callable(rule):
+        return lambda engagement: int(rule(engagement))
+    points = int(rule)
+    return lambda engagement: points
 
+
+class PointsMatrixProvider:
+    """Cached point rules shared by every code path that scores engagements.
+
+    Rules are ``DEFAULT_POINT_MATRIX`` overlaid with the ``POINT_MATRIX``
+    config value and then with the ``PointsMatrix`` table that admins edit,
+    compiled into callables once. The table is reloaded only when its
+    version counter moves: commits in this process invalidate immediately
+    and other processes' edits are noticed within ``check_interval``
+    seconds, so scoring an engagement costs no query.
+    """
+
+    def __init__(
+        self,
+        config: Optional[Mapping[str, Any]] = None,
+        check_interval: float = MATRIX_CHECK_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.config = config
+        self.check_interval = check_interval
+        self.clock = clock
+        self._entries: Dict[Any, tuple] = {}
+        self._lock = threading.Lock()
+
+    def rules(self, session=None, refresh: bool = False) -> Dict[str, Callable[[Any], int]]:
+        """Return ``{event type name: rule}``.
+
+        ``refresh`` checks the stored version now instead of trusting a
+        recent check; use it where a stale matrix is not acceptable.
+        """
+        overrides = self.config.get("POINT_MATRIX") if self.config is not None else None
+        generation = models.points_matrix_generation
+        bind = session.get_bind() if session is not None else None
+        with self._lock:
+            entry = self._entries.get(bind)
+        if entry is not None and entry[0] == generation and entry[3] is overrides:
+            if not refresh and self.clock() - entry[2] < self.check_interval:
+                return entry[4]
+        if session is None:
+            version, table = 0, {}
+        else:
+            version = session.query(PointsMatrixVersion.version).filter_by(id=1).scalar() or 0
+            if entry is not None and entry[1] == version and entry[3] is overrides:
+                table = None
+            else:
+                table = {
+                    etype.name: value
+                    for etype, value in session.query(PointsMatrix.event_type, PointsMatrix.value)
+                }
+        if table is None:
+            rules = entry[4]
+        else:
+            matrix = dict(DEFAULT_POINT_MATRIX)
+            matrix.update(overrides or {})
+            matrix.update(table)
+            rules = {name: compile_rule(rule) for name, rule in matrix.items()}
+        with self._lock:
+            self._entries[bind] = (generation, version, self.clock(), overrides, rules)
+        return rules
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+DEFAULT_PROVIDER = PointsMatrixProvider()
+
+
+def get_matrix_provider(app=None) -> PointsMatrixProvider:
+    """Return ``app``'s provider (default: the current Flask app's), creating it once."""
+    if app is None:
+        try:  # Only available when Flask is installed and an app context is active
+            from flask import current_app
+
+            app = current_app._get_current_object()
+        except Exception:  # pragma: no cover - Flask not available or no context
+            return DEFAULT_PROVIDER
+    provider = getattr(app, "points_matrix", None)
+    if provider is None:
+        provider = app.points_matrix = PointsMatrixProvider(app.config)
+    return provider
+
+
+class _ScoredEngagement:
+    """An engagement as callable rules see it, ``raw_json`` included.
+
+    Rows in the compact encoding keep no ``raw_json``; rules written against
+    it get the JSON of ``Engagement.activity``, decoded only if they read it.
+    """
+
+    __slots__ = ("_engagement",)
+
+    def __init__(self, engagement):
+        self._engagement = engagement
+
+    def __getattr__(self, name):
+        if name == "raw_json":
+            activity = self._engagement.activity
+            return json.dumps(activity) if activity is not None else None
+        return getattr(self._engagement, name)
+
+
+def score_engagement(engagement, matrix: Dict[str, Any] | None = None) -> int:
+    """Return the points an engagement is worth under ``matrix``.
+
+    Without ``matrix`` the current app's cached rules are used. Callable
+    rules can read the activity as ``engagement.activity`` or, however the
+    row is stored, as ``engagement.raw_json``.
+    """
+    if matrix is None:
+        matrix = get_matrix_provider().rules(object_session(engagement))
+    rule = matrix.get(engagement.event_type.name)
+    if rule is None:
+        return 0
+    if callable(rule):
+        if engagement.raw_json is None:
+            engagement = _ScoredEngagement(engagement)
+        return int(rule(engagement))
+    return int(rule)
+
+
+@METRICS.timed("points_apply_seconds", mode="single")
 def apply_points(user, engagement) -> int:
     """Apply points for an engagement.
 
@@ -41,15 +177,7 @@ def apply_points(user, engagement) -> int:
     if session is None:
         raise RuntimeError("User object is not attached to a session")
 
-    matrix = _get_matrix()
-    rule = matrix.get(engagement.event_type.name)
-    if rule is None:
-        delta = 0
-    elif callable(rule):
-        delta = int(rule(engagement))
-    else:
-        delta = int(rule)
-
+    delta = score_engagement(engagement, get_matrix_provider().rules(session))
     ledger = PointsLedger(
         user_id=user.id,
         engagement=engagement,
@@ -60,3 +188,128 @@ def apply_points(user, engagement) -> int:
     session.add(ledger)
     session.commit()
     return get_total_points(session, user.id)
+
+
+@METRICS.timed("points_apply_seconds", mode="bulk")
+def apply_points_bulk(session, engagements: Iterable[Any]) -> Dict[int, int]:
+    """Apply points for many engagements in one transaction.
+
+    Every engagement is scored against the same cached rules and gets its own
+    ledger row, as with ``apply_points``; the rows are inserted in a single
+    statement, the balances are bumped once per user and the transaction is
+    committed once. Returns ``{user_id: new_total}`` read from the
+    materialized balances just bumped, not by summing the ledger.
+    """
+    engagements = list(engagements)
+    if not engagements:
+        return {}
+    # New engagements need their primary keys before the ledger can point at them
+    session.flush()
+    rules = get_matrix_provider().rules(session)
+    now = datetime.utcnow()
+    rows = []
+    deltas: Dict[int, int] = {}
+    for engagement in engagements:
+        delta = score_engagement(engagement, rules)
+        rows.append({
+            "user_id": engagement.user_id,
+            "engagement_id": engagement.id,
+            "points_delta": delta,
+            "reason": engagement.event_type.name,
+            "timestamp": now,
+        })
+        deltas[engagement.user_id] = deltas.get(engagement.user_id, 0) + delta
+    # A bulk insert skips the flush hooks, so balances and rollups are bumped here
+    session.execute(insert(PointsLedger), rows)
+    bump_points_balances(session.connection(), deltas)
+    bump_points_rollups(
+        session.connection(),
+        [(row["user_id"], row["reason"], now, row["points_delta"]) for row in rows],
+    )
+    mark_points_changed(session, deltas)
+    totals = dict(
+        session.query(UserPointsBalance.user_id, UserPointsBalance.total)
+        .filter(UserPointsBalance.user_id.in_(list(deltas)))
+        .all()
+    )
+    session.commit()
+    return {user_id: totals.get(user_id, 0) for user_id in deltas}
+
+
+class PointsCache:
+    """Short-lived per-user totals for page renders.
+
+    Entries are dropped as soon as a commit in this process changes the
+    user's balance; writes from other processes show up within ``ttl``.
+    """
+
+    def __init__(self, ttl: float = 5.0, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: Dict[int, Tuple[float, int]] = {}
+        self._invalidations = 0
+        self._lock = threading.Lock()
+        models.points_subscribers.add(self)
+
+    def get(self, session_factory: Callable[[], Any], user_id: int) -> int:
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            invalidations = self._invalidations
+        session = session_factory()
+        try:
+            total = get_total_points(session, user_id)
+        finally:
+            session.close()
+        with self._lock:
+            # Do not cache a total read while a write was being committed
+            if invalidations == self._invalidations:
+                self._entries[user_id] = (now + self.ttl, total)
+        return total
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._invalidations += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._entries.clear()
+
+
+def rebuild_points_balances(
+    session, apply: bool = True, user_ids: Optional[Iterable[int]] = None
+) -> Dict[int, Tuple[int, int]]:
+    """Recompute ``UserPointsBalance`` rows from the ledger.
+
+    Returns ``{user_id: (stored, expected)}`` for every balance that drifted
+    from the ledger sum. When ``apply`` is true the drift is corrected in the
+    same transaction the totals were read in. ``user_ids`` limits the work
+    to those users.
+    """
+    sums = session.query(PointsLedger.user_id, func.sum(PointsLedger.points_delta))
+    balances = session.query(UserPointsBalance.user_id, UserPointsBalance.total)
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        sums = sums.filter(PointsLedger.user_id.in_(user_ids))
+        balances = balances.filter(UserPointsBalance.user_id.in_(user_ids))
+    expected = dict(sums.group_by(PointsLedger.user_id).all())
+    stored = dict(balances.all())
+    drift = {}
+    for user_id in expected.keys() | stored.keys():
+        have = stored.get(user_id, 0)
+        want = expected.get(user_id) or 0
+        if have != want:
+            drift[user_id] = (have, want)
+    if apply and drift:
+        bump_points_balances(
+            session.connection(),
+            {uid: want - have for uid, (have, want) in drift.items()},
+        )
+        mark_points_changed(session, drift)
+        session.commit()
+    return drift
@@ -1,7 +1,25 @@
+import codecs
+import gzip
+import json
 import os
 import random
 import re
-from typing import Dict, List
+import sys
+import tempfile
+import threading
+import zlib
+from array import array
+from typing import BinaryIO, Dict, Iterable, List, Optional, Union
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.idx'
+CHUNK_SIZE = 64 * 1024
+
+_TRAILING_WORD = re.compile(r"\w+\Z")
+
+
+class TranscriptTooLarge(ValueError):
+    """Raised when an uploaded transcript exceeds the configured size."""
 
 
 def load_transcript(path: str) -> str:
@@ -13,16 +31,262 @@ def _words(text: str) -> List[str]:
     return re.findall(r"\b\w+\b", text)
 
 
-def generate_question(transcript: str) -> Dict[str, object]:
-    words = _words(transcript)
-    if len(words) < 4:
+class TranscriptIndex:
+    """Tokenized transcript used to generate quiz questions.
+
+    ``tokens`` holds one vocabulary id per word in transcript order, so the
+    word at position ``i`` is ``vocab[tokens[i]]`` and ``freqs[j]`` is how
+    often ``vocab[j]`` occurs.
+    """
+
+    def __init__(self, vocab: List[str], tokens: array, freqs: Optional[List[int]] = None):
+        self.vocab = vocab
+        self.tokens = tokens
+        if freqs is None:
+            freqs = [0] * len(vocab)
+            for token in tokens:
+                freqs[token] += 1
+        self.freqs = freqs
+
+    @classmethod
+    def from_text(cls, text: str) -> 'TranscriptIndex':
+        builder = TranscriptIndexBuilder()
+        builder.feed(text)
+        return builder.finish()
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def word(self, position: int) -> str:
+        return self.vocab[self.tokens[position]]
+
+
+class TranscriptIndexBuilder:
+    """Build a ``TranscriptIndex`` incrementally from chunks of text.
+
+    A word cut in two by a chunk boundary is held back until the next chunk
+    (or ``finish``) completes it.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._vocab: List[str] = []
+        self._freqs: List[int] = []
+        self._tokens = array('I')
+        self._tail = ''
+
+    def feed(self, text: str) -> None:
+        text = self._tail + text
+        match = _TRAILING_WORD.search(text)
+        if match:
+            self._tail = text[match.start():]
+            text = text[:match.start()]
+        else:
+            self._tail = ''
+        for word in _words(text):
+            self._add(word)
+
+    def _add(self, word: str) -> None:
+        token = self._ids.get(word)
+        if token is None:
+            token = self._ids[word] = len(self._vocab)
+            self._vocab.append(word)
+            self._freqs.append(0)
+        self._freqs[token] += 1
+        self._tokens.append(token)
+
+    def finish(self) -> TranscriptIndex:
+        for word in _words(self._tail):
+            self._add(word)
+        self._tail = ''
+        return TranscriptIndex(self._vocab, self._tokens, self._freqs)
+
+
+def index_path(transcript_path: str) -> str:
+    return os.path.splitext(transcript_path)[0] + INDEX_SUFFIX
+
+
+def save_index(index: TranscriptIndex, path: str) -> None:
+    """Write ``index`` as gzip: a length-prefixed JSON header, then raw uint32 tokens."""
+    header = json.dumps(
+        {'version': INDEX_VERSION, 'vocab': index.vocab, 'freqs': index.freqs},
+        separators=(',', ':'),
+    ).encode('utf-8')
+    tokens = index.tokens
+    if sys.byteorder != 'little':
+        tokens = array('I', tokens)
+        tokens.byteswap()
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+            f.write(len(header).to_bytes(4, 'little'))
+            f.write(header)
+            f.write(tokens.tobytes())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load_index(path: str) -> TranscriptIndex:
+    with gzip.open(path, 'rb') as f:
+        size = int.from_bytes(f.read(4), 'little')
+        header = json.loads(f.read(size))
+        if header.get('version') != INDEX_VERSION:
+            raise ValueError(f"Unsupported transcript index version {header.get('version')}")
+        tokens = array('I')
+        tokens.frombytes(f.read())
+    if sys.byteorder != 'little':
+        tokens.byteswap()
+    return TranscriptIndex(header['vocab'], tokens, header['freqs'])
+
+
+_index_cache: Dict[str, tuple] = {}
+_index_lock = threading.Lock()
+
+
+def _stamp(path: str) -> tuple:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def get_index(transcript_path: str) -> TranscriptIndex:
+    """Return the cached index for a transcript, loading or building it once.
+
+    Entries are keyed on the index file's mtime and size, so a re-upload
+    that rewrites the index is picked up even by other worker processes.
+    """
+    path = index_path(transcript_path)
+    try:
+        stamp = _stamp(path)
+    except FileNotFoundError:
+        # Transcript uploaded before indexes existed
+        save_index(TranscriptIndex.from_text(load_transcript(transcript_path)), path)
+        stamp = _stamp(path)
+    with _index_lock:
+        cached = _index_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    index = load_index(path)
+    with _index_lock:
+        _index_cache[path] = (stamp, index)
+    return index
+
+
+def store_index(transcript_path: str, index: TranscriptIndex) -> None:
+    """Persist ``index`` for a transcript and make it the cached copy."""
+    path = index_path(transcript_path)
+    save_index(index, path)
+    with _index_lock:
+        _index_cache[path] = (_stamp(path), index)
+
+
+def _decompressed(stream: BinaryIO, chunk_size: int) -> Iterable[bytes]:
+    # Cap each decompression step so a gzip bomb cannot balloon in memory.
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        while data:
+            out = decompressor.decompress(data, chunk_size)
+            if out:
+                yield out
+            data = decompressor.unconsumed_tail
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def write_transcript(
+    stream: BinaryIO,
+    path: str,
+    max_bytes: int,
+    gzipped: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+) -> Optional[TranscriptIndex]:
+    """Stream an uploaded transcript to ``path`` and index it on the way.
+
+    The body is read in ``chunk_size`` pieces, written to a temporary file and
+    atomically renamed into place, so readers never see a partial file. Raises
+    ``TranscriptTooLarge`` once more than ``max_bytes`` of (decompressed) text
+    arrive and ``zlib.error`` for corrupt gzip data; nothing is written in
+    either case. Returns ``None`` for an empty upload.
+    """
+    if gzipped:
+        chunks = _decompressed(stream, chunk_size)
+    else:
+        chunks = iter(lambda: stream.read(chunk_size), b'')
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    builder = TranscriptIndexBuilder()
+    received = 0
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            for chunk in chunks:
+                received += len(chunk)
+                if received > max_bytes:
+                    raise TranscriptTooLarge(f"Transcript exceeds {max_bytes} bytes")
+                text = decoder.decode(chunk)
+                out.write(text)
+                builder.feed(text)
+            text = decoder.decode(b'', final=True)
+            out.write(text)
+            builder.feed(text)
+        if not received:
+            os.unlink(tmp)
+            return None
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return builder.finish()
+
+
+def generate_questions(
+    transcript: Union[str, TranscriptIndex],
+    count: int = 1,
+    rng: Optional[random.Random] = None,
+) -> List[Dict[str, object]]:
+    """Generate ``count`` questions in one pass over the transcript index.
+
+    Distractors are three distinct vocabulary ids sampled without
+    replacement, so each question takes constant time however small the
+    vocabulary. Pass a seeded ``rng`` for reproducible (and thread-safe)
+    output. Returns an empty list when there are fewer than four distinct
+    words.
+    """
+    if isinstance(transcript, TranscriptIndex):
+        index = transcript
+    else:
+        index = TranscriptIndex.from_text(transcript)
+    if rng is None:
+        rng = random.Random()
+    tokens = index.tokens
+    vocab = index.vocab
+    if len(vocab) < 4:
+        return []
+    questions = []
+    for _ in range(count):
+        idx = rng.randrange(len(tokens))
+        correct = tokens[idx]
+        # Sample from every id but the answer by shifting ids past it up one
+        option_ids = [correct] + [
+            pick + (pick >= correct) for pick in rng.sample(range(len(vocab) - 1), 3)
+        ]
+        rng.shuffle(option_ids)
+        questions.append({
+            "question": f"Which word appears in the transcript near position {idx + 1}?",
+            "options": [vocab[token] for token in option_ids],
+        })
+    return questions
+
+
+def generate_question(
+    transcript: Union[str, TranscriptIndex], rng: Optional[random.Random] = None
+) -> Dict[str, object]:
+    questions = generate_questions(transcript, 1, rng)
+    if not questions:
         return {"question": "Transcript too short", "options": []}
-    idx = random.randrange(len(words))
-    correct = words[idx]
-    options = {correct}
-    while len(options) < 4:
-        options.add(random.choice(words))
-    options_list = list(options)
-    random.shuffle(options_list)
-    question = f"Which word appears in the transcript near position {idx + 1}?"
-    return {"question": question, "options": options_list}
+    return questions[0]
@@ -0,0 +1,118 @@
+"""Bytes per engagement for raw JSON versus the compact activity encoding.
+
+Generates YouTube activities shaped like the ``activities.list`` items the
+poller stores, then stores them in two SQLite databases, one per
+``ENGAGEMENT_STORAGE`` mode. It reports the payload bytes per row and the
+database file sizes.
+
+    python -m benchmarks.activity_storage --rows 100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import string
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, text
+
+from app.models import Base, Engagement
+from app.utils.activity import pack_activity
+
+# Activity types the poller keeps (see ``_ingest_activities``)
+KINDS = ("like", "comment")
+WORDS = ["podcast", "episode", "live", "giveaway", "review", "news", "clip", "interview", "q&a", "update"]
+
+BATCH = 5_000
+
+
+def _token(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(string.ascii_letters + string.digits + "-_") for _ in range(length))
+
+
+def make_activity(rng: random.Random, n: int, start: datetime) -> dict:
+    kind = rng.choice(KINDS)
+    video_id = _token(rng, 11)
+    published = start + timedelta(seconds=n * 37)
+    thumbnails = {
+        name: {"url": f"https://i.ytimg.com/vi/{video_id}/{name}.jpg", "width": width, "height": height}
+        for name, width, height in (("default", 120, 90), ("medium", 320, 180), ("high", 480, 360))
+    }
+    details = {"resourceId": {"kind": "youtube#video", "videoId": video_id}}
+    return {
+        "kind": "youtube#activity",
+        "etag": _token(rng, 27),
+        "id": _token(rng, 40),
+        "snippet": {
+            "publishedAt": published.isoformat() + "Z",
+            "channelId": "UC" + _token(rng, 22),
+            "title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 9))).title(),
+            "description": " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 40))),
+            "thumbnails": thumbnails,
+            "channelTitle": " ".join(rng.choice(WORDS) for _ in range(2)).title(),
+            "type": kind,
+        },
+        "contentDetails": {kind: details},
+    }
+
+
+def _store(path: str, activities: list, compact: bool) -> int:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine, tables=[Engagement.__table__])
+    rows = []
+    for n, item in enumerate(activities):
+        row = {
+            "user_id": 1 + n % 1000,
+            "event_type": item["snippet"]["type"].upper(),
+            "event_id": item["id"],
+            "timestamp": datetime(2024, 1, 1),
+        }
+        if compact:
+            row["published_at"], row["channel_id"], row["activity_blob"] = pack_activity(item, item["id"])
+        else:
+            row["raw_json"] = json.dumps(item)
+        rows.append(row)
+    with engine.begin() as conn:
+        for offset in range(0, len(rows), BATCH):
+            conn.execute(insert(Engagement.__table__), rows[offset:offset + BATCH])
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+    engine.dispose()
+    return os.path.getsize(path)
+
+
+def run(rows: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    activities = [make_activity(rng, n, start) for n in range(rows)]
+    json_bytes = sum(len(json.dumps(item).encode()) for item in activities)
+    compact_bytes = 0
+    for item in activities:
+        published_at, channel_id, blob = pack_activity(item, item["id"])
+        compact_bytes += len(blob) + len(channel_id or "") + (8 if published_at else 0)
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = _store(os.path.join(tmp, "json.db"), activities, compact=False)
+        compact_file = _store(os.path.join(tmp, "compact.db"), activities, compact=True)
+    return {
+        "rows": rows,
+        "json_bytes_per_row": round(json_bytes / rows, 1),
+        "compact_bytes_per_row": round(compact_bytes / rows, 1),
+        "saved_bytes_per_row": round((json_bytes - compact_bytes) / rows, 1),
+        "json_db_bytes": json_file,
+        "compact_db_bytes": compact_file,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.rows, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
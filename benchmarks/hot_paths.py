@@ -0,0 +1,398 @@
+"""Throughput and latency of the scoring, ingestion and leaderboard hot paths.
+
+For every ``--rows`` size, builds a SQLite database with the app's schema and
+fills it with synthetic users, engagements and ledger rows. It then times:
+
+* ``apply_points`` - one engagement scored and committed per call
+* ``apply_points_bulk`` - ``--batch`` engagements per call
+* ``get_total_points`` - a random user's balance
+* ``get_points_week`` - a random user's points for the last week (rollups)
+* ``update_engagements`` - a full poll of ``--poll-users`` users against a fake
+  YouTube service that returns ``--poll-items`` new activities each
+* ``leaderboard_loop_all`` / ``leaderboard_loop_week`` - one broadcast tick
+  with the leaderboard cache disabled
+
+The results (throughput, p50/p99 latency) are written as JSON to ``--out``.
+Pass an earlier report as ``--baseline`` to print how each case moved.
+
+    python -m benchmarks.hot_paths --rows 10000 100000 1000000 --out bench.json
+    python -m benchmarks.hot_paths --rows 10000 100000 --baseline bench.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import sqlalchemy
+from sqlalchemy import insert
+
+from app import tasks
+from app.db import init_db
+from app.leaderboard import LeaderboardCache
+from app.models import (
+    Engagement,
+    EventType,
+    OAuth,
+    PointsLedger,
+    User,
+    bump_points_balances,
+    bump_points_rollups,
+    get_total_points,
+)
+from app.rollups import get_points
+from app.utils.activity import pack_activity
+from app.utils.points import DEFAULT_POINT_MATRIX, apply_points, apply_points_bulk
+
+BATCH = 50_000
+KINDS = [kind for kind in EventType if kind.name in DEFAULT_POINT_MATRIX]
+
+
+# -- synthetic data -----------------------------------------------------------
+
+def _activity(event_id: str, kind: str, published: datetime) -> dict:
+    return {
+        "kind": "youtube#activity",
+        "etag": event_id[::-1],
+        "id": event_id,
+        "snippet": {
+            "publishedAt": published.replace(microsecond=0).isoformat() + "Z",
+            "channelId": "UCbenchmarkchannel0000000",
+            "title": "Episode discussion",
+            "type": kind.lower(),
+        },
+        "contentDetails": {kind.lower(): {"resourceId": {"kind": "youtube#video", "videoId": event_id[:11]}}},
+    }
+
+
+def build(Session, rows: int, users: int, poll_users: int, seed: int = 0) -> None:
+    """Fill the database with ``users`` users and ``rows`` engagements/ledger rows."""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    span = timedelta(days=90)
+    blobs = {
+        kind: pack_activity(_activity("seed-activity", kind.name, now), "seed-activity")
+        for kind in KINDS
+    }
+    engine = Session.get_bind()
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [{"id": uid, "username": f"user{uid}"} for uid in range(1, users + 1)])
+        conn.execute(
+            insert(OAuth.__table__),
+            [
+                {"provider": "youtube", "token": json.dumps({"access_token": f"user{uid}"}), "user_id": uid}
+                for uid in range(1, poll_users + 1)
+            ],
+        )
+    for offset in range(0, rows, BATCH):
+        engagements, ledger, totals = [], [], {}
+        for n in range(offset, min(rows, offset + BATCH)):
+            user_id = rng.randint(1, users)
+            kind = rng.choice(KINDS)
+            ts = now - span + span * (n / rows)
+            published_at, channel_id, blob = blobs[kind]
+            engagements.append({
+                "id": n + 1, "user_id": user_id, "event_type": kind.name, "event_id": f"seed-{n}",
+                "timestamp": ts, "published_at": published_at, "channel_id": channel_id,
+                "activity_blob": blob,
+            })
+            points = DEFAULT_POINT_MATRIX[kind.name]
+            ledger.append({
+                "user_id": user_id, "engagement_id": n + 1, "points_delta": points,
+                "reason": kind.name, "timestamp": ts,
+            })
+            totals[user_id] = totals.get(user_id, 0) + points
+        with engine.begin() as conn:
+            conn.execute(insert(Engagement.__table__), engagements)
+            conn.execute(insert(PointsLedger.__table__), ledger)
+            bump_points_balances(conn, totals)
+            bump_points_rollups(
+                conn, [(r["user_id"], r["reason"], r["timestamp"], r["points_delta"]) for r in ledger]
+            )
+
+
+# -- measurement --------------------------------------------------------------
+
+def _percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def measure(run: Callable[[], int], repeat: int, warmup: int = 2) -> Dict[str, float]:
+    """Call ``run`` (which returns the number of items it handled) ``repeat`` times."""
+    for _ in range(warmup):
+        run()
+    samples, items = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        items += run()
+        samples.append(time.perf_counter() - started)
+    total = sum(samples)
+    return {
+        "calls": repeat,
+        "items": items,
+        "seconds": round(total, 4),
+        "throughput_per_s": round(items / total, 1) if total else None,
+        "p50_ms": round(_percentile(samples, 50) * 1000, 3),
+        "p99_ms": round(_percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+    }
+
+
+# -- cases --------------------------------------------------------------------
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+        self.headers = {}
+
+    def execute(self):
+        return self.result
+
+
+class FakeYouTube:
+    """Returns ``items`` fresh activities per poll, newest first, like the API."""
+
+    feed = {"round": 0, "items": 10, "clock": datetime.utcnow()}
+
+    def __init__(self, user: str):
+        self.user = user
+
+    def subscriptions(self):
+        return self
+
+    def activities(self):
+        return self
+
+    def list(self, **kwargs):
+        if kwargs.get("part") == "id":
+            return FakeRequest({"items": []})
+        feed = self.feed
+        published = feed["clock"] + timedelta(seconds=feed["round"])
+        kinds = [kind.name for kind in KINDS]
+        items = [
+            _activity(f"{self.user}-{feed['round']}-{n}", kinds[n % len(kinds)], published)
+            for n in range(feed["items"])
+        ]
+        return FakeRequest({"items": items, "etag": f"r{feed['round']}"})
+
+
+class _Tick(Exception):
+    pass
+
+
+class LoopSocketIO:
+    """Just enough of Flask-SocketIO to run ``leaderboard_loop`` one tick at a time."""
+
+    def __init__(self):
+        self.task = None
+        self.emits = 0
+
+    def on(self, event):
+        return lambda handler: handler
+
+    def emit(self, *args, **kwargs):
+        self.emits += 1
+
+    def start_background_task(self, target):
+        self.task = target
+
+    def sleep(self, seconds):
+        raise _Tick
+
+
+def _leaderboard_tick(Session, window: str) -> Callable[[], int]:
+    from app.socket_events import init_socket_events
+
+    app = types.SimpleNamespace(
+        config={"LEADERBOARD_WINDOW": window}, leaderboard_cache=LeaderboardCache(ttl=0)
+    )
+    socketio = LoopSocketIO()
+    loop = init_socket_events(app, Session, socketio)
+
+    def tick() -> int:
+        try:
+            loop()
+        except _Tick:
+            pass
+        return 1
+
+    return tick
+
+
+def cases(Session, users: int, poll_users: int, args, rng: random.Random) -> Dict[str, Callable[[], int]]:
+    counter = iter(range(10 ** 12))
+
+    def new_engagement(session, user_id):
+        kind = rng.choice(KINDS)
+        engagement = Engagement(
+            user_id=user_id, event_type=kind, event_id=f"bench-{next(counter)}",
+            timestamp=datetime.utcnow(),
+        )
+        session.add(engagement)
+        return engagement
+
+    def one_apply() -> int:
+        session = Session()
+        try:
+            user = session.get(User, rng.randint(1, users))
+            apply_points(user, new_engagement(session, user.id))
+        finally:
+            session.close()
+        return 1
+
+    def bulk_apply() -> int:
+        session = Session()
+        try:
+            engagements = [new_engagement(session, rng.randint(1, users)) for _ in range(args.batch)]
+            apply_points_bulk(session, engagements)
+        finally:
+            session.close()
+        return args.batch
+
+    def total() -> int:
+        session = Session()
+        try:
+            get_total_points(session, rng.randint(1, users))
+        finally:
+            session.close()
+        return 1
+
+    def week() -> int:
+        session = Session()
+        try:
+            get_points(session, rng.randint(1, users), since=datetime.utcnow() - timedelta(days=7))
+        finally:
+            session.close()
+        return 1
+
+    def poll() -> int:
+        FakeYouTube.feed["round"] += 1
+        tasks._update_engagements(None, Session)
+        return poll_users * args.poll_items
+
+    return {
+        "apply_points": one_apply,
+        "apply_points_bulk": bulk_apply,
+        "get_total_points": total,
+        "get_points_week": week,
+        "update_engagements": poll,
+        "leaderboard_loop_all": _leaderboard_tick(Session, "all"),
+        "leaderboard_loop_week": _leaderboard_tick(Session, "week"),
+    }
+
+
+def run_size(rows: int, args, path: str) -> List[dict]:
+    users = args.users or max(100, rows // 100)
+    poll_users = min(args.poll_users, users)
+    Session = init_db(f"sqlite:///{path}")
+    started = time.perf_counter()
+    build(Session, rows, users, poll_users, seed=args.seed)
+    build_seconds = time.perf_counter() - started
+
+    FakeYouTube.feed.update(round=0, items=args.poll_items, clock=datetime.utcnow())
+    tasks.SERVICE_CACHE = tasks.YouTubeServiceCache()
+    original_build = tasks._build_youtube_service
+    tasks._build_youtube_service = lambda token, timeout=None: FakeYouTube(token["access_token"])
+    results = []
+    try:
+        rng = random.Random(args.seed + 1)
+        for name, run in cases(Session, users, poll_users, args, rng).items():
+            if args.only and name not in args.only:
+                continue
+            repeat = args.poll_repeat if name == "update_engagements" else args.repeat
+            result = {"rows": rows, "users": users, "case": name}
+            result.update(measure(run, repeat))
+            results.append(result)
+            print(json.dumps(result), flush=True)
+    finally:
+        tasks._build_youtube_service = original_build
+        Session.remove()
+        Session.get_bind().dispose()
+    results.insert(0, {"rows": rows, "users": users, "build_seconds": round(build_seconds, 2)})
+    return results
+
+
+def _commit() -> Optional[str]:
+    # The checkout this file belongs to, wherever the benchmark is run from
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """Lines describing how each case's p50 moved against ``baseline``."""
+    before = {(r["rows"], r["case"]): r for r in baseline["results"] if "case" in r}
+    lines = []
+    for result in report["results"]:
+        old = before.get((result.get("rows"), result.get("case")))
+        if old is None or not old["p50_ms"]:
+            continue
+        change = result["p50_ms"] / old["p50_ms"] - 1
+        flag = "REGRESSION" if change > threshold else "ok"
+        lines.append(
+            f"{flag:10} {result['case']:24} rows={result['rows']:<9} "
+            f"p50 {old['p50_ms']:.3f} -> {result['p50_ms']:.3f} ms ({change:+.0%})"
+        )
+    return lines
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000], help="ledger sizes to test")
+    parser.add_argument("--users", type=int, help="users per database (default rows / 100)")
+    parser.add_argument("--repeat", type=int, default=200, help="calls per case")
+    parser.add_argument("--batch", type=int, default=500, help="engagements per apply_points_bulk call")
+    parser.add_argument("--poll-users", type=int, default=200, help="YouTube-linked users per poll")
+    parser.add_argument("--poll-items", type=int, default=10, help="new activities per user per poll")
+    parser.add_argument("--poll-repeat", type=int, default=10, help="polls to time")
+    parser.add_argument("--only", nargs="+", help="cases to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db-dir", help="where to build the databases (default: a temp dir)")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p50 slowdown flagged as a regression")
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.db_dir:
+        os.makedirs(args.db_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as tmp:
+        for rows in args.rows:
+            results.extend(run_size(rows, args, os.path.join(tmp, f"bench-{rows}.db")))
+    report = {
+        "commit": _commit(),
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "args": {key: value for key, value in vars(args).items() if key not in ("out", "baseline")},
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(report, out, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            for line in compare(report, json.load(baseline), args.threshold):
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Hot query timings on a large ledger before and after the schema v2 indexes.
+
+Builds a SQLite database shaped like one created before schema versioning
+(no secondary indexes), fills it with ``--rows`` engagements and one ledger
+row each, times the lookups the app runs most, applies the real v2
+migration step and times them again.
+
+    python -m benchmarks.ledger_indexes --rows 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, insert, select, text
+
+from app.db import _add_hot_path_indexes
+from app.models import Base, EventType
+
+ENGAGEMENTS = Base.metadata.tables["engagements"]
+LEDGER = Base.metadata.tables["points_ledger"]
+OAUTH = Base.metadata.tables["oauth"]
+
+# Tables as they were created before schema version 2
+LEGACY_SCHEMA = (
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR UNIQUE NOT NULL)",
+    "CREATE TABLE engagements (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+    "event_type VARCHAR(15) NOT NULL, event_id VARCHAR NOT NULL, "
+    "timestamp DATETIME NOT NULL, raw_json TEXT)",
+    "CREATE TABLE points_ledger (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+    "engagement_id INTEGER, points_delta INTEGER NOT NULL, reason VARCHAR NOT NULL, "
+    "timestamp DATETIME NOT NULL)",
+    "CREATE TABLE oauth (id INTEGER PRIMARY KEY, provider VARCHAR NOT NULL, "
+    "token TEXT NOT NULL, user_id INTEGER NOT NULL)",
+)
+
+BATCH = 50_000
+
+
+def build(engine, rows: int, users: int, seed: int = 0) -> datetime:
+    """Fill a legacy-shaped database; returns the newest timestamp written."""
+    rng = random.Random(seed)
+    kinds = [kind.name for kind in EventType]
+    start = datetime(2024, 1, 1)
+    step = timedelta(days=365) / rows
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(
+            insert(OAUTH),
+            [{"provider": "youtube", "token": "{}", "user_id": uid} for uid in range(1, users + 1)],
+        )
+        for offset in range(0, rows, BATCH):
+            engagements, ledger = [], []
+            for n in range(offset, min(rows, offset + BATCH)):
+                user_id = rng.randint(1, users)
+                kind = rng.choice(kinds)
+                ts = start + step * n
+                engagements.append({
+                    "id": n + 1, "user_id": user_id, "event_type": kind,
+                    "event_id": f"evt-{n}", "timestamp": ts,
+                })
+                ledger.append({
+                    "user_id": user_id, "engagement_id": n + 1, "points_delta": rng.randint(1, 10),
+                    "reason": kind, "timestamp": ts,
+                })
+            conn.execute(insert(ENGAGEMENTS), engagements)
+            conn.execute(insert(LEDGER), ledger)
+    return start + step * rows
+
+
+def queries(rows: int, users: int, newest: datetime, seed: int = 1):
+    """The app's hot lookups as ``name -> callable(conn)``."""
+    rng = random.Random(seed)
+
+    def dedupe(conn):
+        # _ingest_activities: which of this page's events are already stored
+        ids = [f"evt-{rng.randrange(rows)}" for _ in range(50)]
+        conn.execute(
+            select(ENGAGEMENTS.c.event_id).where(
+                ENGAGEMENTS.c.user_id == rng.randint(1, users),
+                ENGAGEMENTS.c.event_id.in_(ids),
+            )
+        ).all()
+
+    def user_sum(conn):
+        # rebuild_points_balances for one user
+        conn.execute(
+            select(func.sum(LEDGER.c.points_delta)).where(LEDGER.c.user_id == rng.randint(1, users))
+        ).scalar()
+
+    def week_board(conn):
+        # top_points for the "week" window
+        points = func.sum(LEDGER.c.points_delta)
+        conn.execute(
+            select(LEDGER.c.user_id, points)
+            .where(LEDGER.c.timestamp >= newest - timedelta(days=7))
+            .group_by(LEDGER.c.user_id)
+            .order_by(points.desc())
+            .limit(10)
+        ).all()
+
+    def oauth_token(conn):
+        # OAuth lookup on sign-in
+        conn.execute(
+            select(OAUTH.c.token).where(
+                OAUTH.c.provider == "youtube", OAUTH.c.user_id == rng.randint(1, users)
+            )
+        ).first()
+
+    def recalc_chunk(conn):
+        # RecalcEngine._next_chunk
+        conn.execute(
+            select(ENGAGEMENTS.c.user_id)
+            .distinct()
+            .where(
+                ENGAGEMENTS.c.event_type == "COMMENT",
+                ENGAGEMENTS.c.user_id > rng.randint(0, users),
+            )
+            .order_by(ENGAGEMENTS.c.user_id)
+            .limit(500)
+        ).all()
+
+    return {
+        "engagement_dedupe": dedupe,
+        "user_ledger_sum": user_sum,
+        "week_leaderboard": week_board,
+        "oauth_lookup": oauth_token,
+        "recalc_chunk": recalc_chunk,
+    }
+
+
+def time_queries(engine, cases, repeat: int) -> dict:
+    timings = {}
+    with engine.connect() as conn:
+        for name, run in cases.items():
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run(conn)
+                samples.append(time.perf_counter() - started)
+            timings[name] = statistics.median(samples) * 1000
+    return timings
+
+
+def run(rows: int, users: int, repeat: int, path: str) -> list:
+    engine = create_engine(f"sqlite:///{path}")
+    started = time.perf_counter()
+    newest = build(engine, rows, users)
+    load_seconds = time.perf_counter() - started
+
+    before = time_queries(engine, queries(rows, users, newest), repeat)
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        _add_hot_path_indexes(conn)
+    migrate_seconds = time.perf_counter() - started
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+    after = time_queries(engine, queries(rows, users, newest), repeat)
+    engine.dispose()
+
+    results = [
+        {"rows": rows, "users": users, "load_seconds": round(load_seconds, 2),
+         "migration_seconds": round(migrate_seconds, 2)}
+    ]
+    for name in before:
+        results.append({
+            "query": name,
+            "before_ms": round(before[name], 3),
+            "after_ms": round(after[name], 3),
+            "speedup": round(before[name] / after[name], 1) if after[name] else None,
+        })
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000, help="ledger rows")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20, help="runs per query (median)")
+    parser.add_argument("--db", help="database file to create (default: a temp file)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        results = run(args.rows, args.users, args.repeat, args.db)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = run(args.rows, args.users, args.repeat, os.path.join(tmp, "ledger.db"))
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
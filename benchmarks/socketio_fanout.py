@@ -0,0 +1,159 @@
+"""Socket.IO fan-out load test across worker servers sharing a message queue.
+
+Each worker is a Socket.IO server with ``--clients`` connected sockets in the
+``public`` room. A write-only publisher (what the leader process does for
+leaderboard and points broadcasts) emits ``--messages`` events and the test
+measures how long it takes for every socket on every worker to receive them.
+Deliveries should grow linearly with the number of workers while the time
+per delivery stays flat.
+
+By default workers are threads joined by the in-process ``local://`` queue.
+Pass ``--message-queue redis://localhost:6379/0`` (or any Kombu URL) to run
+each worker in its own process against a real broker.
+
+    python -m benchmarks.socketio_fanout --workers 1 2 4 8
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import threading
+import time
+
+import socketio
+
+from app.realtime import LocalMessageQueue, LocalPubSubManager
+
+
+def _counting_server(manager):
+    class CountingServer(socketio.Server):
+        """Server that counts packets instead of writing them to sockets."""
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.delivered = 0
+            self._lock = threading.Lock()
+
+        def _send_eio_packet(self, eio_sid, pkt):
+            with self._lock:
+                self.delivered += 1
+
+    server = CountingServer(client_manager=manager, async_mode="threading")
+    server.manager_initialized = True
+    server.manager.initialize()
+    return server
+
+
+def _connect_clients(server, clients: int, worker: int) -> None:
+    for n in range(clients):
+        sid = server.manager.connect(f"w{worker}-c{n}", "/")
+        server.manager.enter_room(sid, "/", "public")
+
+
+def _remote_manager(url: str, write_only: bool = False):
+    if url.startswith(("redis://", "rediss://")):
+        return socketio.RedisManager(url, write_only=write_only)
+    return socketio.KombuManager(url, write_only=write_only)
+
+
+def _wait_for(count, expected: int, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while count() < expected:
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def run_local(workers: int, clients: int, messages: int, timeout: float) -> dict:
+    broker = LocalMessageQueue()
+    servers = []
+    for worker in range(workers):
+        server = _counting_server(LocalPubSubManager(broker=broker))
+        _connect_clients(server, clients, worker)
+        servers.append(server)
+    publisher = LocalPubSubManager(broker=broker, write_only=True)
+    # Give every listener thread time to subscribe
+    time.sleep(0.05)
+
+    expected = workers * clients * messages
+    start = time.perf_counter()
+    for n in range(messages):
+        publisher.emit("leaderboard", {"version": n}, room="public")
+    done = _wait_for(lambda: sum(s.delivered for s in servers), expected, timeout)
+    elapsed = time.perf_counter() - start
+    delivered = sum(s.delivered for s in servers)
+    return _result(workers, clients, messages, delivered, expected, elapsed, done)
+
+
+def _worker_process(url, worker, clients, expected, timeout, ready, results):
+    server = _counting_server(_remote_manager(url))
+    _connect_clients(server, clients, worker)
+    ready.put(worker)
+    _wait_for(lambda: server.delivered, expected, timeout)
+    results.put(server.delivered)
+
+
+def run_processes(url: str, workers: int, clients: int, messages: int, timeout: float) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    ready, results = ctx.Queue(), ctx.Queue()
+    procs = [
+        ctx.Process(
+            target=_worker_process,
+            args=(url, n, clients, clients * messages, timeout, ready, results),
+        )
+        for n in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    for _ in procs:
+        ready.get(timeout=timeout)
+    # Give every worker time to subscribe to the broker
+    time.sleep(0.5)
+
+    publisher = _remote_manager(url, write_only=True)
+    start = time.perf_counter()
+    for n in range(messages):
+        publisher.emit("leaderboard", {"version": n}, room="public")
+    delivered = sum(results.get(timeout=timeout + 5) for _ in procs)
+    elapsed = time.perf_counter() - start
+    for proc in procs:
+        proc.join()
+    expected = workers * clients * messages
+    return _result(workers, clients, messages, delivered, expected, elapsed, delivered >= expected)
+
+
+def _result(workers, clients, messages, delivered, expected, elapsed, complete) -> dict:
+    return {
+        "workers": workers,
+        "clients_per_worker": clients,
+        "messages": messages,
+        "delivered": delivered,
+        "expected": expected,
+        "complete": complete,
+        "seconds": round(elapsed, 4),
+        "deliveries_per_second": round(delivered / elapsed) if elapsed else None,
+        "us_per_delivery": round(elapsed / delivered * 1e6, 2) if delivered else None,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--clients", type=int, default=250, help="sockets per worker")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--message-queue", help="broker URL; runs workers as processes")
+    args = parser.parse_args(argv)
+
+    for workers in args.workers:
+        if args.message_queue:
+            result = run_processes(args.message_queue, workers, args.clients, args.messages, args.timeout)
+        else:
+            result = run_local(workers, args.clients, args.messages, args.timeout)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
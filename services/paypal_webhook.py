@@ -3,16 +3,31 @@ from __future__ import annotations
 import hmac
 import hashlib
 import json
-from typing import Any
+import logging
+import threading
+from datetime import datetime
+from typing import Iterable, Optional, Set
 
+import click
 from flask import Blueprint, current_app, request, abort
 
 try:
-    from app.models import GiveawayWinner
+    from sqlalchemy import update
+    from sqlalchemy.exc import IntegrityError
+
+    from app.models import GiveawayWinner, WebhookEvent
 except Exception:  # pragma: no cover - SQLAlchemy optional
     GiveawayWinner = None  # type: ignore
+    WebhookEvent = None  # type: ignore
+
+bp = Blueprint("paypal_webhook", __name__, cli_group="paypal")
+
+# Inbox rows applied per transaction
+BATCH_SIZE = 100
+# Seconds the worker sleeps when idle; it also picks up rows other processes received
+POLL_INTERVAL = 5.0
 
-bp = Blueprint("paypal_webhook", __name__)
+logger = logging.getLogger(__name__)
 
 
 def _verify_signature() -> bool:
@@ -27,30 +42,223 @@ def _verify_signature() -> bool:
     return hmac.compare_digest(expected, signature)
 
 
+def store_event(session, transmission_id: str, body: str) -> bool:
+    """Insert an inbox row unless the transmission is already stored.
+
+    Returns whether the row is new. PayPal retries reuse the transmission
+    id, so the unique key turns a retry into one rejected insert.
+    """
+    session.add(
+        WebhookEvent(transmission_id=transmission_id, body=body, received_at=datetime.utcnow())
+    )
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        return False
+    return True
+
+
+def _completed_payout_items(payload: dict) -> Set[str]:
+    """Keys a completed payout item may be stored under in ``GiveawayWinner``.
+
+    PayPal generates ``payout_item_id`` itself; our own key, such as the
+    ``<giveaway>:<user id>`` of drawn winners, comes back as the item's
+    ``sender_item_id``.
+    """
+    event_type = str(payload.get("event_type", "")).lower()
+    if "payout" not in event_type or "completed" not in event_type:
+        return set()
+    resource = payload.get("resource", {}) or {}
+    item = resource.get("payout_item", {}) or {}
+    keys = (
+        resource.get("payout_item_id"),
+        item.get("payout_item_id"),
+        resource.get("sender_item_id"),
+        item.get("sender_item_id"),
+    )
+    return {key for key in keys if isinstance(key, str) and key}
+
+
+def process_batch(session, limit: int = BATCH_SIZE) -> int:
+    """Apply up to ``limit`` unprocessed inbox rows in one transaction.
+
+    Completed payouts are marked paid with a single ``UPDATE ... IN``;
+    other events are recorded as ignored. Returns the number of rows
+    processed.
+    """
+    events = (
+        session.query(WebhookEvent)
+        .filter(WebhookEvent.processed_at.is_(None))
+        .order_by(WebhookEvent.id)
+        .limit(limit)
+        .all()
+    )
+    if not events:
+        return 0
+    payout_items = set()
+    for event in events:
+        try:
+            payload = json.loads(event.body)
+        except ValueError:
+            event.status = "invalid"
+            continue
+        keys = _completed_payout_items(payload if isinstance(payload, dict) else {})
+        if keys:
+            payout_items |= keys
+            event.status = "applied"
+        else:
+            event.status = "ignored"
+    if payout_items:
+        session.execute(
+            update(GiveawayWinner)
+            .where(
+                GiveawayWinner.payout_item_id.in_(payout_items),
+                GiveawayWinner.paid.is_(False),
+            )
+            .values(paid=True)
+        )
+    now = datetime.utcnow()
+    for event in events:
+        event.processed_at = now
+    session.commit()
+    return len(events)
+
+
+def process_pending(session_factory, limit: int = BATCH_SIZE) -> int:
+    """Drain the inbox batch by batch; returns the number of rows processed."""
+    total = 0
+    while True:
+        session = session_factory()
+        try:
+            processed = process_batch(session, limit)
+        finally:
+            session.close()
+        total += processed
+        if processed < limit:
+            return total
+
+
+class WebhookWorker:
+    """Background thread that applies inbox rows as they arrive.
+
+    The request handler calls ``notify`` after storing an event, which
+    starts the thread on first use; it then also wakes every ``interval``
+    seconds for rows stored by other processes. Rows left over from before
+    a restart are drained by the leader's scheduler job, which calls
+    ``drain``. Applying a row twice is harmless, so any number of workers
+    may run. Set ``PAYPAL_WEBHOOK_WORKER = False`` to leave the inbox to
+    ``flask paypal process``.
+    """
+
+    def __init__(self, app, interval: float = POLL_INTERVAL, batch_size: int = BATCH_SIZE):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def notify(self) -> None:
+        if not self.app.config.get("PAYPAL_WEBHOOK_WORKER", True):
+            return
+        self._start()
+        self._wake.set()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="paypal-webhooks", daemon=True)
+            self._thread.start()
+
+    def drain(self) -> int:
+        """Apply every pending inbox row now; returns the number processed."""
+        session_factory = getattr(self.app, "session_factory", None)
+        if session_factory is None:
+            return 0
+        return process_pending(session_factory, self.batch_size)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception:
+                logger.exception("PayPal webhook batch failed")
+
+
 @bp.route("/webhooks/paypal", methods=["POST"])
 def handle_webhook() -> tuple[str, int]:
     if not _verify_signature():
         abort(400)
 
-    payload: dict[str, Any] = request.get_json(silent=True) or {}
-    event_type = str(payload.get("event_type", "")).lower()
-    if "payout" in event_type and "completed" in event_type:
-        resource = payload.get("resource", {}) or {}
-        payout_item_id = resource.get("payout_item_id") or resource.get("payout_item", {}).get("payout_item_id")
-        if payout_item_id and GiveawayWinner is not None:
-            session_factory = getattr(current_app, "session_factory", None)
-            if session_factory is not None:
-                session = session_factory()
-                try:
-                    winner = session.query(GiveawayWinner).filter_by(payout_item_id=payout_item_id).first()
-                    if winner and not winner.paid:
-                        winner.paid = True
-                        session.commit()
-                finally:
-                    session.close()
-
+    session_factory = getattr(current_app, "session_factory", None)
+    if session_factory is None or WebhookEvent is None:
+        abort(503)
+    body = request.get_data(as_text=True)
+    transmission_id = (
+        request.headers.get("PayPal-Transmission-Id")
+        or hashlib.sha256(body.encode()).hexdigest()
+    )
+    session = session_factory()
+    try:
+        added = store_event(session, transmission_id, body)
+    finally:
+        session.close()
+    worker = getattr(current_app, "paypal_webhook_worker", None)
+    if added and worker is not None:
+        worker.notify()
     return "", 204
 
 
+def _replay(session, transmission_ids: Iterable[str], since: Optional[datetime]) -> int:
+    query = session.query(WebhookEvent)
+    if transmission_ids:
+        query = query.filter(WebhookEvent.transmission_id.in_(list(transmission_ids)))
+    if since is not None:
+        query = query.filter(WebhookEvent.received_at >= since)
+    count = query.update(
+        {"processed_at": None, "status": None}, synchronize_session=False
+    )
+    session.commit()
+    return count
+
+
+def _session_factory():
+    session_factory = getattr(current_app, "session_factory", None)
+    if session_factory is None:
+        raise click.ClickException("Database is not configured")
+    return session_factory
+
+
+@bp.cli.command("replay")
+@click.argument("transmission_ids", nargs=-1)
+@click.option("--since", type=click.DateTime(), help="Replay events received since then.")
+@click.option("--all", "replay_all", is_flag=True, help="Replay the whole inbox.")
+def replay_command(transmission_ids, since, replay_all) -> None:
+    """Re-apply stored webhook events and drain the inbox."""
+    if not (transmission_ids or since or replay_all):
+        raise click.UsageError("give transmission ids, --since or --all")
+    session_factory = _session_factory()
+    session = session_factory()
+    try:
+        requeued = _replay(session, transmission_ids, since)
+    finally:
+        session.close()
+    processed = process_pending(session_factory)
+    click.echo(f"{requeued} event(s) requeued, {processed} processed")
+
+
+@bp.cli.command("process")
+def process_command() -> None:
+    """Apply every unprocessed webhook event in the inbox."""
+    click.echo(f"{process_pending(_session_factory())} event(s) processed")
+
+
 def init_paypal_webhook(app) -> None:
     app.register_blueprint(bp)
+    app.paypal_webhook_worker = WebhookWorker(
+        app, interval=app.config.get("PAYPAL_WEBHOOK_POLL_INTERVAL", POLL_INTERVAL)
+    )
@@ -0,0 +1,59 @@
+import json
+from datetime import datetime
+
+from app.db import init_db
+from app.compaction import compact_activities, load_activity
+from app.models import Engagement, EventType, User
+from app.utils.activity import pack_activity, unpack_activity
+
+ITEM = {
+    'kind': 'youtube#activity',
+    'etag': 'abc',
+    'id': 'evt-1',
+    'snippet': {
+        'publishedAt': '2024-05-01T12:30:00Z',
+        'channelId': 'UC123',
+        'title': 'Episode 12',
+        'type': 'comment',
+    },
+    'contentDetails': {'comment': {'resourceId': {'kind': 'youtube#video', 'videoId': 'vid'}}},
+}
+
+
+def test_pack_round_trip_moves_typed_fields_out():
+    published_at, channel_id, blob = pack_activity(ITEM, 'evt-1')
+    assert (published_at, channel_id) == (datetime(2024, 5, 1, 12, 30), 'UC123')
+    assert len(blob) < len(json.dumps(ITEM))
+    assert unpack_activity(blob, 'evt-1', published_at, channel_id) == ITEM
+
+    # Values that would not survive the typed column stay in the blob
+    odd = {'id': 'x', 'snippet': {'publishedAt': '2024-05-01T12:30:00.5+02:00'}}
+    published_at, channel_id, blob = pack_activity(odd, 'x')
+    assert published_at == datetime(2024, 5, 1, 10, 30, 0, 500000)
+    assert unpack_activity(blob, 'x', published_at, channel_id) == odd
+
+
+def test_compact_converts_raw_json_rows():
+    Session = init_db('sqlite:///:memory:')
+    session = Session()
+    user = User(username='ann')
+    session.add(user)
+    session.flush()
+    for n in range(5):
+        item = dict(ITEM, id=f'evt-{n}')
+        session.add(Engagement(
+            user_id=user.id, event_type=EventType.COMMENT, event_id=item['id'],
+            timestamp=datetime.utcnow(), raw_json=json.dumps(item),
+        ))
+    session.commit()
+
+    batches = list(compact_activities(session, batch_size=2))
+    assert [rows for rows, _, _ in batches] == [2, 2, 1]
+    assert all(compact < original for _, original, compact in batches)
+    assert session.query(Engagement).filter(Engagement.raw_json.is_not(None)).count() == 0
+    session.expunge_all()
+    engagement = session.query(Engagement).filter_by(event_id='evt-3').one()
+    assert engagement.channel_id == 'UC123'
+    assert engagement.activity == dict(ITEM, id='evt-3')
+    assert load_activity(session, engagement.id) == dict(ITEM, id='evt-3')
+    session.close()
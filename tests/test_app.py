@@ -20,3 +20,34 @@ def test_login(client):
     res = client.post('/login', data={'username': 'tester'}, follow_redirects=True)
     assert res.status_code == 200
     assert b'Welcome tester' in res.data
+
+
+def test_dashboard_cached_lookups(app):
+    from datetime import datetime
+
+    from sqlalchemy import event
+
+    from app.db import init_db
+    from app.models import PointsLedger, User
+
+    Session = init_db('sqlite:///:memory:')
+    app.session_factory = Session
+    statements = []
+    event.listen(Session.get_bind(), 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['username'] = 'dana'
+
+    assert client.get('/dashboard').status_code == 200
+    assert statements
+    statements.clear()
+    assert client.get('/dashboard').status_code == 200
+    assert statements == []
+
+    # A ledger write drops the cached total at once
+    session = Session()
+    user_id = session.query(User.id).filter_by(username='dana').scalar()
+    session.add(PointsLedger(user_id=user_id, points_delta=7, reason='test', timestamp=datetime.utcnow()))
+    session.commit()
+    session.close()
+    assert app.points_cache.get(Session, user_id) == 7
@@ -0,0 +1,79 @@
+from app.utils.channels import ChannelCache
+
+
+class FakeResponse:
+    def __init__(self, items):
+        self.items = items
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'items': self.items}
+
+
+class FakeHttp:
+    def __init__(self, titles):
+        self.titles = titles
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        ids = params['id'].split(',')
+        self.calls.append(ids)
+        return FakeResponse([
+            {'id': cid, 'snippet': {'title': self.titles[cid]}}
+            for cid in ids
+            if cid in self.titles
+        ])
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_fetches_all_channels_in_one_batch():
+    http = FakeHttp({'a': 'A', 'c': 'C'})
+    cache = ChannelCache('key', ['a', 'b', 'c'], http=http, clock=Clock())
+
+    channels = cache.get_all()
+    assert [c['title'] for c in channels] == ['A', 'C']
+    assert cache.get('c')['url'] == 'https://www.youtube.com/channel/c'
+    assert cache.get('b') is None
+    assert http.calls == [['a', 'b', 'c']]
+
+
+def test_stale_entries_served_while_refreshing():
+    http = FakeHttp({'a': 'A'})
+    clock = Clock()
+    cache = ChannelCache('key', ['a'], ttl=10, stale_ttl=100, http=http, clock=clock)
+    cache.get_all()
+
+    clock.now += 5
+    cache.get_all()
+    assert len(http.calls) == 1
+
+    http.titles['a'] = 'A2'
+    clock.now += 10
+    assert cache.get('a')['title'] == 'A'
+    cache._refresher.join()
+    assert len(http.calls) == 2
+    assert cache.get('a')['title'] == 'A2'
+
+    http.titles['a'] = 'A3'
+    clock.now += 500
+    assert cache.get('a')['title'] == 'A3'
+    assert len(http.calls) == 3
+
+
+def test_without_api_key_no_requests():
+    http = FakeHttp({})
+    cache = ChannelCache(None, ['a'], http=http)
+    assert cache.get_all() == [
+        {'id': 'a', 'title': 'Channel a', 'url': 'https://www.youtube.com/channel/a'}
+    ]
+    assert cache.get('missing') is None
+    assert http.calls == []
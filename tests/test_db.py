@@ -0,0 +1,135 @@
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from app import db
+from app.db import SCHEMA_VERSION, init_db, schema_version
+
+
+def test_sqlite_file_uses_wal_and_thread_local_sessions(tmp_path):
+    Session = init_db(f"sqlite:///{tmp_path / 'app.db'}")
+    session = Session()
+    assert session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+    assert session.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+    assert session.execute(text("PRAGMA busy_timeout")).scalar() == db.SQLITE_BUSY_TIMEOUT
+    assert Session() is session
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(Session()))
+    thread.start()
+    thread.join()
+    assert other[0] is not session
+    Session.remove()
+    assert Session() is not session
+
+
+def test_schema_created_once(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    Session = init_db(url)
+    assert schema_version(Session.get_bind()) == SCHEMA_VERSION
+
+    calls = []
+    monkeypatch.setattr(db.Base.metadata, "create_all", lambda *a, **k: calls.append(a))
+    init_db(url)
+    assert calls == []
+
+
+def test_database_url_and_pool_options(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    options = db._engine_options(make_url("postgresql://u@h/db"), {"max_overflow": 0})
+    assert options["pool_size"] == 20
+    assert options["max_overflow"] == 0
+    assert options["pool_pre_ping"] is True
+    assert db._engine_options(make_url("sqlite:///app.db"), {}) == {}
+
+    monkeypatch.setenv("DATABASE_URL", "sqlite://")
+    assert str(init_db().get_bind().url) == "sqlite://"
+
+
+def test_migration_indexes_legacy_database(tmp_path, caplog):
+    from sqlalchemy import create_engine, inspect
+
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        # Tables as created before the schema was versioned, with no indexes
+        conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR UNIQUE NOT NULL)"))
+        conn.execute(text(
+            "CREATE TABLE engagements (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+            "event_type VARCHAR(15) NOT NULL, event_id VARCHAR NOT NULL, "
+            "timestamp DATETIME NOT NULL, raw_json TEXT)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE points_ledger (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+            "engagement_id INTEGER, points_delta INTEGER NOT NULL, reason VARCHAR NOT NULL, "
+            "timestamp DATETIME NOT NULL)"
+        ))
+        conn.execute(text(
+            "INSERT INTO users (id, username) VALUES (1, 'ann'), (2, 'bob')"
+        ))
+        conn.execute(text(
+            "INSERT INTO points_ledger (user_id, points_delta, reason, timestamp) VALUES "
+            "(1, 50, 'COMMENT', '2024-01-01 00:00:00'), (1, -5, 'ADJUST', '2024-01-02 00:00:00'), "
+            "(2, 2, 'LIKE', '2024-01-01 00:00:00')"
+        ))
+        conn.execute(text(
+            "CREATE TABLE oauth (id INTEGER PRIMARY KEY, provider VARCHAR NOT NULL, "
+            "token TEXT NOT NULL, user_id INTEGER NOT NULL)"
+        ))
+        conn.execute(text(
+            "INSERT INTO oauth (provider, token, user_id) VALUES ('youtube', '{}', 1), ('youtube', '{}', 1)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE giveaway_winners (id INTEGER PRIMARY KEY, "
+            "payout_item_id VARCHAR UNIQUE NOT NULL, paid BOOLEAN NOT NULL)"
+        ))
+    engine.dispose()
+
+    Session = init_db(url)
+    inspector = inspect(Session.get_bind())
+    names = {ix["name"] for table in ("engagements", "points_ledger", "oauth") for ix in inspector.get_indexes(table)}
+    assert {
+        "uq_engagements_user_event", "ix_engagements_event_type_user", "ix_points_ledger_user_time",
+        "ix_points_ledger_timestamp", "ix_points_ledger_engagement",
+    } <= names
+    # Duplicate tokens block the unique index but not the rest of the upgrade
+    assert "uq_oauth_provider_user" not in names
+    assert "uq_oauth_provider_user" in caplog.text
+    assert schema_version(Session.get_bind()) == SCHEMA_VERSION
+    columns = {column["name"] for column in inspector.get_columns("giveaway_winners")}
+    assert {"user_id", "giveaway", "points", "seed", "drawn_at"} <= columns
+    columns = {column["name"] for column in inspector.get_columns("engagements")}
+    assert {"compacted_points", "archive_segment", "published_at", "channel_id", "activity_blob"} <= columns
+
+    # Balances are seeded from the existing ledger, so totals and boards work
+    from app.leaderboard import top_points
+    from app.models import get_total_points
+
+    session = Session()
+    assert get_total_points(session, 1) == 45
+    assert top_points(session) == [{"name": "ann", "points": 45}, {"name": "bob", "points": 2}]
+    session.close()
+
+
+def test_migration_repairs_balances_of_version_7_databases(tmp_path):
+    from app.models import get_total_points
+
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = init_db(url).get_bind()
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, username) VALUES (1, 'ann')"))
+        # History from before the upgrade, then points earned after it that
+        # created the balance row without that history
+        conn.execute(text(
+            "INSERT INTO points_ledger (user_id, points_delta, reason, timestamp) VALUES "
+            "(1, 50, 'COMMENT', '2024-01-01 00:00:00'), (1, 2, 'LIKE', '2024-06-01 00:00:00')"
+        ))
+        conn.execute(text("INSERT INTO user_points_balances (user_id, total) VALUES (1, 2)"))
+        conn.execute(text("UPDATE schema_version SET version = 7"))
+    engine.dispose()
+
+    Session = init_db(url)
+    session = Session()
+    assert get_total_points(session, 1) == 52
+    session.close()
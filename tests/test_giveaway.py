@@ -0,0 +1,79 @@
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.db import init_db
+from app.giveaway import draw_winners, weighted_sample
+from app.models import GiveawayWinner, PointsLedger, User
+
+
+def test_weighted_sample_is_proportional_and_seeded():
+    weights = [('a', 1), ('b', 3), ('c', 0), ('d', 6)]
+    wins = Counter()
+    for seed in range(4000):
+        (winner, _), = weighted_sample(iter(weights), 1, random.Random(seed))
+        wins[winner] += 1
+    assert wins['c'] == 0
+    assert abs(wins['a'] / 4000 - 0.1) < 0.03
+    assert abs(wins['b'] / 4000 - 0.3) < 0.03
+    assert abs(wins['d'] / 4000 - 0.6) < 0.03
+
+    assert weighted_sample(weights, 2, random.Random(7)) == weighted_sample(weights, 2, random.Random(7))
+    assert sorted(item for item, _ in weighted_sample(weights, 5, random.Random(1))) == ['a', 'b', 'd']
+
+
+def _seed_users(Session, points):
+    session = Session()
+    now = datetime.utcnow()
+    for n, total in enumerate(points):
+        user = User(username=f'u{n}')
+        session.add(user)
+        session.flush()
+        session.add(PointsLedger(user_id=user.id, points_delta=total, reason='test', timestamp=now - timedelta(days=n)))
+    session.commit()
+    session.close()
+
+
+def test_draw_winners_reproducible_and_excludes_paid():
+    Session = init_db('sqlite:///:memory:')
+    _seed_users(Session, [10, 20, 30, 40, 0])
+    session = Session()
+    session.add(GiveawayWinner(payout_item_id='old', paid=True, user_id=4))
+    session.commit()
+
+    first = draw_winners(session, 'ep1', 2, seed=42)
+    winners = {w['user_id'] for w in first['winners']}
+    assert len(winners) == 2 and not winners & {4, 5}
+    rows = session.query(GiveawayWinner).filter_by(giveaway='ep1').all()
+    assert {row.user_id for row in rows} == winners
+    assert {row.payout_item_id for row in rows} == {f'ep1:{uid}' for uid in winners}
+
+    assert {row.seed for row in rows} == {42}
+    assert first['eligible']['users'] == 3 and not first['dry_run']
+
+    # A dry run with the same seed reproduces the draw for an audit, writing nothing
+    audit = draw_winners(session, 'ep1', 2, seed=42, dry_run=True)
+    assert audit == dict(first, dry_run=True)
+    assert session.query(GiveawayWinner).filter_by(giveaway='ep1').count() == 2
+    # Drawing again for real with that seed would not reproduce anything
+    with pytest.raises(ValueError):
+        draw_winners(session, 'ep1', 2, seed=42)
+
+    # A second draw for the same giveaway only picks from who is left
+    rest = draw_winners(session, 'ep1', 5, seed=1)
+    assert {w['user_id'] for w in rest['winners']} == {1, 2, 3} - winners
+    assert rest['eligible']['users'] == 1
+    # Later draws change who was eligible, which the snapshot hash shows
+    assert draw_winners(session, 'ep1', 2, seed=42, dry_run=True)['eligible'] != first['eligible']
+    session.close()
+
+
+def test_windowed_draw_uses_recent_points():
+    Session = init_db('sqlite:///:memory:')
+    _seed_users(Session, [10, 20, 30])
+    session = Session()
+    draw = draw_winners(session, 'week', 3, seed=3, since=datetime.utcnow() - timedelta(hours=36))
+    assert sorted((w['user_id'], w['points']) for w in draw['winners']) == [(1, 10), (2, 20)]
+    session.close()
@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+from app.db import init_db
+from app.leader import LeaderElection
+from app.models import LeaderLease
+
+
+def test_single_leader_and_failover():
+    Session = init_db('sqlite:///:memory:')
+    first = LeaderElection(Session, holder='a', ttl=60)
+    second = LeaderElection(Session, holder='b', ttl=60)
+
+    assert first.acquire() is True
+    assert second.acquire() is False
+    assert first.acquire() is True
+
+    # The leader stops renewing: once the lease expires the other takes over
+    session = Session()
+    session.query(LeaderLease).update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    session.commit()
+    session.close()
+    assert second.acquire() is True
+    assert first.acquire() is False
+
+    second.release()
+    assert first.acquire() is True
@@ -0,0 +1,82 @@
+import pytest
+from datetime import datetime, timedelta
+
+from app import create_app
+from app.db import init_db
+from app.leaderboard import LeaderboardCache, top_points, window_start
+from app.models import User, PointsLedger
+
+
+@pytest.fixture()
+def Session():
+    Session = init_db('sqlite:///:memory:')
+    session = Session()
+    users = [User(username=name) for name in ('alice', 'bob', 'carol')]
+    session.add_all(users)
+    session.commit()
+    now = datetime.utcnow()
+    old = now - timedelta(days=30)
+    session.add_all([
+        PointsLedger(user_id=users[0].id, points_delta=50, reason='test', timestamp=old),
+        PointsLedger(user_id=users[0].id, points_delta=1, reason='test', timestamp=now),
+        PointsLedger(user_id=users[1].id, points_delta=20, reason='test', timestamp=now),
+        PointsLedger(user_id=users[2].id, points_delta=5, reason='test', timestamp=now),
+    ])
+    session.commit()
+    session.close()
+    return Session
+
+
+def test_top_points_all_time(Session):
+    session = Session()
+    board = top_points(session, limit=2)
+    session.close()
+    assert board == [{'name': 'alice', 'points': 51}, {'name': 'bob', 'points': 20}]
+
+
+def test_top_points_windowed(Session):
+    session = Session()
+    since = datetime.utcnow() - timedelta(days=1)
+    board = top_points(session, limit=10, since=since)
+    session.close()
+    assert [row['name'] for row in board] == ['bob', 'carol', 'alice']
+    assert board[2]['points'] == 1
+
+
+def test_window_start():
+    now = datetime(2024, 5, 9, 15, 30)  # a Thursday
+    assert window_start('all', now) is None
+    assert window_start('week', now) == datetime(2024, 5, 6)
+    assert window_start('episode', episode_start='2024-05-08T20:00:00') == datetime(2024, 5, 8, 20)
+    with pytest.raises(ValueError):
+        window_start('episode')
+
+
+def test_cache_reuses_result(Session):
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return Session()
+
+    cache = LeaderboardCache(ttl=60)
+    first = cache.get(factory, limit=1)
+    second = cache.get(factory, limit=1)
+    assert first == second == [{'name': 'alice', 'points': 51}]
+    assert len(calls) == 1
+
+
+def test_leaderboard_endpoint(Session):
+    app = create_app()
+    app.session_factory = Session
+    app.config.update({'TESTING': True})
+    client = app.test_client()
+
+    res = client.get('/api/leaderboard?limit=1')
+    assert res.status_code == 200
+    assert res.get_json() == {'window': 'all', 'leaderboard': [{'name': 'alice', 'points': 51}]}
+
+    res = client.get('/api/leaderboard?window=episode')
+    assert res.status_code == 400
+    res = client.get('/api/leaderboard?window=month')
+    assert res.status_code == 400
@@ -0,0 +1,70 @@
+import pytest
+
+from app import create_app, tasks
+from app.metrics import METRICS, Metrics
+
+
+@pytest.fixture()
+def metrics_on(monkeypatch, tmp_path):
+    monkeypatch.setenv('METRICS_ENABLED', '1')
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'app.db'}")
+    yield METRICS
+    METRICS.enabled = False
+    METRICS.reset()
+
+
+def test_registry_renders_prometheus_text():
+    metrics = Metrics()
+    metrics.inc('jobs_total')
+    with metrics.time('job_seconds'):
+        pass
+    assert metrics.render() == '\n'
+
+    metrics.enabled = True
+    metrics.describe('jobs_total', 'Jobs run.')
+    metrics.inc('jobs_total', kind='a"b')
+    metrics.inc('jobs_total', 2, kind='a"b')
+    metrics.observe('job_seconds', 0.003)
+    metrics.observe('job_seconds', 100)
+    text = metrics.render()
+    assert '# HELP jobs_total Jobs run.\n# TYPE jobs_total counter\njobs_total{kind="a\\"b"} 3\n' in text
+    assert 'job_seconds_bucket{le="0.0025"} 0\n' in text
+    assert 'job_seconds_bucket{le="0.005"} 1\n' in text
+    assert 'job_seconds_bucket{le="30"} 1\n' in text
+    assert 'job_seconds_bucket{le="+Inf"} 2\n' in text
+    assert 'job_seconds_count 2\n' in text
+
+
+def test_metrics_endpoint_reports_requests_queries_and_jobs(metrics_on, monkeypatch):
+    monkeypatch.setattr(tasks, 'SERVICE_CACHE', tasks.YouTubeServiceCache())
+    monkeypatch.setattr(tasks, '_build_youtube_service', lambda token, timeout=None: object())
+    app = create_app()
+    app.config.update({'TESTING': True, 'SECRET_KEY': 'test'})
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['username'] = 'dana'
+    assert client.get('/dashboard').status_code == 200
+    tasks._update_engagements(app, None)
+
+    res = client.get('/metrics')
+    assert res.status_code == 200
+    assert res.content_type.startswith('text/plain; version=0.0.4')
+    text = res.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{endpoint="main.dashboard",method="GET",status="200"} 1' in text
+    assert 'http_request_db_queries_bucket{endpoint="main.dashboard",le="0"} 0' in text
+    assert 'db_query_duration_seconds_count' in text
+    assert 'youtube_poll_run_seconds_count 1' in text
+
+    tasks.SERVICE_CACHE.get(1, {'access_token': 'a'})
+    tasks.SERVICE_CACHE.get(1, {'access_token': 'a'})
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'youtube_service_cache_hits_total 1\n' in text
+    assert 'youtube_service_cache_misses_total 1\n' in text
+
+
+def test_metrics_disabled_by_default(monkeypatch):
+    monkeypatch.delenv('METRICS_ENABLED', raising=False)
+    app = create_app()
+    assert app.metrics is None
+    assert not METRICS.enabled
+    assert app.test_client().get('/metrics').status_code == 404
@@ -6,7 +6,8 @@ import pytest
 
 from app import create_app
 from app.db import init_db
-from app.models import GiveawayWinner
+from app.models import GiveawayWinner, WebhookEvent
+from services.paypal_webhook import process_pending
 
 
 @pytest.fixture()
@@ -14,10 +15,24 @@ def app_and_session():
     Session = init_db('sqlite:///:memory:')
     app = create_app()
     app.session_factory = Session
-    app.config.update({'TESTING': True, 'PAYPAL_WEBHOOK_SECRET': 'secret'})
+    app.config.update({
+        'TESTING': True,
+        'PAYPAL_WEBHOOK_SECRET': 'secret',
+        # The worker thread would get its own empty in-memory database
+        'PAYPAL_WEBHOOK_WORKER': False,
+    })
     return app, Session
 
 
+def _post(client, event, transmission_id=None):
+    body = json.dumps(event).encode()
+    sig = hmac.new(b'secret', body, hashlib.sha256).hexdigest()
+    headers = {'PayPal-Transmission-Sig': sig}
+    if transmission_id:
+        headers['PayPal-Transmission-Id'] = transmission_id
+    return client.post('/webhooks/paypal', data=body, headers=headers, content_type='application/json')
+
+
 def test_payout_completed_marks_paid(app_and_session):
     app, Session = app_and_session
     session = Session()
@@ -40,8 +55,84 @@ def test_payout_completed_marks_paid(app_and_session):
         content_type='application/json',
     )
     assert res.status_code == 204
+    # Only queued so far
+    session = Session()
+    assert session.query(GiveawayWinner).filter_by(payout_item_id='p1').one().paid is False
+    session.close()
+    assert process_pending(Session) == 1
 
     session = Session()
     row = session.query(GiveawayWinner).filter_by(payout_item_id='p1').one()
     assert row.paid is True
     session.close()
+
+
+def test_retries_are_deduplicated_and_batched(app_and_session):
+    app, Session = app_and_session
+    session = Session()
+    session.add_all([GiveawayWinner(payout_item_id=f'p{n}') for n in range(3)])
+    session.commit()
+    session.close()
+
+    client = app.test_client()
+    for n in range(3):
+        event = {'event_type': 'PAYOUTS-ITEM.COMPLETED', 'resource': {'payout_item_id': f'p{n}'}}
+        assert _post(client, event, transmission_id=f't{n}').status_code == 204
+        assert _post(client, event, transmission_id=f't{n}').status_code == 204
+    assert _post(client, {'event_type': 'PAYMENT.SALE.COMPLETED'}, transmission_id='t9').status_code == 204
+
+    session = Session()
+    assert session.query(WebhookEvent).count() == 4
+    session.close()
+    assert process_pending(Session, limit=2) == 4
+
+    session = Session()
+    assert session.query(GiveawayWinner).filter_by(paid=True).count() == 3
+    statuses = dict(session.query(WebhookEvent.transmission_id, WebhookEvent.status))
+    assert statuses == {'t0': 'applied', 't1': 'applied', 't2': 'applied', 't9': 'ignored'}
+    session.close()
+
+    # Drawn winners are keyed by our own id, which PayPal echoes as sender_item_id
+    session = Session()
+    session.add(GiveawayWinner(payout_item_id='ep1:7'))
+    session.commit()
+    session.close()
+    event = {
+        'event_type': 'PAYOUTS-ITEM.COMPLETED',
+        'resource': {'payout_item_id': 'PAYPAL123', 'payout_item': {'sender_item_id': 'ep1:7'}},
+    }
+    assert _post(client, event, transmission_id='t10').status_code == 204
+    assert process_pending(Session) == 1
+    session = Session()
+    assert session.query(GiveawayWinner).filter_by(payout_item_id='ep1:7').one().paid is True
+    session.close()
+
+    # Replaying re-applies stored events without new deliveries
+    result = app.test_cli_runner().invoke(args=['paypal', 'replay', 't0', 't9'])
+    assert result.exit_code == 0, result.output
+    assert '2 event(s) requeued, 2 processed' in result.output
+
+
+def test_leader_sweep_applies_leftover_inbox_rows(app_and_session):
+    from app import tasks
+    from services.paypal_webhook import store_event
+
+    app, Session = app_and_session
+    session = Session()
+    session.add(GiveawayWinner(payout_item_id='p1'))
+    session.commit()
+    # Stored before a restart: no worker was ever woken for it
+    event = {'event_type': 'PAYOUTS-ITEM.COMPLETED', 'resource': {'payout_item_id': 'p1'}}
+    assert store_event(session, 't1', json.dumps(event))
+    session.close()
+
+    app.config['PAYPAL_WEBHOOK_WORKER'] = True
+    scheduler = tasks.init_scheduler(app, Session)
+    try:
+        sweep, = [job for job in scheduler.get_jobs() if job.func.__name__ == 'drain_webhooks']
+        sweep.func()
+    finally:
+        scheduler.shutdown(wait=False)
+    session = Session()
+    assert session.query(GiveawayWinner).filter_by(payout_item_id='p1').one().paid is True
+    session.close()
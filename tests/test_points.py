@@ -40,6 +40,8 @@ def test_apply_points(session):
 
 
 def test_duplicate_engagement_id(session):
+    from sqlalchemy.exc import IntegrityError
+
     user = User(username="bob")
     session.add(user)
     session.commit()
@@ -50,25 +52,29 @@ def test_duplicate_engagement_id(session):
         event_id="dup",
         timestamp=datetime.utcnow(),
     )
-    e2 = Engagement(
-        user_id=user.id,
-        event_type=EventType.COMMENT,
-        event_id="dup",
-        timestamp=datetime.utcnow(),
-    )
-    session.add_all([e1, e2])
+    session.add(e1)
     session.commit()
 
     app = Flask(__name__)
     app.config["POINT_MATRIX"] = {"COMMENT": 2}
     with app.app_context():
         first_total = apply_points(user, e1)
-        second_total = apply_points(user, e2)
+
+    e2 = Engagement(
+        user_id=user.id,
+        event_type=EventType.COMMENT,
+        event_id="dup",
+        timestamp=datetime.utcnow(),
+    )
+    session.add(e2)
+    with pytest.raises(IntegrityError):
+        session.commit()
+    session.rollback()
 
     assert first_total == 2
-    assert second_total == 4
-    assert session.query(PointsLedger).count() == 2
-    assert get_total_points(session, user.id) == 4
+    assert session.query(Engagement).count() == 1
+    assert session.query(PointsLedger).count() == 1
+    assert get_total_points(session, user.id) == 2
 
 
 def test_matrix_change_immutability(session):
@@ -139,3 +145,98 @@ def test_superchat_multiplier(session):
     assert total == 40
     row = session.query(PointsLedger).filter_by(engagement_id=engagement.id).one()
     assert row.points_delta == 40
+
+
+def test_rebuild_points_balances(session):
+    from sqlalchemy import update
+    from app.models import UserPointsBalance
+    from app.utils.points import rebuild_points_balances
+
+    user = User(username="erin")
+    session.add(user)
+    session.commit()
+    session.add_all([
+        PointsLedger(user_id=user.id, points_delta=7, reason="test", timestamp=datetime.utcnow()),
+        PointsLedger(user_id=user.id, points_delta=3, reason="test", timestamp=datetime.utcnow()),
+    ])
+    session.commit()
+    assert get_total_points(session, user.id) == 10
+    assert rebuild_points_balances(session) == {}
+
+    session.execute(
+        update(UserPointsBalance).where(UserPointsBalance.user_id == user.id).values(total=4)
+    )
+    session.commit()
+
+    assert rebuild_points_balances(session, apply=False) == {user.id: (4, 10)}
+    assert get_total_points(session, user.id) == 4
+    assert rebuild_points_balances(session) == {user.id: (4, 10)}
+    assert get_total_points(session, user.id) == 10
+
+
+def test_matrix_provider_caches_table_rules(session):
+    from sqlalchemy import event
+    from app.models import PointsMatrix
+    from app.utils.points import PointsMatrixProvider
+
+    now = [0.0]
+    provider = PointsMatrixProvider({"POINT_MATRIX": {"COMMENT": 3, "LIKE": 4}}, clock=lambda: now[0])
+    session.add(PointsMatrix(event_type=EventType.COMMENT, value=7))
+    session.commit()
+
+    rules = provider.rules(session)
+    # The table wins over the config, which wins over the defaults
+    assert {name: rule(None) for name, rule in rules.items()} == {
+        "COMMENT": 7, "LIKE": 4, "SUPERCHAT": 10, "LIVESTREAM_CHAT": 1,
+    }
+
+    statements = []
+    event.listen(session.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    assert provider.rules(session) is rules
+    assert statements == []
+
+    # A commit in this process invalidates at once
+    session.query(PointsMatrix).filter_by(event_type=EventType.COMMENT).update({"value": 9})
+    session.commit()
+    assert provider.rules(session)["COMMENT"](None) == 9
+
+    # Past the check interval an unchanged version costs one lookup, no reload
+    now[0] += 60
+    statements.clear()
+    assert provider.rules(session)["COMMENT"](None) == 9
+    assert len(statements) == 1
+
+
+def test_apply_points_bulk(session):
+    from sqlalchemy import event
+    from app.utils.points import apply_points_bulk
+
+    alice = User(username="frank")
+    bob = User(username="grace")
+    session.add_all([alice, bob])
+    session.commit()
+    bob_first = Engagement(user_id=bob.id, event_type=EventType.LIKE, event_id="b0", timestamp=datetime.utcnow())
+    session.add(bob_first)
+    session.commit()
+
+    app = Flask(__name__)
+    app.config["POINT_MATRIX"] = {"COMMENT": 3, "LIKE": 1}
+    with app.app_context():
+        apply_points(bob, bob_first)
+        engagements = [
+            Engagement(user_id=alice.id, event_type=EventType.COMMENT, event_id="a1", timestamp=datetime.utcnow()),
+            Engagement(user_id=alice.id, event_type=EventType.LIKE, event_id="a2", timestamp=datetime.utcnow()),
+            Engagement(user_id=bob.id, event_type=EventType.COMMENT, event_id="b1", timestamp=datetime.utcnow()),
+        ]
+        session.add_all(engagements)
+        commits = []
+        event.listen(session, "after_commit", lambda s: commits.append(s))
+        totals = apply_points_bulk(session, engagements)
+
+    assert totals == {alice.id: 4, bob.id: 4}
+    assert len(commits) == 1
+    assert get_total_points(session, alice.id) == 4
+    rows = session.query(PointsLedger).filter(PointsLedger.engagement_id.in_([e.id for e in engagements]))
+    assert sorted(row.points_delta for row in rows) == [1, 3, 3]
+    assert session.query(PointsLedger).count() == 4
+    assert apply_points_bulk(session, []) == {}
@@ -22,3 +22,120 @@ def test_quiz_generation(tmp_path):
     assert 'question' in data
     assert 'options' in data
     assert isinstance(data['options'], list)
+
+
+def test_transcript_index_roundtrip(tmp_path):
+    from app.utils.quiz import TranscriptIndex, load_index, save_index
+
+    index = TranscriptIndex.from_text('the cat saw the other cat, then the dog')
+    assert index.vocab == ['the', 'cat', 'saw', 'other', 'then', 'dog']
+    assert index.freqs == [3, 2, 1, 1, 1, 1]
+    assert index.word(4) == 'other'
+
+    path = str(tmp_path / 'c.idx')
+    save_index(index, path)
+    loaded = load_index(path)
+    assert loaded.vocab == index.vocab
+    assert loaded.freqs == index.freqs
+    assert list(loaded.tokens) == list(index.tokens)
+
+
+def test_quiz_uses_index_and_reupload_invalidates(tmp_path):
+    app = create_app()
+    app.config.update({'TESTING': True})
+    from app import routes
+    from app.utils import quiz
+    routes.TRANSCRIPTS_DIR = tmp_path
+    client = app.test_client()
+
+    client.post('/api/upload_transcript/c1', data='alpha beta gamma delta')
+    assert (tmp_path / 'c1.idx').exists()
+    assert quiz.get_index(str(tmp_path / 'c1.txt')).vocab == ['alpha', 'beta', 'gamma', 'delta']
+
+    client.post('/api/upload_transcript/c1', data='one two three four five')
+    data = client.get('/api/quiz/c1').get_json()
+    assert set(data['options']) <= {'one', 'two', 'three', 'four', 'five'}
+    assert len(data['options']) == 4
+
+
+def test_index_builder_handles_split_words():
+    from app.utils.quiz import TranscriptIndex, TranscriptIndexBuilder
+
+    text = 'streaming uploads split words across chunk boundaries, sometimes twice'
+    builder = TranscriptIndexBuilder()
+    for start in range(0, len(text), 5):
+        builder.feed(text[start:start + 5])
+    index = builder.finish()
+    expected = TranscriptIndex.from_text(text)
+    assert index.vocab == expected.vocab
+    assert list(index.tokens) == list(expected.tokens)
+
+
+def test_streaming_upload_gzip_and_limits(tmp_path):
+    import gzip
+
+    app = create_app()
+    app.config.update({'TESTING': True, 'TRANSCRIPT_MAX_BYTES': 64})
+    from app import routes
+    routes.TRANSCRIPTS_DIR = tmp_path
+    client = app.test_client()
+
+    text = 'gzip compressed transcript body'
+    res = client.post(
+        '/api/upload_transcript/gz',
+        data=gzip.compress(text.encode()),
+        headers={'Content-Encoding': 'gzip'},
+    )
+    assert res.status_code == 200
+    assert (tmp_path / 'gz.txt').read_text(encoding='utf-8') == text
+
+    bomb = gzip.compress(b'word ' * 1000)
+    res = client.post('/api/upload_transcript/big', data=bomb, headers={'Content-Encoding': 'gzip'})
+    assert res.status_code == 413
+    res = client.post('/api/upload_transcript/big', data='x' * 100)
+    assert res.status_code == 413
+    res = client.post('/api/upload_transcript/big', data='not gzip', headers={'Content-Encoding': 'gzip'})
+    assert res.status_code == 400
+    res = client.post('/api/upload_transcript/big', data='')
+    assert res.status_code == 400
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['gz.idx', 'gz.txt']
+
+
+def test_generate_questions_seeded_and_bounded():
+    import random
+    from app.utils.quiz import TranscriptIndex, generate_question, generate_questions
+
+    index = TranscriptIndex.from_text('red red red red green blue yellow')
+    first = generate_questions(index, 20, random.Random(7))
+    second = generate_questions(index, 20, random.Random(7))
+    assert first == second
+    assert len(first) == 20
+    for question in first:
+        assert sorted(question['options']) == ['blue', 'green', 'red', 'yellow']
+
+    # Plenty of words but too few distinct ones must not spin
+    assert generate_question('same same same same same') == {
+        'question': 'Transcript too short',
+        'options': [],
+    }
+
+
+def test_quiz_batch_endpoint(tmp_path):
+    app = create_app()
+    app.config.update({'TESTING': True, 'QUIZ_MAX_COUNT': 5})
+    from app import routes
+    routes.TRANSCRIPTS_DIR = tmp_path
+    client = app.test_client()
+    client.post('/api/upload_transcript/b1', data='one two three four five six seven')
+
+    data = client.get('/api/quiz/b1?count=3&seed=42').get_json()
+    assert data['seed'] == 42
+    assert len(data['questions']) == 3
+    assert client.get('/api/quiz/b1?count=3&seed=42').get_json() == data
+
+    data = client.get('/api/quiz/b1?count=100').get_json()
+    assert len(data['questions']) == 5
+    replay = client.get(f"/api/quiz/b1?count=100&seed={data['seed']}").get_json()
+    assert replay == data
+
+    assert client.get('/api/quiz/missing?count=2').get_json()['questions'] == []
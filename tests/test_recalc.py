@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta
+
+from app.db import init_db
+from app.models import (
+    Engagement,
+    EventType,
+    PointsLedger,
+    PointsMatrix,
+    PointsRecalcJob,
+    User,
+    get_total_points,
+)
+from app.recalc import RecalcEngine
+
+
+class QueueExecutor:
+    """Collect submitted jobs so tests decide when (and on which thread) they run."""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args):
+        self.calls.append((fn, args))
+
+    def run_all(self):
+        calls, self.calls = self.calls, []
+        for fn, args in calls:
+            fn(*args)
+
+
+def _seed(Session, users=5):
+    session = Session()
+    now = datetime.utcnow()
+    for n in range(users):
+        user = User(username=f'user{n}')
+        session.add(user)
+        session.flush()
+        for kind, points in ((EventType.COMMENT, 5), (EventType.LIKE, 2)):
+            engagement = Engagement(
+                user_id=user.id, event_type=kind, event_id=f'{kind.name}-{n}', timestamp=now
+            )
+            session.add(engagement)
+            session.add(PointsLedger(
+                user_id=user.id, engagement=engagement, points_delta=points,
+                reason=kind.name, timestamp=now,
+            ))
+    session.add(PointsMatrix(event_type=EventType.COMMENT, value=8))
+    session.commit()
+    session.close()
+
+
+def test_recalc_applies_new_matrix_in_chunks():
+    Session = init_db('sqlite:///:memory:')
+    _seed(Session)
+    executor = QueueExecutor()
+    engine = RecalcEngine(Session, chunk_size=2, executor=executor)
+
+    job_id = engine.submit('COMMENT')
+    assert engine.progress(job_id)['status'] == 'pending'
+    executor.run_all()
+
+    assert engine.progress(job_id) == {
+        'id': job_id, 'event_type': 'COMMENT', 'status': 'done',
+        'processed': 5, 'total': 5, 'error': None,
+    }
+    session = Session()
+    assert [get_total_points(session, uid) for uid in range(1, 6)] == [10] * 5
+    # Adjustments are appended; the original rows stay untouched
+    assert session.query(PointsLedger).count() == 15
+    session.close()
+
+    # Running again under the same matrix changes nothing
+    executor.run_all()
+    engine.run(engine.submit('COMMENT', dispatch=False))
+    session = Session()
+    assert session.query(PointsLedger).count() == 15
+    session.close()
+
+
+def test_concurrent_requests_share_pending_job():
+    Session = init_db('sqlite:///:memory:')
+    _seed(Session, users=1)
+    executor = QueueExecutor()
+    engine = RecalcEngine(Session, executor=executor)
+
+    first = engine.submit(EventType.COMMENT)
+    assert engine.submit('COMMENT') == first
+    assert engine.submit('LIKE') != first
+    assert len(executor.calls) == 2
+
+    # Once the job is running a new change needs a fresh pass
+    session = Session()
+    session.query(PointsRecalcJob).filter_by(id=first).update({'status': 'running'})
+    session.commit()
+    session.close()
+    assert engine.submit('COMMENT') != first
+    # ...which must wait for the live run to finish
+    assert engine.run(executor.calls[-1][1][0]) is False
+
+
+def test_interrupted_job_resumes_from_last_user():
+    Session = init_db('sqlite:///:memory:')
+    _seed(Session, users=4)
+    engine = RecalcEngine(Session, chunk_size=2, stale_after=60, executor=QueueExecutor())
+    job_id = engine.submit('COMMENT', dispatch=False)
+
+    # A worker is still running the job
+    session = Session()
+    job = session.get(PointsRecalcJob, job_id)
+    job.status = 'running'
+    job.updated_at = datetime.utcnow()
+    session.commit()
+    session.close()
+    assert engine.run(job_id) is False  # still looks alive
+
+    # ...then dies after committing its first chunk
+    session = Session()
+    engine._recalculate(session, EventType.COMMENT, [1, 2])
+    job = session.get(PointsRecalcJob, job_id)
+    job.last_user_id = 2
+    job.processed = 2
+    job.total = 4
+    job.updated_at = datetime.utcnow() - timedelta(minutes=5)
+    session.commit()
+    session.close()
+
+    assert engine.resume_pending() == [job_id]
+    engine._executor.run_all()
+
+    session = Session()
+    assert [get_total_points(session, uid) for uid in range(1, 5)] == [10] * 4
+    job = session.get(PointsRecalcJob, job_id)
+    assert (job.status, job.processed, job.total) == ('done', 4, 4)
+    session.close()
@@ -61,5 +61,86 @@ def test_init_socket_events(monkeypatch):
     event, data, room = socketio.emits[0]
     assert event == 'leaderboard'
     assert room == 'public'
-    assert data[0]['name'] == 'alice'
-    assert data[0]['points'] == 10
+    # The first broadcast is a snapshot
+    assert 'base_version' not in data
+    assert data['size'] == 2
+    assert data['entries'][0] == {'rank': 1, 'name': 'alice', 'points': 10}
+
+    # Clients that miss a diff ask for a snapshot, which the broadcasting
+    # process serves from the board its next diff will be based on
+    sent = []
+    monkeypatch.setattr('app.socket_events.emit', lambda event, data: sent.append((event, data)))
+    socketio.handlers['leaderboard_snapshot']()
+    assert sent == [('leaderboard', data)]
+
+
+def test_leaderboard_only_emits_changes(monkeypatch):
+    from app.leaderboard import LeaderboardTracker, board_version, snapshot
+
+    board = [{'name': 'alice', 'points': 10}, {'name': 'bob', 'points': 5}]
+    tracker = LeaderboardTracker()
+    first = tracker.update(board)
+    assert first == snapshot(board) and first['version'] == board_version(list(board))
+    assert tracker.update(list(board)) is None
+
+    diff = tracker.update([{'name': 'alice', 'points': 10}, {'name': 'carol', 'points': 7}, {'name': 'bob', 'points': 5}])
+    assert diff == {
+        'version': tracker.version,
+        'base_version': first['version'],
+        'size': 3,
+        'entries': [
+            {'rank': 2, 'name': 'carol', 'points': 7},
+            {'rank': 3, 'name': 'bob', 'points': 5},
+        ],
+    }
+    assert tracker.snapshot()['entries'][0] == {'rank': 1, 'name': 'alice', 'points': 10}
+    # Any process reading the same board gives it the same version
+    assert snapshot(tracker.board)['version'] == diff['version']
+
+    tracker.reset()
+    assert 'base_version' not in tracker.update(board)
+
+
+def test_points_update_buffer_coalesces():
+    from app.realtime import PointsUpdateBuffer
+
+    class Clock:
+        now = 0.0
+
+        def __call__(self):
+            return self.now
+
+    clock = Clock()
+    socketio = DummySocketIO()
+    buffer = PointsUpdateBuffer(socketio, window=1.0, clock=clock)
+    buffer.push(1, 5)
+    buffer.push(1, 7)
+    buffer.push(2, 3)
+    assert socketio.emits == []
+
+    clock.now = 1.5
+    buffer.push(1, 9)
+    assert socketio.emits == [
+        ('points_update', {'user_id': 1, 'total': 9}, 'user:1'),
+        ('points_update', {'user_id': 2, 'total': 3}, 'user:2'),
+    ]
+    buffer.flush()
+    assert len(socketio.emits) == 2
+
+
+def test_local_message_queue_fans_out_to_every_server():
+    from benchmarks.socketio_fanout import run_local
+
+    result = run_local(workers=3, clients=4, messages=5, timeout=10)
+    assert result['complete'] is True
+    assert result['delivered'] == 3 * 4 * 5
+
+
+def test_socketio_options():
+    from app.realtime import LocalPubSubManager, socketio_options
+
+    assert socketio_options(None) == {}
+    assert socketio_options('redis://localhost:6379/0') == {'message_queue': 'redis://localhost:6379/0'}
+    manager = socketio_options('local://events')['client_manager']
+    assert isinstance(manager, LocalPubSubManager)
+    assert manager.channel == 'events'
@@ -0,0 +1,321 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from app import tasks
+from app.db import init_db
+from app.models import Engagement, EventType, OAuth, PointsLedger, User, get_total_points
+from app.utils.activity import pack_activity
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+        self.headers = {}
+
+    def execute(self):
+        return self.result
+
+
+class FakeYouTube:
+    def __init__(self, items):
+        self.items = items
+
+    def subscriptions(self):
+        return self
+
+    def activities(self):
+        return self
+
+    def list(self, **kwargs):
+        return FakeRequest({"items": self.items})
+
+
+def _activity(event_id, etype="comment"):
+    return {"id": event_id, "snippet": {"type": etype}}
+
+
+@pytest.fixture()
+def Session():
+    return init_db('sqlite:///:memory:')
+
+
+@pytest.fixture(autouse=True)
+def service_cache(monkeypatch):
+    cache = tasks.YouTubeServiceCache()
+    monkeypatch.setattr(tasks, 'SERVICE_CACHE', cache)
+    return cache
+
+
+def _add_user(Session, name):
+    session = Session()
+    user = User(username=name)
+    session.add(user)
+    session.commit()
+    session.add(OAuth(provider='youtube', token=json.dumps({'access_token': name}), user_id=user.id))
+    session.commit()
+    user_id = user.id
+    session.close()
+    return user_id
+
+
+def test_ingest_activities_skips_known_and_repeated(Session):
+    user_id = _add_user(Session, 'alice')
+    session = Session()
+    session.add(Engagement(user_id=user_id, event_type=EventType.COMMENT, event_id='old', timestamp=datetime.utcnow()))
+    session.commit()
+
+    items = [_activity('old'), _activity('a'), _activity('a'), _activity('b', 'like'), _activity('c', 'upload'), {}]
+    assert tasks._ingest_activities(session, user_id, items) == 2
+    session.commit()
+
+    assert {e.event_id for e in session.query(Engagement)} == {'old', 'a', 'b'}
+    stored = session.query(Engagement).filter_by(event_id='b').one()
+    assert stored.raw_json is None and stored.activity == _activity('b', 'like')
+    assert session.query(PointsLedger).count() == 2
+    assert get_total_points(session, user_id) == tasks.RULES['COMMENT'] + tasks.RULES['LIKE']
+    session.close()
+
+
+def test_update_engagements_commits_per_user(Session, monkeypatch):
+    alice = _add_user(Session, 'alice')
+    bob = _add_user(Session, 'bob')
+    feeds = {
+        'alice': [_activity('a1'), _activity('a2', 'like')],
+        'bob': [_activity('b1', 'superchat')],
+    }
+    monkeypatch.setattr(tasks, '_build_youtube_service', lambda token, timeout=None: FakeYouTube(feeds[token['access_token']]))
+
+    class Emitter:
+        def __init__(self):
+            self.emits = []
+
+        def emit(self, event, data, room=None):
+            self.emits.append((event, data, room))
+
+    socketio = Emitter()
+    tasks._update_engagements(None, Session, socketio)
+    tasks._update_engagements(None, Session, socketio)
+
+    session = Session()
+    assert session.query(Engagement).count() == 3
+    assert get_total_points(session, alice) == tasks.RULES['COMMENT'] + tasks.RULES['LIKE']
+    assert get_total_points(session, bob) == tasks.RULES['SUPERCHAT']
+    session.close()
+    assert ('points_update', {'user_id': bob, 'total': tasks.RULES['SUPERCHAT']}, f'user:{bob}') in socketio.emits
+    assert len(socketio.emits) == 2
+
+
+def test_callable_rules_score_compact_rows(Session, monkeypatch):
+    from flask import Flask
+
+    from app.recalc import RecalcEngine
+    from app.utils.points import PointsMatrixProvider
+
+    bob = _add_user(Session, 'bob')
+    item = {'id': 's1', 'snippet': {'type': 'superchat'}, 'amount': 4}
+    monkeypatch.setattr(tasks, '_build_youtube_service', lambda token, timeout=None: FakeYouTube([item]))
+
+    def _multiplier(e):
+        return json.loads(e.raw_json)['amount'] * 10
+
+    app = Flask(__name__)
+    app.config.update(POINT_MATRIX={'SUPERCHAT': _multiplier}, ENGAGEMENT_STORAGE='compact')
+    tasks._update_engagements(app, Session)
+
+    session = Session()
+    stored = session.query(Engagement).one()
+    assert stored.raw_json is None and stored.activity == item
+    assert get_total_points(session, bob) == 40
+    session.close()
+
+    item['amount'] = 5
+    session = Session()
+    session.query(Engagement).update({Engagement.activity_blob: pack_activity(item, 's1')[2]})
+    session.commit()
+    session.close()
+    engine = RecalcEngine(Session, provider=PointsMatrixProvider(app.config))
+    engine.run(engine.submit('SUPERCHAT', dispatch=False))
+    session = Session()
+    assert get_total_points(session, bob) == 50
+    session.close()
+
+
+def test_update_engagements_skips_failed_polls(Session, monkeypatch):
+    alice = _add_user(Session, 'alice')
+    _add_user(Session, 'bob')
+
+    def build(token, timeout=None):
+        if token['access_token'] == 'bob':
+            raise TimeoutError('slow user')
+        return FakeYouTube([_activity('a1')])
+
+    monkeypatch.setattr(tasks, '_build_youtube_service', build)
+    tasks._update_engagements(None, Session)
+
+    session = Session()
+    assert [e.user_id for e in session.query(Engagement)] == [alice]
+    session.close()
+
+
+def test_scheduler_job_never_overlaps(Session):
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.config['YOUTUBE_POLL_INTERVAL'] = 30
+    scheduler = tasks.init_scheduler(app, Session)
+    try:
+        job = scheduler.get_jobs()[0]
+        assert job.max_instances == 1
+        assert job.coalesce is True
+        assert job.trigger.interval.total_seconds() == 30
+    finally:
+        scheduler.shutdown(wait=False)
+
+
+def test_service_cache_reuses_until_token_changes(service_cache, monkeypatch):
+    built = []
+
+    def build(token, timeout=None):
+        built.append(token['access_token'])
+        return object()
+
+    monkeypatch.setattr(tasks, '_build_youtube_service', build)
+    first = service_cache.get(1, {'access_token': 'a'})
+    assert service_cache.get(1, {'access_token': 'a'}) is first
+    assert service_cache.get(1, {'access_token': 'b'}) is not first
+    service_cache.get(2, {'access_token': 'c'})
+    service_cache.retain([2])
+
+    assert built == ['a', 'b', 'c']
+    assert service_cache.stats() == {'hits': 1, 'misses': 3, 'size': 1}
+
+
+def test_build_youtube_service_uses_bundled_discovery(monkeypatch):
+    pytest.importorskip('googleapiclient')
+    import httplib2
+
+    def offline(*args, **kwargs):
+        raise AssertionError('network access while building the service')
+
+    monkeypatch.setattr(httplib2.Http, 'request', offline)
+    service = tasks._build_youtube_service({'access_token': 'x'}, timeout=5)
+    assert service.activities() is not None
+
+
+class NotModified(Exception):
+    class resp:
+        status = 304
+
+
+class PagedYouTube:
+    """Serves pages newest-first and honours pageToken / If-None-Match."""
+
+    def __init__(self, pages, etag='v1'):
+        self.pages = pages
+        self.etag = etag
+        self.requests = []
+
+    def activities(self):
+        return self
+
+    def list(self, pageToken=None, **params):
+        service = self
+
+        class Request:
+            def __init__(self):
+                self.headers = {}
+
+            def execute(self):
+                service.requests.append((pageToken, params, dict(self.headers)))
+                if self.headers.get('If-None-Match') == service.etag:
+                    raise NotModified()
+                index = int(pageToken or 0)
+                resp = {'etag': service.etag, 'items': service.pages[index]}
+                if index + 1 < len(service.pages):
+                    resp['nextPageToken'] = str(index + 1)
+                return resp
+
+        return Request()
+
+
+def _published(event_id, day):
+    return {'id': event_id, 'snippet': {'type': 'comment', 'publishedAt': f'2024-05-{day:02d}T12:00:00Z'}}
+
+
+def test_fetch_activities_stops_at_known_items():
+    service = PagedYouTube([
+        [_published('e5', 5), _published('e4', 4)],
+        [_published('e3', 3), _published('e2', 2)],
+        [_published('e1', 1)],
+    ])
+    cursor = {'last_published_at': datetime(2024, 5, 3, 12)}
+    items, cursor = tasks._fetch_activities(service, cursor)
+
+    # The cursor's own second is fetched again; ingestion skips known ids
+    assert [item['id'] for item in items] == ['e5', 'e4', 'e3']
+    assert cursor['last_published_at'] == datetime(2024, 5, 5, 12)
+    assert cursor['page_token'] is None
+    assert len(service.requests) == 2
+    assert service.requests[0][1]['publishedAfter'] == '2024-05-03T12:00:00Z'
+
+    items, _ = tasks._fetch_activities(service, cursor)
+    assert items == []
+    assert service.requests[-1][2] == {'If-None-Match': 'v1'}
+
+
+def test_activities_in_the_cursor_second_are_not_lost(Session):
+    user_id = _add_user(Session, 'alice')
+    session = Session()
+    seen = _published('a', 1)
+    items, cursor = tasks._fetch_activities(PagedYouTube([[seen]]), None)
+    assert tasks._ingest_activities(session, user_id, items) == 1
+
+    # 'b' was published in the same second as 'a', but after the last poll
+    service = PagedYouTube([[_published('b', 1), seen]], etag='v2')
+    items, cursor = tasks._fetch_activities(service, cursor)
+    assert [item['id'] for item in items] == ['b', 'a']
+    assert tasks._ingest_activities(session, user_id, items) == 1
+    session.commit()
+    assert {e.event_id for e in session.query(Engagement)} == {'a', 'b'}
+    session.close()
+
+
+def test_fetch_activities_resumes_unfinished_sweep():
+    service = PagedYouTube([
+        [_published('e3', 3)],
+        [_published('e2', 2)],
+        [_published('e1', 1)],
+    ])
+    items, cursor = tasks._fetch_activities(service, None, max_pages=2)
+    assert [item['id'] for item in items] == ['e3', 'e2']
+    assert cursor['page_token'] == '2'
+    assert cursor.get('last_published_at') is None
+    assert cursor['sweep_published_at'] == datetime(2024, 5, 3, 12)
+
+    items, cursor = tasks._fetch_activities(service, cursor, max_pages=2)
+    assert [item['id'] for item in items] == ['e1']
+    assert cursor['page_token'] is None
+    assert cursor['last_published_at'] == datetime(2024, 5, 3, 12)
+
+
+def test_update_engagements_persists_cursor(Session, monkeypatch):
+    from app.models import YouTubeSyncCursor
+
+    alice = _add_user(Session, 'alice')
+    service = PagedYouTube([[_published('e2', 2), _published('e1', 1)]])
+    service.subscriptions = lambda: FakeYouTube([])
+    monkeypatch.setattr(tasks, '_build_youtube_service', lambda token, timeout=None: service)
+
+    tasks._update_engagements(None, Session)
+    tasks._update_engagements(None, Session)
+
+    session = Session()
+    cursor = session.get(YouTubeSyncCursor, alice)
+    assert cursor.last_published_at == datetime(2024, 5, 2, 12)
+    assert cursor.etag == 'v1'
+    assert session.query(Engagement).count() == 2
+    session.close()
+    assert len(service.requests) == 2
+    assert service.requests[1][2] == {'If-None-Match': 'v1'}